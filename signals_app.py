@@ -15,7 +15,7 @@ from dotenv import load_dotenv
 from genai import FunctionTemplate
 from genai import MessageTemplate
 from genai.eyfs import TextGenerator
-from genai.message_history import InMemoryMessageHistory
+from genai.message_history import SummaryMessageHistory
 from genai.message_history import TokenCounter
 
 
@@ -284,8 +284,8 @@ def signals_bot() -> None:
     if "messages" not in st.session_state:
         # Record of messages to display on the app
         st.session_state.messages = []
-        # Record of messages to send to the LLM
-        st.session_state["memory"] = InMemoryMessageHistory()
+        # Record of messages to send to the LLM, older turns are summarised in the background
+        st.session_state["memory"] = SummaryMessageHistory()
         st.session_state["messages_intent"] = []
         st.session_state["messages_signal"] = []
         # Keep track of which state we're in
@@ -436,20 +436,13 @@ def signals_bot() -> None:
                 except AttributeError:
                     return m
 
-            cost_input = (
-                TokenCounter._count_tokens_from_messages(
-                    messages=[transform_message(m) for m in message_history], model_name=selected_model
-                )
-                * 0.01
-                / 1000
-            )
-            cost_output = (
-                TokenCounter._count_tokens_from_messages(
-                    messages=[{"role": "assistant", "content": full_response}], model_name=selected_model
-                )
-                * 0.03
-                / 1000
+            # Count the prompt and the response in one batch
+            num_tokens = TokenCounter.count_message_tokens(
+                [transform_message(m) for m in message_history] + [{"role": "assistant", "content": full_response}],
+                model_name=selected_model,
             )
+            cost_input = (num_tokens[:-1].sum() + TokenCounter.tokens_per_reply) * 0.01 / 1000
+            cost_output = (num_tokens[-1] + TokenCounter.tokens_per_reply) * 0.03 / 1000
             cost_total = cost_input + cost_output
             print(f"Total cost: {cost_total}")  # noqa: T001
 
@@ -1,3 +1,6 @@
+from .local_index import LocalIndex
+from .local_index import LocalVectorIndex
 from .prompt_template import FunctionTemplate
 from .prompt_template import MessageTemplate
 from .vector_index import PineconeIndex
+from .vector_index import get_vector_index
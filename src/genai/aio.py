@@ -0,0 +1,84 @@
+"""Process-wide async plumbing for the OpenAI calls.
+
+OpenAI's async client opens a new `aiohttp.ClientSession` per request unless `openai.aiosession` is set.
+This module keeps a single pooled, keep-alive session per event loop and a background event loop so that
+blocking code can delegate to the async API without spinning up a loop per call.
+"""
+import asyncio
+import atexit
+import threading
+
+from typing import AsyncIterator
+from typing import Awaitable
+from typing import Dict
+from typing import Iterator
+from typing import Optional
+from typing import TypeVar
+
+import aiohttp
+
+
+T = TypeVar("T")
+
+# Max number of open connections in the pool and how long idle connections are kept alive (in seconds)
+POOL_SIZE = 100
+KEEPALIVE_TIMEOUT = 30
+
+_sessions: Dict[asyncio.AbstractEventLoop, aiohttp.ClientSession] = {}
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+
+def get_aiosession() -> aiohttp.ClientSession:
+    """Return the pooled session bound to the running event loop, creating it if needed."""
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(limit=POOL_SIZE, keepalive_timeout=KEEPALIVE_TIMEOUT, ttl_dns_cache=300)
+        session = aiohttp.ClientSession(connector=connector)
+        _sessions[loop] = session
+
+    return session
+
+
+async def close_aiosession() -> None:
+    """Close the pooled session bound to the running event loop."""
+    session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None and not session.closed:
+        await session.close()
+
+
+def _background_loop() -> asyncio.AbstractEventLoop:
+    """Return the event loop running in a daemon thread, starting it on first use."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="genai-aio", daemon=True).start()
+
+    return _loop
+
+
+def run_sync(coro: Awaitable[T]) -> T:
+    """Run a coroutine on the background event loop and block until it returns."""
+    return asyncio.run_coroutine_threadsafe(coro, _background_loop()).result()
+
+
+async def _anext(aiterator: AsyncIterator[T]) -> T:
+    return await aiterator.__anext__()
+
+
+def iter_sync(aiterator: AsyncIterator[T]) -> Iterator[T]:
+    """Iterate over an async iterator that lives on the background event loop."""
+    while True:
+        try:
+            yield run_sync(_anext(aiterator))
+        except StopAsyncIteration:
+            return
+
+
+@atexit.register
+def _shutdown() -> None:
+    """Close the background loop's session so aiohttp does not warn about unclosed connections."""
+    if _loop is not None and _loop.is_running():
+        asyncio.run_coroutine_threadsafe(close_aiosession(), _loop).result(timeout=5)
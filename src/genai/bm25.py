@@ -0,0 +1,167 @@
+"""In-process BM25 index for lexical retrieval next to the vector indexes.
+
+Term weights are precomputed at build time and stored as compressed sparse rows (one posting list of
+(document, weight) pairs per term), so a query only sums the posting lists of its terms.
+
+Usage: Build the index of the documents in a snapshot from the repo root directory
+$ python src/genai/bm25.py snapshots/eyfs-index.npz .cache/bm25/eyfs-index.npz
+"""
+import json
+import os
+import re
+import sys
+
+from collections import Counter
+from typing import List
+from typing import Optional
+
+import numpy as np
+
+from genai.index_snapshot import IndexSnapshot
+from genai.local_index import matches_filter
+
+
+STOPWORDS = frozenset(
+    """a an and are as at be but by can do for from has have how i if in is it its my of on or our should so
+    that the their them there they this to was we what when where which who will with you your""".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase the text and split it into words, dropping stopwords."""
+    return [token for token in re.findall(r"\w+", text.lower()) if token not in STOPWORDS]
+
+
+class BM25Index:
+    """Okapi BM25 index over the documents of a vector index."""
+
+    def __init__(
+        self,
+        ids: List[str],
+        metadata: List[dict],
+        vocabulary: List[str],
+        indptr: np.ndarray,
+        docs: np.ndarray,
+        weights: np.ndarray,
+    ) -> None:
+        """Initialise the index from its posting lists. Use `BM25Index.build` to index documents."""
+        self.ids = ids
+        self.metadata = metadata
+        self.vocabulary = vocabulary
+        self.term_ids = {term: i for i, term in enumerate(vocabulary)}
+        self.indptr = indptr
+        self.docs = docs
+        self.weights = weights
+
+    @classmethod
+    def build(
+        cls, ids: List[str], texts: List[str], metadata: List[dict], k1: float = 1.5, b: float = 0.75
+    ) -> "BM25Index":
+        """Index documents.
+
+        Parameters
+        ----------
+        ids
+            Document ids, the same as in the vector index.
+
+        texts
+            Document texts.
+
+        metadata
+            Document metadata, used to filter results.
+
+        k1
+            Term frequency saturation.
+
+        b
+            Document length normalisation.
+
+        """
+        vocabulary = {}
+        term_ids, doc_ids, frequencies, lengths = [], [], [], []
+        for doc, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths.append(len(tokens))
+            for term, frequency in Counter(tokens).items():
+                term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+                doc_ids.append(doc)
+                frequencies.append(frequency)
+
+        term_ids = np.array(term_ids, dtype=np.int64)
+        order = np.argsort(term_ids, kind="stable")
+        docs = np.array(doc_ids, dtype=np.int32)[order]
+        tf = np.array(frequencies, dtype=np.float32)[order]
+        lengths = np.array(lengths, dtype=np.float32)
+
+        df = np.bincount(term_ids, minlength=len(vocabulary))
+        idf = np.log1p((len(texts) - df + 0.5) / (df + 0.5)).astype(np.float32)
+        norm = k1 * (1 - b + b * lengths / max(lengths.mean() if len(lengths) else 0.0, 1.0))
+        weights = idf[term_ids[order]] * tf * (k1 + 1) / (tf + norm[docs])
+
+        indptr = np.concatenate([[0], np.cumsum(df)]).astype(np.int64)
+        return cls(list(ids), list(metadata), list(vocabulary), indptr, docs, weights.astype(np.float32))
+
+    @classmethod
+    def from_snapshot(cls, snapshot: IndexSnapshot, text_field: str = "text") -> "BM25Index":
+        """Index the documents of a vector index snapshot that have a text."""
+        rows = [i for i, metadata in enumerate(snapshot.metadata) if isinstance(metadata.get(text_field), str)]
+        return cls.build(
+            [snapshot.ids[i] for i in rows],
+            [snapshot.metadata[i][text_field] for i in rows],
+            [snapshot.metadata[i] for i in rows],
+        )
+
+    def search(self, query: str, top_k: int = 10, filter: Optional[dict] = None) -> List[dict]:
+        """Return the `top_k` best matching documents that match the metadata filter, best first."""
+        terms = [self.term_ids[term] for term in set(tokenize(query)) if term in self.term_ids]
+        if not terms:
+            return []
+
+        docs = np.concatenate([self.docs[self.indptr[t] : self.indptr[t + 1]] for t in terms])
+        weights = np.concatenate([self.weights[self.indptr[t] : self.indptr[t + 1]] for t in terms])
+        candidates, inverse = np.unique(docs, return_inverse=True)
+        scores = np.bincount(inverse, weights=weights)
+
+        matches = []
+        for i in np.argsort(-scores, kind="stable"):
+            doc = candidates[i]
+            if filter and not matches_filter(self.metadata[doc], filter):
+                continue
+            matches.append({"id": self.ids[doc], "score": float(scores[i]), "metadata": self.metadata[doc]})
+            if len(matches) == top_k:
+                break
+        return matches
+
+    def save(self, path: str) -> None:
+        """Write the index to a `.npz` file."""
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                ids=np.array(self.ids, dtype=str),
+                metadata=np.array(json.dumps(self.metadata, default=str)),
+                vocabulary=np.array(json.dumps(self.vocabulary)),
+                indptr=self.indptr,
+                docs=self.docs,
+                weights=self.weights,
+            )
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        """Read an index written with `save`."""
+        with np.load(path, allow_pickle=False) as data:
+            return cls(
+                ids=data["ids"].tolist(),
+                metadata=json.loads(str(data["metadata"])),
+                vocabulary=json.loads(str(data["vocabulary"])),
+                indptr=data["indptr"],
+                docs=data["docs"],
+                weights=data["weights"],
+            )
+
+
+if "__main__" == __name__:
+    snapshot_path, output_path = sys.argv[1:3]
+    BM25Index.from_snapshot(IndexSnapshot.load(snapshot_path)).save(output_path)
@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from typing import Any
+from typing import Optional
+
+
+class ResponseCache:
+    """Disk-backed cache with size-bounded LRU eviction and a TTL.
+
+    Entries live in a local SQLite database in WAL mode, so a hit is a single indexed lookup
+    and the cache can be shared by several processes on the same machine.
+    """
+
+    def __init__(
+        self,
+        path: str = ".cache/openai_responses.sqlite",
+        max_size_bytes: int = 256 * 1024**2,
+        ttl: Optional[float] = 30 * 24 * 60 * 60,
+    ) -> None:
+        """Open (or create) the cache.
+
+        Parameters
+        ----------
+        path
+            Path to the SQLite file.
+
+        max_size_bytes
+            Total size of the stored values above which the least recently used entries are evicted.
+
+        ttl
+            Seconds after which an entry expires. None means entries never expire.
+
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.max_size_bytes = max_size_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)")
+
+    @staticmethod
+    def make_key(**request) -> str:
+        """Hash a request into a canonical key. Dict ordering and whitespace do not matter."""
+        canonical = json.dumps(request, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value or None if it is missing or expired."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, created_at FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+
+            value, created_at = row
+            if self.ttl is not None and now - created_at > self.ttl:
+                self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                return None
+
+            self._conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+
+        return json.loads(value)
+
+    def set(self, key: str, value: Any) -> None:
+        """Store a JSON-serialisable value and evict the least recently used entries if needed."""
+        serialised = json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, serialised, len(serialised), now, now),
+            )
+            self._evict()
+
+    def _evict(self) -> None:
+        """Drop expired entries, then the least recently used ones until the cache fits in max_size_bytes."""
+        if self.ttl is not None:
+            self._conn.execute("DELETE FROM entries WHERE created_at < ?", (time.time() - self.ttl,))
+
+        total_size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total_size <= self.max_size_bytes:
+            return
+
+        to_free = total_size - self.max_size_bytes
+        keys = []
+        for key, size in self._conn.execute("SELECT key, size FROM entries ORDER BY accessed_at"):
+            keys.append((key,))
+            to_free -= size
+            if to_free <= 0:
+                break
+
+        self._conn.executemany("DELETE FROM entries WHERE key = ?", keys)
+
+    def clear(self) -> None:
+        """Remove all entries."""
+        with self._lock:
+            self._conn.execute("DELETE FROM entries")
+
+    def __len__(self) -> int:
+        """Return the number of entries."""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import time
+
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+from typing import Deque
+from typing import Optional
+
+from openai.error import APIError
+from openai.error import RateLimitError
+from openai.error import ServiceUnavailableError
+from openai.error import Timeout
+
+
+logger = logging.getLogger(__name__)
+
+
+def is_overload_error(e: Exception) -> bool:
+    """Return True if the error means the API is overloaded or throttling us (429, 5xx, timeouts)."""
+    if isinstance(e, (RateLimitError, ServiceUnavailableError, Timeout)):
+        return True
+    return isinstance(e, APIError) and (e.http_status or 0) >= 500
+
+
+class AdaptiveConcurrencyLimiter:
+    """Limit the number of in-flight requests and adapt the limit AIMD style.
+
+    The limit grows by one for every `limit` successful requests (additive increase) and is multiplied
+    by `backoff` when a request is throttled, fails with a 5xx or when the smoothed latency exceeds
+    `latency_tolerance` times the best latency observed so far (multiplicative decrease). The limit
+    is decreased at most once per round trip so a burst of errors counts as a single congestion event.
+
+    A single instance is meant to be shared by all tasks running on an event loop.
+    """
+
+    def __init__(
+        self,
+        initial_limit: int = 4,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        backoff: float = 0.5,
+        latency_tolerance: float = 2.0,
+        smoothing: float = 0.2,
+    ) -> None:
+        """Initialise the limiter.
+
+        Parameters
+        ----------
+        initial_limit
+            Number of concurrent requests to start with.
+
+        min_limit
+            Lowest number of concurrent requests.
+
+        max_limit
+            Highest number of concurrent requests.
+
+        backoff
+            Factor applied to the limit on congestion.
+
+        latency_tolerance
+            Ratio between the smoothed and the best latency above which the limit is decreased.
+
+        smoothing
+            Weight of the latest sample in the exponentially weighted moving average of the latency.
+
+        """
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.smoothing = smoothing
+        self.in_flight = 0
+        self.latency: Optional[float] = None
+        self.min_latency: Optional[float] = None
+        self._last_decrease = 0.0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    async def acquire(self) -> None:
+        """Wait for a free slot."""
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            # The slot was handed over right before the cancellation, give it back
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+
+    def release(self) -> None:
+        """Free a slot and wake up waiting tasks."""
+        self.in_flight -= 1
+        self._wake_up()
+
+    def _wake_up(self) -> None:
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """Hold a slot for the duration of a request and adapt the limit to its outcome."""
+        await self.acquire()
+        start = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            if is_overload_error(e):
+                self._decrease()
+            raise
+        else:
+            self._on_success(time.monotonic() - start)
+        finally:
+            self.release()
+
+    def _on_success(self, latency: float) -> None:
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency = (1 - self.smoothing) * self.latency + self.smoothing * latency
+        # Let the baseline drift up slowly so that a lasting slowdown of the API does not pin the limit down
+        if self.min_latency is None:
+            self.min_latency = self.latency
+        else:
+            self.min_latency = min(self.min_latency * (1 + self.smoothing / 10), self.latency)
+
+        if self.latency > self.latency_tolerance * self.min_latency:
+            self._decrease()
+        else:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def _decrease(self) -> None:
+        now = time.monotonic()
+        if now - self._last_decrease < (self.latency or 1.0):
+            return
+
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * self.backoff)
+        logger.debug(f"Concurrency limit decreased to {self.limit:.1f}")
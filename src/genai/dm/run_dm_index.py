@@ -1,15 +1,20 @@
 """Build a pinecone index with the Development Matters learning goals and examples."""
 
 import os
-import uuid
 
+from typing import List
+
+import numpy as np
 import openai
 
 from dotenv import load_dotenv
 
-from genai.eyfs import get_embedding
+from genai.embedding_cache import EmbeddingCache
+from genai.eyfs import get_embeddings
+from genai.eyfs import set_embedding_cache
+from genai.index_manifest import content_id
 from genai.utils import read_json
-from genai.vector_index import PineconeIndex
+from genai.vector_index import get_vector_index
 
 
 load_dotenv()
@@ -19,37 +24,52 @@ openai.api_key = os.environ["OPENAI_API_KEY"]
 PATH_TO_DM = "src/genai/dm/dm.json"
 INDEX_NAME = "eyfs-index"
 ENCODER_NAME = "text-embedding-ada-002"
+# Only new or changed texts are sent to the API on rebuilds
+EMBEDDING_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH", ".cache/embeddings")
+
+
+def embed(items: List[dict]) -> np.ndarray:
+    """Encode the text of the items in batched requests."""
+    return get_embeddings([item["text"] for item in items], model=ENCODER_NAME)
+
 
 if "__main__" == __name__:
+    set_embedding_cache(EmbeddingCache(EMBEDDING_CACHE_PATH))
+
     data = read_json(PATH_TO_DM)
     # Temp hack to exclude the template
     data = [d for d in data if d["area_of_learning"] != ""]
 
-    # Format the data to what pinecone needs and generate a temp uuid
-    docs = []
+    # Collect the items and their metadata
+    items = []
     for elem in data:
         aol = elem["area_of_learning"]
         d = elem["age_group"]
         for age, age_dict in d.items():
-            for k, items in age_dict.items():
-                for item in items:
-                    doc = tuple(
-                        (
-                            str(uuid.uuid4()),
-                            get_embedding(item),
-                            {
-                                "age_group": age,
-                                "type_": k,
-                                "source": "dm",
-                                "text": item,
-                                "areas_of_learning": aol,
-                            },
-                        )
+            for k, texts in age_dict.items():
+                for item in texts:
+                    items.append(
+                        {
+                            "age_group": age,
+                            "type_": k,
+                            "source": "dm",
+                            "text": item,
+                            "areas_of_learning": aol,
+                        }
                     )
-                    docs.append(doc)
+
+    # Derive stable ids from the content, only new or changed items are encoded and upserted
+    docs = [
+        (
+            content_id(item["source"], item["areas_of_learning"], item["age_group"], item["type_"], item["text"]),
+            None,
+            item,
+        )
+        for item in items
+    ]
 
     # Build the index
-    conn = PineconeIndex(api_key=os.environ["PINECONE_API_KEY"], environment=os.environ["PINECONE_REGION"])
+    conn = get_vector_index(api_key=os.environ.get("PINECONE_API_KEY"), environment=os.environ.get("PINECONE_REGION"))
 
     conn.build_and_upsert(
         index_name=INDEX_NAME,
@@ -58,4 +78,7 @@ if "__main__" == __name__:
         docs=docs,
         metadata_config={"indexed": ["areas_of_learning", "source", "type_", "age_group"]},
         batch_size=40,
+        manifest="dm",
+        embed=embed,
+        namespace="dm",
     )
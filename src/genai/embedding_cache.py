@@ -0,0 +1,173 @@
+import fcntl
+import hashlib
+import json
+import os
+import threading
+
+from contextlib import contextmanager
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+
+
+INDEX_DTYPE = np.dtype([("key", "<u8"), ("row", "<i8")])
+
+
+def normalise_text(text: str) -> str:
+    """Collapse whitespace so texts that only differ in spacing or newlines share an embedding."""
+    return " ".join(text.split())
+
+
+def text_key(text: str) -> int:
+    """Return the 64-bit content hash of the normalised text."""
+    digest = hashlib.blake2b(normalise_text(text).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+class _ModelStore:
+    """Memory-mapped vectors and sorted key index of one embedding model."""
+
+    def __init__(self, directory: str, model: str) -> None:
+        self.vectors_path = os.path.join(directory, f"{model}.f32")
+        self.index_path = os.path.join(directory, f"{model}.idx.npy")
+        self.meta_path = os.path.join(directory, f"{model}.json")
+        self.vectors: Optional[np.ndarray] = None
+        self.index = np.empty(0, dtype=INDEX_DTYPE)
+        self.dimension: Optional[int] = None
+        self._version: Optional[Tuple[int, int]] = None
+
+    def refresh(self) -> None:
+        """Re-open the files if another writer has updated them."""
+        try:
+            stat = os.stat(self.index_path)
+        except FileNotFoundError:
+            return
+
+        version = (stat.st_mtime_ns, stat.st_size)
+        if version == self._version:
+            return
+
+        with open(self.meta_path, "r") as f:
+            self.dimension = json.load(f)["dimension"]
+        self.index = np.load(self.index_path, mmap_mode="r")
+        # Only map whole rows, a crashed writer may have left a partial one at the end
+        num_rows = os.path.getsize(self.vectors_path) // (4 * self.dimension)
+        self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(num_rows, self.dimension))
+        self._version = version
+
+    def lookup(self, keys: np.ndarray) -> np.ndarray:
+        """Return the row of each key in the vectors file, or -1 when it is missing."""
+        rows = np.full(len(keys), -1, dtype=np.int64)
+        if not len(self.index):
+            return rows
+
+        sorted_keys = self.index["key"]
+        positions = np.minimum(np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)
+        found = sorted_keys[positions] == keys
+        rows[found] = self.index["row"][positions[found]]
+        return rows
+
+
+class EmbeddingCache:
+    """Content-addressed embedding store on local disk.
+
+    Each model has an append-only float32 file of vectors and a compact index of (64-bit text hash, row)
+    pairs sorted by hash. Both are memory-mapped, so lookups are a binary search with no deserialisation
+    and several processes can share the same files read-only. Writers take a file lock and replace the
+    index atomically, so readers always see a consistent snapshot.
+    """
+
+    def __init__(self, path: str = ".cache/embeddings") -> None:
+        """Open (or create) the store in the `path` directory."""
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self._stores: Dict[str, _ModelStore] = {}
+        self._lock = threading.Lock()
+
+    def _store(self, model: str) -> _ModelStore:
+        if model not in self._stores:
+            self._stores[model] = _ModelStore(self.path, model)
+        store = self._stores[model]
+        store.refresh()
+        return store
+
+    @contextmanager
+    def _write_lock(self) -> Iterator[None]:
+        with self._lock, open(os.path.join(self.path, ".lock"), "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def get(self, text: str, model: str = "text-embedding-ada-002") -> Optional[np.ndarray]:
+        """Return the cached embedding of a text or None."""
+        embeddings, found = self.get_many([text], model)
+        return embeddings[0] if found[0] else None
+
+    def get_many(self, texts: List[str], model: str = "text-embedding-ada-002") -> Tuple[np.ndarray, np.ndarray]:
+        """Look up many texts at once.
+
+        Returns
+        -------
+        embeddings
+            A float32 matrix with one row per text. Rows of missing texts are zeros.
+
+        found
+            A boolean mask of the texts that were found.
+
+        """
+        store = self._store(model)
+        keys = np.array([text_key(text) for text in texts], dtype=np.uint64)
+        rows = store.lookup(keys)
+        found = rows >= 0
+        embeddings = np.zeros((len(texts), store.dimension or 0), dtype=np.float32)
+        if found.any():
+            embeddings[found] = store.vectors[rows[found]]
+        return embeddings, found
+
+    def put_many(self, texts: List[str], embeddings: np.ndarray, model: str = "text-embedding-ada-002") -> None:
+        """Append the embeddings of texts that are not stored yet."""
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        with self._write_lock():
+            store = self._store(model)
+            if store.dimension is None:
+                store.dimension = embeddings.shape[1]
+                with open(store.meta_path, "w") as f:
+                    json.dump({"dimension": store.dimension}, f)
+
+            keys = np.array([text_key(text) for text in texts], dtype=np.uint64)
+            keys, first = np.unique(keys, return_index=True)
+            new = store.lookup(keys) < 0
+            if not new.any():
+                return
+
+            # Count rows from the file itself, so rows orphaned by an interrupted write are skipped over, and cut
+            # a partial row left by a crash so that new rows start at a row boundary
+            num_rows = 0
+            if os.path.exists(store.vectors_path):
+                size = os.path.getsize(store.vectors_path)
+                num_rows = size // (4 * store.dimension)
+                if size != num_rows * 4 * store.dimension:
+                    os.truncate(store.vectors_path, num_rows * 4 * store.dimension)
+            with open(store.vectors_path, "ab") as f:
+                f.write(embeddings[first[new]].tobytes())
+
+            added = np.empty(int(new.sum()), dtype=INDEX_DTYPE)
+            added["key"] = keys[new]
+            added["row"] = np.arange(num_rows, num_rows + len(added))
+            index = np.concatenate([np.asarray(store.index), added])
+            index = index[np.argsort(index["key"], kind="stable")]
+
+            tmp_path = f"{store.index_path}.tmp.npy"
+            np.save(tmp_path, index)
+            os.replace(tmp_path, store.index_path)
+            store.refresh()
+
+    def __len__(self) -> int:
+        """Return the number of stored embeddings across models."""
+        return sum(len(store.index) for store in self._stores.values())
@@ -1,3 +1,5 @@
 from .eyfs import EYFSClassifier
 from .eyfs import TextGenerator
 from .eyfs import get_embedding
+from .eyfs import get_embeddings
+from .eyfs import set_embedding_cache
@@ -1,14 +1,20 @@
-import asyncio
 import json
 import logging
+import os
 import string
 
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator
+from typing import Callable
 from typing import Dict
+from typing import Iterable
+from typing import Iterator
 from typing import List
 from typing import Optional
 from typing import Union
 
 import aiofiles
+import numpy as np
 import openai
 
 from openai.error import APIConnectionError
@@ -16,6 +22,7 @@ from openai.error import APIError
 from openai.error import RateLimitError
 from openai.error import ServiceUnavailableError
 from openai.error import Timeout
+from openai.util import convert_to_openai_object
 from tenacity import before_sleep_log
 from tenacity import retry
 from tenacity import retry_if_exception_type
@@ -23,13 +30,31 @@ from tenacity import stop_after_attempt
 from tenacity import wait_exponential
 
 from genai import MessageTemplate
+from genai.aio import get_aiosession
+from genai.aio import iter_sync
+from genai.aio import run_sync
+from genai.cache import ResponseCache
+from genai.concurrency import AdaptiveConcurrencyLimiter
+from genai.embedding_cache import EmbeddingCache
+from genai.rate_limiter import count_embedding_tokens
+from genai.rate_limiter import estimate_chat_tokens
+from genai.rate_limiter import estimate_embedding_tokens
+from genai.rate_limiter import rate_limiter
+from genai.singleflight import SingleFlight
 
 
 logger = logging.getLogger(__name__)
 
 
 class TextGenerator:
-    """Generate tokens using OpenAI's API."""
+    """Generate tokens using OpenAI's API.
+
+    Set `TextGenerator.cache` to a `ResponseCache` to serve repeated requests from local disk.
+    Concurrent identical calls to `generate` are coalesced by `TextGenerator.single_flight`; set it to None to opt out.
+    """
+
+    cache: Optional[ResponseCache] = None
+    single_flight: Optional[SingleFlight] = SingleFlight()
 
     @classmethod
     def generate(
@@ -38,8 +63,9 @@ class TextGenerator:
         message_kwargs: Optional[Dict] = None,
         model: str = "gpt-3.5-turbo",
         temperature: float = 0.0,
+        use_async: bool = False,
         **openai_kwargs,
-    ) -> Union[Dict, str]:
+    ) -> Union[Dict, Iterator[Dict]]:
         """Generate text using OpenAI's API.
 
         More details on the API and messages: https://platform.openai.com/docs/guides/gpt/chat-completions-api
@@ -60,11 +86,14 @@ class TextGenerator:
             temperature
                 The sampling temperature.
 
+            use_async
+                Delegate the request to the async client, which reuses the process-wide pooled HTTP session.
+
             openai_kwargs
                 Keyword arguments to pass to the OpenAI API.
 
         Returns:
-            A dictionary containing the response from the API.
+            A dictionary containing the response from the API, or an iterator of chunks when `stream=True`.
 
         """
         if not message_kwargs:
@@ -72,7 +101,70 @@ class TextGenerator:
 
         messages = [cls.prepare_message(message, **message_kwargs) for message in messages]
 
-        response = cls._call(
+        request = dict(messages=messages, temperature=temperature, model=model, **openai_kwargs)
+
+        def call() -> Union[Dict, Iterator[Dict]]:
+            if use_async:
+                response = run_sync(_cached_acall(cls.cache, cls._acall, **request))
+                if request.get("stream"):
+                    return iter_sync(response)
+                return response
+
+            return _cached_call(cls.cache, cls._call, **request)
+
+        if cls.single_flight is None:
+            return call()
+
+        # Concurrent identical requests share one upstream call
+        key = ResponseCache.make_key(**request)
+        if request.get("stream"):
+            return cls.single_flight.do_stream(key, call)
+        return cls.single_flight.do(key, call)
+
+    @classmethod
+    async def agenerate(
+        cls,
+        messages: List[Union[str, Dict]],
+        message_kwargs: Optional[Dict] = None,
+        model: str = "gpt-3.5-turbo",
+        temperature: float = 0.0,
+        **openai_kwargs,
+    ) -> Union[Dict, AsyncIterator[Dict]]:
+        """Generate text using async OpenAI's API.
+
+        Requests go through a pooled, keep-alive HTTP session that is shared by every call on the event loop.
+
+        Args:
+            messages
+                A list of messages to send to the API. They can be:
+                - dictionaries
+                - str (JSON file path)
+                - instances of classes that inherit from BasePromptTemplate
+
+            message_kwargs
+                A dictionary of keyword arguments to pass to the messages.
+
+            model
+                The OpenAI model to use.
+
+            temperature
+                The sampling temperature.
+
+            openai_kwargs
+                Keyword arguments to pass to the OpenAI API.
+
+        Returns:
+            A dictionary containing the response from the API, or an async iterator of chunks when `stream=True`.
+
+        """
+        if not message_kwargs:
+            message_kwargs = {}
+
+        messages = [cls.prepare_message(message, **message_kwargs) for message in messages]
+
+        response = await _cached_acall(
+            cls.cache,
+            cls._acall,
             messages=messages,
             temperature=temperature,
             model=model,
@@ -114,6 +206,10 @@ class TextGenerator:
         temperature: float = 0.0,
         **kwargs,
     ) -> Dict:
+        rate_limiter.acquire(
+            kwargs["model"],
+            estimate_chat_tokens(messages, kwargs["model"], kwargs.get("max_tokens"), kwargs.get("functions")),
+        )
         response = openai.ChatCompletion.create(
             messages=messages,
             temperature=temperature,
@@ -122,6 +218,43 @@ class TextGenerator:
 
         return response  # type: ignore
 
+    @staticmethod
+    @retry(
+        retry(
+            reraise=True,
+            stop=stop_after_attempt(6),
+            wait=wait_exponential(multiplier=1, min=1, max=60),
+            retry=(
+                retry_if_exception_type(Timeout)
+                | retry_if_exception_type(APIError)
+                | retry_if_exception_type(APIConnectionError)
+                | retry_if_exception_type(RateLimitError)
+                | retry_if_exception_type(ServiceUnavailableError)
+            ),
+            before_sleep=before_sleep_log(logger, logging.WARNING),
+        )
+    )
+    async def _acall(
+        messages: List[Dict],
+        temperature: float = 0.0,
+        **kwargs,
+    ) -> Union[Dict, AsyncIterator[Dict]]:
+        # Respect a session set by the caller, otherwise reuse the pooled one
+        if openai.aiosession.get() is None:
+            openai.aiosession.set(get_aiosession())
+
+        await rate_limiter.aacquire(
+            kwargs["model"],
+            estimate_chat_tokens(messages, kwargs["model"], kwargs.get("max_tokens"), kwargs.get("functions")),
+        )
+        response = await openai.ChatCompletion.acreate(
+            messages=messages,
+            temperature=temperature,
+            **kwargs,
+        )
+
+        return response  # type: ignore
+
     @staticmethod
     def _extract_placeholders(s: str) -> List[str]:
         """Extract placeholder variables that can be filled in an f-string."""
@@ -130,7 +263,13 @@ class TextGenerator:
 
 
 class EYFSClassifier:
-    """Classify text to EYFS areas of learning."""
+    """Classify text to EYFS areas of learning.
+
+    Set `EYFSClassifier.cache` to a `ResponseCache` to serve repeated requests from local disk.
+    """
+
+    cache: Optional[ResponseCache] = None
+    concurrency_limiter = AdaptiveConcurrencyLimiter()
 
     @classmethod
     def generate(
@@ -173,7 +312,9 @@ class EYFSClassifier:
 
         messages = [cls.prepare_message(message, **message_kwargs) for message in messages]
 
-        response = cls._call(
+        response = _cached_call(
+            cls.cache,
+            cls._call,
             messages=messages,
             temperature=temperature,
             model=model,
@@ -221,6 +362,9 @@ class EYFSClassifier:
         temperature: float = 0.0,
         **kwargs,
     ) -> Dict:
+        rate_limiter.acquire(
+            model, estimate_chat_tokens(messages, model, kwargs.get("max_tokens"), kwargs.get("functions"))
+        )
         response = openai.ChatCompletion.create(
             messages=messages,
             model=model,
@@ -237,13 +381,15 @@ class EYFSClassifier:
         message_kwargs: Optional[Dict] = None,
         model: str = "gpt-3.5-turbo",
         temperature: float = 0.0,
-        concurrency: int = 10,
         **openai_kwargs,
     ) -> Dict:
         """Generate text using async OpenAI's API.
 
         More details on the API and messages: https://platform.openai.com/docs/guides/gpt/chat-completions-api
 
+        The number of in-flight requests is limited by `EYFSClassifier.concurrency_limiter`, which is shared
+        by all calls and adapts to the API's latency and error rates.
+
         Args:
             messages
                 A list of messages to send to the API. They can be:
@@ -259,34 +405,31 @@ class EYFSClassifier:
             openai_kwargs
                 Keyword arguments to pass to the OpenAI API.
 
-            concurrency:
-                The number of concurrent requests to make.
-
         Returns:
             A dictionary containing the response from the API.
 
         """
-        semaphore = asyncio.Semaphore(concurrency)
-        async with semaphore:
-            if not message_kwargs:
-                message_kwargs = {}
+        if not message_kwargs:
+            message_kwargs = {}
 
-            messages = [cls.prepare_message(message, **message_kwargs) for message in messages]
+        messages = [cls.prepare_message(message, **message_kwargs) for message in messages]
 
-            response = await cls._acall(
-                messages=messages,
-                temperature=temperature,
-                model=model,
-                **openai_kwargs,
-            )
+        response = await _cached_acall(
+            cls.cache,
+            cls._acall,
+            messages=messages,
+            temperature=temperature,
+            model=model,
+            **openai_kwargs,
+        )
 
-            response = response["choices"][0]["message"]["function_call"]["arguments"]
-            parsed_response = await cls._parse_json(response)
-            if parsed_response:
-                parsed_response["url"] = message_kwargs["url"]
-                return parsed_response
+        response = response["choices"][0]["message"]["function_call"]["arguments"]
+        parsed_response = await cls._parse_json(response)
+        if parsed_response:
+            parsed_response["url"] = message_kwargs["url"]
+            return parsed_response
 
-            return message_kwargs["url"]
+        return message_kwargs["url"]
 
     @staticmethod
     @retry(
@@ -310,12 +453,19 @@ class EYFSClassifier:
         temperature: float = 0.0,
         **kwargs,
     ) -> Dict:
-        response = await openai.ChatCompletion.acreate(
-            messages=messages,
-            model=model,
-            temperature=temperature,
-            **kwargs,
+        if openai.aiosession.get() is None:
+            openai.aiosession.set(get_aiosession())
+
+        await rate_limiter.aacquire(
+            model, estimate_chat_tokens(messages, model, kwargs.get("max_tokens"), kwargs.get("functions"))
         )
+        async with EYFSClassifier.concurrency_limiter.slot():
+            response = await openai.ChatCompletion.acreate(
+                messages=messages,
+                model=model,
+                temperature=temperature,
+                **kwargs,
+            )
 
         return response  # type: ignore
 
@@ -347,7 +497,195 @@ class EYFSClassifier:
             await f.write(f"{json.dumps(item)}\n")
 
 
+def _cached_call(cache: Optional[ResponseCache], call: Callable, **request) -> Union[Dict, Iterator[Dict]]:
+    """Serve a request from the cache or make it and store the response. Streams are recorded as they are consumed."""
+    if cache is None:
+        return call(**request)
+
+    key = cache.make_key(**request)
+    cached = cache.get(key)
+    if cached is not None:
+        if request.get("stream"):
+            return (convert_to_openai_object(chunk) for chunk in cached)
+        return convert_to_openai_object(cached)
+
+    response = call(**request)
+    if request.get("stream"):
+        return _record_stream(cache, key, response)
+
+    cache.set(key, response)
+    return response
+
+
+def _record_stream(cache: ResponseCache, key: str, chunks: Iterator[Dict]) -> Iterator[Dict]:
+    """Yield the chunks and cache them once the stream has been fully consumed."""
+    recorded = []
+    for chunk in chunks:
+        recorded.append(chunk)
+        yield chunk
+
+    cache.set(key, recorded)
+
+
+async def _cached_acall(cache: Optional[ResponseCache], call: Callable, **request) -> Union[Dict, AsyncIterator[Dict]]:
+    """Async version of `_cached_call`."""
+    if cache is None:
+        return await call(**request)
+
+    key = cache.make_key(**request)
+    cached = cache.get(key)
+    if cached is not None:
+        if request.get("stream"):
+            return _areplay_stream(cached)
+        return convert_to_openai_object(cached)
+
+    response = await call(**request)
+    if request.get("stream"):
+        return _arecord_stream(cache, key, response)
+
+    cache.set(key, response)
+    return response
+
+
+async def _arecord_stream(cache: ResponseCache, key: str, chunks: AsyncIterator[Dict]) -> AsyncIterator[Dict]:
+    """Yield the chunks and cache them once the stream has been fully consumed."""
+    recorded = []
+    async for chunk in chunks:
+        recorded.append(chunk)
+        yield chunk
+
+    cache.set(key, recorded)
+
+
+async def _areplay_stream(chunks: List[Dict]) -> AsyncIterator[Dict]:
+    """Replay cached chunks as an async stream."""
+    for chunk in chunks:
+        yield convert_to_openai_object(chunk)
+
+
+# Concurrent requests to embed the same text share one upstream call
+_embedding_flight = SingleFlight()
+
+# Embeddings are looked up on local disk before calling the API when a cache is set
+embedding_cache: Optional[EmbeddingCache] = (
+    EmbeddingCache(os.environ["EMBEDDING_CACHE_PATH"]) if os.environ.get("EMBEDDING_CACHE_PATH") else None
+)
+
+
+def set_embedding_cache(cache: Optional[EmbeddingCache]) -> None:
+    """Set the embedding cache used by `get_embedding` and `get_embeddings`. None disables it."""
+    global embedding_cache
+    embedding_cache = cache
+
+
 def get_embedding(text: str, model: str = "text-embedding-ada-002") -> List[float]:
     """Encode text with OpenAI's text embedding model."""
     text = text.replace("\n", " ")
-    return openai.Embedding.create(input=[text], model=model)["data"][0]["embedding"]
+    if embedding_cache is not None:
+        cached = embedding_cache.get(text, model)
+        if cached is not None:
+            return cached.tolist()
+
+    return _embedding_flight.do(ResponseCache.make_key(input=text, model=model), lambda: _embed(text, model))
+
+
+def _embed(text: str, model: str) -> List[float]:
+    rate_limiter.acquire(model, estimate_embedding_tokens([text], model))
+    embedding = openai.Embedding.create(input=[text], model=model)["data"][0]["embedding"]
+    if embedding_cache is not None:
+        embedding_cache.put_many([text], np.array([embedding]), model)
+
+    return embedding
+
+
+def get_embeddings(
+    texts: Iterable[str],
+    model: str = "text-embedding-ada-002",
+    batch_size: int = 2048,
+    max_tokens_per_batch: int = 100000,
+    concurrency: int = 4,
+) -> np.ndarray:
+    """Encode many texts with OpenAI's text embedding model in as few requests as possible.
+
+    Duplicate texts are embedded once and texts found in the embedding cache are not sent. The remaining texts
+    are packed into requests of at most `batch_size` inputs and `max_tokens_per_batch` tokens, which are sent
+    concurrently.
+
+    Args:
+        texts
+            The texts to encode.
+
+        model
+            The OpenAI embedding model to use.
+
+        batch_size
+            Maximum number of inputs per request. The API accepts up to 2048.
+
+        max_tokens_per_batch
+            Maximum number of tokens per request.
+
+        concurrency
+            Number of requests in flight at once.
+
+    Returns:
+        A contiguous float32 matrix with one row per text, in the input order.
+
+    """
+    texts = [text.replace("\n", " ") for text in texts]
+    unique_texts = list(dict.fromkeys(texts))
+    if not unique_texts:
+        return np.empty((0, 0), dtype=np.float32)
+
+    row = {text: i for i, text in enumerate(unique_texts)}
+    if embedding_cache is not None:
+        unique_embeddings, found = embedding_cache.get_many(unique_texts, model)
+        missing_texts = [text for text, is_found in zip(unique_texts, found) if not is_found]
+        if not missing_texts:
+            return unique_embeddings[[row[text] for text in texts]]
+    else:
+        missing_texts = unique_texts
+
+    batches = []
+    current, current_tokens = [], 0
+    for text, num_tokens in zip(missing_texts, count_embedding_tokens(missing_texts, model).tolist()):
+        if current and (len(current) == batch_size or current_tokens + num_tokens > max_tokens_per_batch):
+            batches.append((current, current_tokens))
+            current, current_tokens = [], 0
+        current.append(text)
+        current_tokens += num_tokens
+    batches.append((current, current_tokens))
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda item: _embed_batch(item[0], model, item[1]), batches))
+
+    new_embeddings = np.concatenate(results)
+    if embedding_cache is not None:
+        embedding_cache.put_many(missing_texts, new_embeddings, model)
+        if len(missing_texts) < len(unique_texts):
+            unique_embeddings[~found] = new_embeddings
+            new_embeddings = unique_embeddings
+
+    return np.ascontiguousarray(new_embeddings[[row[text] for text in texts]], dtype=np.float32)
+
+
+@retry(
+    retry(
+        reraise=True,
+        stop=stop_after_attempt(6),
+        wait=wait_exponential(multiplier=1, min=1, max=60),
+        retry=(
+            retry_if_exception_type(Timeout)
+            | retry_if_exception_type(APIError)
+            | retry_if_exception_type(APIConnectionError)
+            | retry_if_exception_type(RateLimitError)
+            | retry_if_exception_type(ServiceUnavailableError)
+        ),
+        before_sleep=before_sleep_log(logger, logging.WARNING),
+    )
+)
+def _embed_batch(texts: List[str], model: str, num_tokens: Optional[int] = None) -> np.ndarray:
+    """Embed a batch of texts in a single request. `num_tokens` is counted if not given."""
+    rate_limiter.acquire(model, num_tokens if num_tokens is not None else estimate_embedding_tokens(texts, model))
+    data = openai.Embedding.create(input=texts, model=model)["data"]
+    data = sorted(data, key=lambda item: item["index"])
+    return np.array([item["embedding"] for item in data], dtype=np.float32)
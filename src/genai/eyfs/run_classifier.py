@@ -7,13 +7,12 @@ import time
 import openai
 import pandas as pd
 
-from aiohttp import ClientSession
 from dotenv import load_dotenv
 
 from genai import FunctionTemplate
 from genai import MessageTemplate
+from genai.aio import close_aiosession
 from genai.eyfs import EYFSClassifier
-from genai.utils import batch
 from genai.utils import create_directory_if_not_exists
 from genai.utils import read_json
 
@@ -54,8 +53,6 @@ def get_areas_of_learning(path: str) -> tuple:
 
 async def main() -> None:
     """Create prompts for path selection and infer paths."""
-    openai.aiosession.set(ClientSession())
-
     # Fetch the BBC activities
     activities_df = get_bbc_activities(os.environ["PATH_TO_BBC_ACTIVITIES_DATA"])
 
@@ -69,33 +66,34 @@ async def main() -> None:
     model = "gpt-3.5-turbo"
     temperature = 0.6
 
-    for i, batched_results in enumerate(batch(activities_df, 20)):
-        print(f"Batch {i} / {len(activities_df) // 20}")  # noqa: T001
-        tasks = [
-            EYFSClassifier.agenerate(
-                model=model,
-                temperature=temperature,
-                messages=[message],
-                message_kwargs={
-                    "areas_of_learning": areas_of_learning_text,
-                    "text": tup.text,
-                    "url": tup.URL,
-                },
-                functions=[function.to_prompt()],
-                function_call={"name": "predict_area_of_learning"},
-                max_tokens=100,
-                concurrency=5,
+    # Submit every activity at once, EYFSClassifier.concurrency_limiter adapts the number of in-flight requests
+    tasks = [
+        EYFSClassifier.agenerate(
+            model=model,
+            temperature=temperature,
+            messages=[message],
+            message_kwargs={
+                "areas_of_learning": areas_of_learning_text,
+                "text": tup.text,
+                "url": tup.URL,
+            },
+            functions=[function.to_prompt()],
+            function_call={"name": "predict_area_of_learning"},
+            max_tokens=100,
+        )
+        for tup in activities_df.itertuples()
+    ]
+
+    for i, future in enumerate(asyncio.as_completed(tasks)):
+        result = await future  # Get the result (waits if not ready)
+        await EYFSClassifier.write_line_to_file(result, OUTPUT_FILENAME)  # Write to the file
+        if i % 20 == 0:
+            print(  # noqa: T001
+                f"Classified {i} / {len(tasks)} "
+                f"(concurrency limit: {EYFSClassifier.concurrency_limiter.limit:.1f})"
             )
-            for tup in batched_results.itertuples()
-        ]
-
-        for future in asyncio.as_completed(tasks):
-            result = await future  # Get the result (waits if not ready)
-            await EYFSClassifier.write_line_to_file(result, OUTPUT_FILENAME)  # Write to the file
-
-        time.sleep(2)
 
-    await openai.aiosession.get().close()  # Close the http session at the end of the program
+    await close_aiosession()  # Close the pooled http session at the end of the program
 
 
 if "__main__" == __name__:
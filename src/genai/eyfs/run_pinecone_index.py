@@ -11,9 +11,11 @@ import pandas as pd
 
 from dotenv import load_dotenv
 
-from genai.eyfs import get_embedding
+from genai.embedding_cache import EmbeddingCache
+from genai.eyfs import get_embeddings
+from genai.eyfs import set_embedding_cache
 from genai.utils import read_jsonl_from_s3
-from genai.vector_index import PineconeIndex
+from genai.vector_index import get_vector_index
 
 
 load_dotenv()
@@ -22,6 +24,8 @@ load_dotenv()
 openai.api_key = os.environ["OPENAI_API_KEY"]
 INDEX_NAME = "eyfs-index"
 ENCODER_NAME = "text-embedding-ada-002"
+# Only new or changed texts are sent to the API on rebuilds
+EMBEDDING_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH", ".cache/embeddings")
 
 
 def get_labelled_bbc_activities(path: str) -> pd.DataFrame:
@@ -48,6 +52,8 @@ def get_bbc_activities(path: str) -> pd.DataFrame:
 
 def main() -> None:
     """Run the script."""
+    set_embedding_cache(EmbeddingCache(EMBEDDING_CACHE_PATH))
+
     # Read and merge dataframes
     labels = get_labelled_bbc_activities(os.environ["PATH_TO_LABELLED_BBC_DATA"])
     bbc = get_bbc_activities(os.environ["PATH_TO_BBC_ACTIVITIES_DATA"])
@@ -55,7 +61,8 @@ def main() -> None:
     df = labels.merge(bbc[["SHORT DESCRIPTION", "text", "URL", "title"]], how="left", left_on="URL", right_on="URL")
 
     # Encode the BBC activities' text
-    df["embedding"] = df["text"].apply(lambda row: get_embedding(row, model=ENCODER_NAME))
+    embeddings = get_embeddings(df["text"], model=ENCODER_NAME)
+    df["embedding"] = [embedding.tolist() for embedding in embeddings]
 
     # Batch items
     items = []
@@ -68,15 +75,21 @@ def main() -> None:
         items.append(item)
 
     # Build the index
-    conn = PineconeIndex(api_key=os.environ["PINECONE_API_KEY"], environment=os.environ["PINECONE_REGION"])
+    conn = get_vector_index(api_key=os.environ.get("PINECONE_API_KEY"), environment=os.environ.get("PINECONE_REGION"))
     conn.build_and_upsert(
         index_name=INDEX_NAME,
-        dimension=len(df["embedding"].iloc[0]),
+        dimension=embeddings.shape[1],
         metric="euclidean",
         docs=items,
         metadata_config={"indexed": ["areas_of_learning", "source", "type_", "age_group"]},
         batch_size=40,
+        # Only clears the BBC namespace, the other sources are kept
         delete_if_exists=True,
+        # Records the ids of the activities, which snapshot exports read as Pinecone cannot list them
+        manifest="BBC",
+        namespace="BBC",
+        # Remove the activities that earlier builds stored in the default namespace
+        legacy_filter={"source": {"$eq": "BBC"}},
     )
 
 
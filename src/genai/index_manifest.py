@@ -0,0 +1,174 @@
+"""Stable document ids and manifests for incremental index builds.
+
+A manifest records the (id, content hash) of every document a builder upserted in an index,
+so that a rebuild only embeds and upserts added or changed documents and deletes removed ones.
+Manifests are scoped by name, e.g. "dm" or "nhs", because several builders share an index, and by namespace,
+because the same docs can be stored in several namespaces.
+"""
+import hashlib
+import json
+import os
+import shutil
+
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+
+
+MANIFEST_PATH = os.environ.get("INDEX_MANIFEST_PATH", ".cache/index_manifests")
+
+
+def _digest(value: Any) -> str:
+    canonical = json.dumps(value, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def content_id(*parts: Any) -> str:
+    """Return a stable document id derived from the parts that identify it, e.g. its source and text."""
+    return _digest(parts)[:32]
+
+
+def content_hash(metadata: dict) -> str:
+    """Return the hash of a document's content."""
+    return _digest(metadata)
+
+
+class IndexManifest:
+    """The (id, content hash) of the documents a builder upserted in an index."""
+
+    def __init__(self, index_name: str, name: str, path: str = MANIFEST_PATH, namespace: Optional[str] = None) -> None:
+        """Load the manifest `name` of a namespace of the index, or start an empty one."""
+        self.path = os.path.join(path, index_name, namespace or "", f"{name}.json")
+        self.hashes: Dict[str, str] = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                self.hashes = json.load(f)
+
+    def diff(self, hashes: Dict[str, str]) -> Tuple[List[str], List[str]]:
+        """Return the ids that are new or whose content changed, and the ids that were removed."""
+        changed = [id_ for id_, hash_ in hashes.items() if self.hashes.get(id_) != hash_]
+        removed = [id_ for id_ in self.hashes if id_ not in hashes]
+        return changed, removed
+
+    def save(self, hashes: Dict[str, str]) -> None:
+        """Replace the manifest with the documents now in the index."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(hashes, f)
+        os.replace(tmp_path, self.path)
+        self.hashes = dict(hashes)
+
+    def delete(self) -> None:
+        """Forget the documents of the manifest, e.g. after clearing their namespace."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.hashes = {}
+
+    @staticmethod
+    def load_all(index_name: str, path: str = MANIFEST_PATH) -> Dict[str, Dict[str, str]]:
+        """Return the hashes of every manifest of an index by name, e.g. "dm" or "<namespace>/dm"."""
+        directory = os.path.join(path, index_name)
+        names = [
+            os.path.relpath(os.path.join(root, filename), directory)[: -len(".json")].replace(os.sep, "/")
+            for root, _, filenames in os.walk(directory)
+            for filename in filenames
+            if filename.endswith(".json")
+        ]
+        return {name: IndexManifest(index_name, name, path).hashes for name in sorted(names)}
+
+    @staticmethod
+    def restore_all(index_name: str, manifests: Dict[str, Dict[str, str]], path: str = MANIFEST_PATH) -> None:
+        """Save manifests returned by `load_all`, e.g. after importing a snapshot of the index."""
+        for name, hashes in manifests.items():
+            IndexManifest(index_name, name, path).save(hashes)
+
+    @staticmethod
+    def delete_all(index_name: str, path: str = MANIFEST_PATH) -> None:
+        """Forget every manifest of an index, e.g. after deleting it."""
+        shutil.rmtree(os.path.join(path, index_name), ignore_errors=True)
+
+
+def legacy_manifest(
+    index_name: str, name: str, namespace: Optional[str], path: str = MANIFEST_PATH
+) -> Optional[IndexManifest]:
+    """Return the manifest of docs an earlier build stored in the default namespace, before they got `namespace`.
+
+    Only returned on the first build of the namespace. Once the docs are upserted in the namespace, delete
+    the ids of the returned manifest from the default namespace, then the manifest itself.
+    """
+    if not namespace or os.path.exists(IndexManifest(index_name, name, path, namespace).path):
+        return None
+    manifest = IndexManifest(index_name, name, path)
+    return manifest if os.path.exists(manifest.path) else None
+
+
+def plan_upserts(
+    index_name: str,
+    docs: list,
+    manifest: Optional[str] = None,
+    embed: Optional[Callable[[List[dict]], np.ndarray]] = None,
+    manifest_path: str = MANIFEST_PATH,
+    namespace: Optional[str] = None,
+) -> Tuple[list, List[str], Optional[IndexManifest], Dict[str, str]]:
+    """Work out which docs to upsert and which ids to delete to bring an index up to date.
+
+    Parameters
+    ----------
+    index_name
+        Name of the index.
+
+    docs
+        (id, values, metadata) tuples. Values can be None when `embed` is given.
+
+    manifest
+        Name of the manifest of these docs. Without it, every doc is upserted and nothing is deleted.
+
+    embed
+        Function returning the embeddings of a list of metadata. Only called for the docs to upsert.
+
+    manifest_path
+        Directory of the manifests.
+
+    namespace
+        Namespace of the docs. Each namespace has its own manifests.
+
+    Returns
+    -------
+    to_upsert
+        The (id, values, metadata) tuples to upsert.
+
+    to_delete
+        The ids that are no longer in the docs.
+
+    index_manifest
+        The manifest to save once the index is updated.
+
+    hashes
+        The content hash of every doc, to save in the manifest.
+
+    """
+    hashes = {id_: content_hash(metadata) for id_, _, metadata in docs}
+    index_manifest = None
+    to_delete: List[str] = []
+    if manifest is not None:
+        index_manifest = IndexManifest(index_name, manifest, manifest_path, namespace)
+        changed, to_delete = index_manifest.diff(hashes)
+        changed = set(changed)
+        docs = [doc for doc in docs if doc[0] in changed]
+
+    missing = [i for i, (_, values, _) in enumerate(docs) if values is None]
+    if missing:
+        if embed is None:
+            raise ValueError("Docs without values need an `embed` function.")
+        embeddings = embed([docs[i][2] for i in missing])
+        docs = list(docs)
+        for i, embedding in zip(missing, embeddings):
+            docs[i] = (docs[i][0], np.asarray(embedding).tolist(), docs[i][2])
+
+    return docs, to_delete, index_manifest, hashes
@@ -0,0 +1,123 @@
+"""Export and import vector indexes as local snapshots.
+
+A snapshot is a single uncompressed `.npz` file with the ids, a float32 matrix of vectors, the metadata
+and the config of an index, plus its build manifests and the namespace of every vector. Loading it into
+a Pinecone or a local index needs no scraping and no embedding calls.
+
+Usage: Run the script from the repo root directory
+$ python src/genai/index_snapshot.py export eyfs-index snapshots/eyfs-index.npz
+$ python src/genai/index_snapshot.py export eyfs-index snapshots/eyfs-index.npz --ids ids.txt
+$ VECTOR_INDEX_BACKEND=local python src/genai/index_snapshot.py import eyfs-index snapshots/eyfs-index.npz
+"""
+import argparse
+import json
+import logging
+import os
+
+from dataclasses import dataclass
+from dataclasses import field
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Tuple
+
+import numpy as np
+
+
+@dataclass
+class IndexSnapshot:
+    """Contents of an index."""
+
+    ids: List[str]
+    vectors: np.ndarray
+    metadata: List[dict]
+    dimension: int
+    metric: str
+    metadata_config: dict = field(default_factory=dict)
+    manifests: Dict[str, Dict[str, str]] = field(default_factory=dict)
+    namespaces: List[str] = field(default_factory=list)
+
+    def save(self, path: str) -> None:
+        """Write the snapshot to a `.npz` file."""
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        config = {
+            "dimension": self.dimension,
+            "metric": self.metric,
+            "metadata_config": self.metadata_config,
+            "manifests": self.manifests,
+        }
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                ids=np.array(self.ids, dtype=str),
+                vectors=np.ascontiguousarray(self.vectors, dtype=np.float32).reshape(-1, self.dimension),
+                metadata=np.array(json.dumps(self.metadata, default=str)),
+                config=np.array(json.dumps(config)),
+                namespaces=np.array(self.namespaces or [""] * len(self.ids), dtype=str),
+            )
+
+    @classmethod
+    def load(cls, path: str) -> "IndexSnapshot":
+        """Read a snapshot written with `save`."""
+        with np.load(path, allow_pickle=False) as data:
+            config = json.loads(str(data["config"]))
+            return cls(
+                ids=data["ids"].tolist(),
+                vectors=data["vectors"],
+                metadata=json.loads(str(data["metadata"])),
+                namespaces=data["namespaces"].tolist() if "namespaces" in data else [],
+                **config,
+            )
+
+    def split(self) -> Dict[str, "IndexSnapshot"]:
+        """Return the snapshot of each namespace, "" being the default one."""
+        namespaces = self.namespaces or [""] * len(self.ids)
+        snapshots = {}
+        for namespace in sorted(set(namespaces)):
+            rows = [i for i, name in enumerate(namespaces) if name == namespace]
+            snapshots[namespace] = IndexSnapshot(
+                ids=[self.ids[i] for i in rows],
+                vectors=np.asarray(self.vectors)[rows],
+                metadata=[self.metadata[i] for i in rows],
+                dimension=self.dimension,
+                metric=self.metric,
+                metadata_config=self.metadata_config,
+            )
+        return snapshots
+
+    def docs(self) -> Iterator[Tuple[str, List[float], dict]]:
+        """Yield the (id, values, metadata) tuples to upsert."""
+        for id_, vector, metadata in zip(self.ids, self.vectors, self.metadata):
+            yield id_, vector.tolist(), metadata
+
+
+if "__main__" == __name__:
+    from dotenv import load_dotenv
+
+    from genai.vector_index import get_vector_index
+
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Export or import a vector index snapshot.")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("index_name")
+    parser.add_argument("path")
+    parser.add_argument("--delete-if-exists", action="store_true", help="Replace the index when importing.")
+    parser.add_argument(
+        "--ids", default=None, help="File with one id per line to export. Defaults to the ids of the manifests."
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    conn = get_vector_index()
+    if args.command == "export":
+        # Local indexes always export every vector
+        kwargs = {}
+        if args.ids:
+            with open(args.ids) as f:
+                kwargs["ids"] = [line.strip() for line in f if line.strip()]
+        conn.export_snapshot(args.index_name, args.path, **kwargs)
+    else:
+        conn.import_snapshot(args.index_name, args.path, delete_if_exists=args.delete_if_exists)
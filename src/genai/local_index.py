@@ -0,0 +1,826 @@
+"""In-process vector index with the same surface as `PineconeIndex` and `pinecone.Index`.
+
+Vectors are stored as a memory-mapped float32 matrix next to the ids and metadata columns,
+and queries are answered with vectorised NumPy scoring. Useful for offline work, tests and
+benchmarks, and to drop the network round trip of small corpora.
+
+Large corpora can add an inverted file (IVF) index: vectors are clustered with k-means and a
+query only scores the rows of its `nprobe` closest clusters.
+"""
+import json
+import os
+import shutil
+import time
+import uuid
+
+from functools import reduce
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Union
+
+import numpy as np
+
+from genai.index_manifest import IndexManifest
+from genai.index_manifest import legacy_manifest
+from genai.index_manifest import plan_upserts
+from genai.index_snapshot import IndexSnapshot
+
+
+class _IVF:
+    """Inverted file index: k-means centroids and the rows of each cluster, stored contiguously."""
+
+    def __init__(self, centroids: np.ndarray, metric: str) -> None:
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.metric = metric
+        self.offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+        self.rows = np.empty(0, dtype=np.int64)
+
+    @classmethod
+    def train(cls, vectors: np.ndarray, metric: str, nlist: int, iterations: int = 10, seed: int = 0) -> "_IVF":
+        """Cluster the vectors with k-means, on a sample of at most 256 vectors per cluster."""
+        rng = np.random.default_rng(seed)
+        nlist = max(1, min(nlist, len(vectors)))
+        sample = vectors[rng.choice(len(vectors), min(len(vectors), 256 * nlist), replace=False)]
+        sample = _prepare(np.asarray(sample, dtype=np.float32), metric)
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(iterations):
+            labels = _nearest_centroids(sample, centroids)
+            counts = np.bincount(labels, minlength=nlist)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            empty = counts == 0
+            centroids[~empty] = sums[~empty] / counts[~empty, None]
+            # Re-seed empty clusters with random vectors
+            centroids[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+            if metric == "cosine":
+                centroids = _prepare(centroids, metric)
+
+        ivf = cls(centroids, metric)
+        ivf.assign(vectors)
+        return ivf
+
+    def assign(self, vectors: np.ndarray) -> None:
+        """Put every row in the list of its closest centroid."""
+        labels = _nearest_centroids(_prepare(np.asarray(vectors, dtype=np.float32), self.metric), self.centroids)
+        self.rows = np.argsort(labels, kind="stable")
+        self.offsets[1:] = np.cumsum(np.bincount(labels, minlength=len(self.centroids)))
+
+    def probe(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        """Return the rows of the `nprobe` clusters closest to the query."""
+        nprobe = min(nprobe, len(self.centroids))
+        if self.metric == "dotproduct":
+            scores = self.centroids @ query
+        else:
+            query = _prepare(query[None, :], self.metric)[0]
+            scores = self.centroids @ query - 0.5 * np.einsum("ij,ij->i", self.centroids, self.centroids)
+        lists = np.argpartition(-scores, nprobe - 1)[:nprobe]
+        return np.concatenate([self.rows[self.offsets[i] : self.offsets[i + 1]] for i in lists])
+
+    def save(self, path: str) -> None:
+        with open(path, "wb") as f:
+            np.savez(f, centroids=self.centroids, offsets=self.offsets, rows=self.rows)
+
+    @classmethod
+    def load(cls, path: str, metric: str) -> "_IVF":
+        with np.load(path) as data:
+            ivf = cls(data["centroids"], metric)
+            ivf.offsets = data["offsets"]
+            ivf.rows = data["rows"]
+        return ivf
+
+
+def _condition_values(op: str, value: Any) -> set:
+    """Return the values a filter condition compares with."""
+    if op in ("$eq", "$ne"):
+        return {value}
+    if op in ("$in", "$nin"):
+        return set(value)
+    raise ValueError(f"Unsupported filter operator {op}.")
+
+
+def matches_filter(metadata: dict, filter: dict) -> bool:
+    """Return True if a document's metadata matches a Pinecone metadata filter."""
+    for field, condition in filter.items():
+        if field == "$and":
+            matched = all(matches_filter(metadata, sub_filter) for sub_filter in condition)
+        elif field == "$or":
+            matched = any(matches_filter(metadata, sub_filter) for sub_filter in condition)
+        else:
+            matched = True
+            cell = metadata.get(field)
+            for op, value in condition.items() if isinstance(condition, dict) else [("$eq", condition)]:
+                values = _condition_values(op, value)
+                found = any(v in values for v in cell) if isinstance(cell, list) else cell in values
+                matched &= found != (op in ("$ne", "$nin"))
+        if not matched:
+            return False
+    return True
+
+
+def _prepare(vectors: np.ndarray, metric: str) -> np.ndarray:
+    """Normalise the vectors for cosine similarity so that k-means clusters directions."""
+    if metric != "cosine":
+        return vectors
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def _nearest_centroids(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Return the index of the closest centroid (in euclidean distance) of every vector."""
+    half_norms = 0.5 * np.einsum("ij,ij->i", centroids, centroids)
+    labels = np.empty(len(vectors), dtype=np.int64)
+    # Chunk to bound the memory of the distance matrix
+    for start in range(0, len(vectors), 4096):
+        chunk = vectors[start : start + 4096]
+        labels[start : start + 4096] = np.argmax(chunk @ centroids.T - half_norms, axis=1)
+    return labels
+
+
+class LocalIndex:
+    """Query, upsert and delete vectors like a `pinecone.Index`.
+
+    Namespaces are stored as separate shards in the `namespaces` directory of the index, so a query or a
+    rebuild of one namespace never touches the vectors of the others.
+    """
+
+    def __init__(
+        self, path: str, dimension: int, metric: str = "cosine", metadata_config: Optional[dict] = None
+    ) -> None:
+        """Create an empty index stored in the `path` directory. Use `LocalIndex.load` to open an existing one."""
+        if metric not in ("cosine", "euclidean", "dotproduct"):
+            raise ValueError(f"Unknown metric {metric}.")
+
+        self.path = path
+        self.dimension = dimension
+        self.metric = metric
+        self.metadata_config = metadata_config or {}
+        self.vectors = np.empty((0, dimension), dtype=np.float32)
+        self.ids: List[str] = []
+        self.metadata: Dict[str, List[Any]] = {}
+        self._positions: Dict[str, int] = {}
+        self._norms = np.empty(0, dtype=np.float32)
+        self._columns: Dict[str, np.ndarray] = {}
+        self._postings: Dict[str, Dict[Any, np.ndarray]] = {}
+        self.ivf: Optional[_IVF] = None
+        self.nprobe = 8
+        self._version = uuid.uuid4().hex
+        self._shards: Dict[str, "LocalIndex"] = {}
+
+    @classmethod
+    def load(cls, path: str) -> "LocalIndex":
+        """Open an index persisted with `flush`. Vectors are memory-mapped read-only until the next upsert."""
+        with open(os.path.join(path, "config.json"), "r") as f:
+            config = json.load(f)
+
+        index = cls(path, config["dimension"], config["metric"], config["metadata_config"])
+        index.nprobe = config.get("nprobe", index.nprobe)
+        index._version = config.get("version", index._version)
+        with open(os.path.join(path, "ids.json"), "r") as f:
+            index.ids = json.load(f)
+        with open(os.path.join(path, "metadata.json"), "r") as f:
+            index.metadata = json.load(f)
+
+        if index.ids:
+            index.vectors = np.memmap(os.path.join(path, "vectors.f32"), dtype=np.float32, mode="r").reshape(
+                -1, index.dimension
+            )
+        index._positions = {id_: i for i, id_ in enumerate(index.ids)}
+        index._norms = np.einsum("ij,ij->i", index.vectors, index.vectors)
+        if os.path.exists(os.path.join(path, "ivf.npz")):
+            index.ivf = _IVF.load(os.path.join(path, "ivf.npz"), index.metric)
+
+        shards_path = os.path.join(path, "namespaces")
+        if os.path.isdir(shards_path):
+            for name in sorted(os.listdir(shards_path)):
+                if os.path.exists(os.path.join(shards_path, name, "config.json")):
+                    index._shards[name] = cls.load(os.path.join(shards_path, name))
+        return index
+
+    @classmethod
+    def from_snapshot(cls, path: str, snapshot: IndexSnapshot) -> "LocalIndex":
+        """Create an index stored in the `path` directory and bulk load a snapshot into it."""
+        index = cls(path, snapshot.dimension, snapshot.metric, snapshot.metadata_config)
+        for namespace, part in snapshot.split().items():
+            shard = index.namespace(namespace)
+            shard.vectors = np.ascontiguousarray(part.vectors, dtype=np.float32).reshape(-1, snapshot.dimension)
+            shard.ids = list(part.ids)
+            fields = sorted(set().union(*[set(metadata) for metadata in part.metadata]))
+            shard.metadata = {field: [metadata.get(field) for metadata in part.metadata] for field in fields}
+            shard._positions = {id_: i for i, id_ in enumerate(shard.ids)}
+            shard._on_change()
+        return index
+
+    def to_snapshot(self) -> IndexSnapshot:
+        """Return the contents of the index and of its namespaces."""
+        shards = sorted({"": self, **self._shards}.items())
+        return IndexSnapshot(
+            ids=[id_ for _, shard in shards for id_ in shard.ids],
+            vectors=np.concatenate([np.asarray(shard.vectors) for _, shard in shards]),
+            metadata=[
+                shard._match(row, None, True, False)["metadata"] for _, shard in shards for row in range(len(shard))
+            ],
+            dimension=self.dimension,
+            metric=self.metric,
+            metadata_config=self.metadata_config,
+            namespaces=[name for name, shard in shards for _ in range(len(shard))],
+        )
+
+    @property
+    def version(self) -> str:
+        """Return an id that changes whenever the vectors of the index or of one of its namespaces change."""
+        return "-".join([self._version, *(self._shards[name]._version for name in sorted(self._shards))])
+
+    def namespace(self, name: Optional[str]) -> "LocalIndex":
+        """Return the shard of a namespace, creating it if needed. The default namespace is the index itself."""
+        if not name:
+            return self
+        if name not in self._shards:
+            path = os.path.join(self.path, "namespaces", name)
+            self._shards[name] = LocalIndex(path, self.dimension, self.metric, self.metadata_config)
+        return self._shards[name]
+
+    def flush(self) -> None:
+        """Persist the index to its directory."""
+        os.makedirs(self.path, exist_ok=True)
+        config = {
+            "dimension": self.dimension,
+            "metric": self.metric,
+            "metadata_config": self.metadata_config,
+            "nprobe": self.nprobe,
+            "version": self._version,
+        }
+        files = {
+            "config.json": json.dumps(config),
+            "ids.json": json.dumps(self.ids),
+            "metadata.json": json.dumps(self.metadata),
+        }
+        for filename, content in files.items():
+            with open(os.path.join(self.path, f"{filename}.tmp"), "w") as f:
+                f.write(content)
+
+        np.ascontiguousarray(self.vectors, dtype=np.float32).tofile(os.path.join(self.path, "vectors.f32.tmp"))
+        filenames = [*files, "vectors.f32"]
+        if self.ivf is not None:
+            self.ivf.save(os.path.join(self.path, "ivf.npz.tmp"))
+            filenames.append("ivf.npz")
+        elif os.path.exists(os.path.join(self.path, "ivf.npz")):
+            os.remove(os.path.join(self.path, "ivf.npz"))
+
+        for filename in filenames:
+            os.replace(os.path.join(self.path, f"{filename}.tmp"), os.path.join(self.path, filename))
+
+        for shard in self._shards.values():
+            shard.flush()
+
+    def build_ivf(self, nlist: Optional[int] = None, nprobe: int = 8, iterations: int = 10) -> None:
+        """Add an inverted file index so that queries only score the rows of the `nprobe` closest clusters.
+
+        Parameters
+        ----------
+        nlist
+            Number of clusters. Defaults to 4 * sqrt(number of vectors).
+
+        nprobe
+            Default number of clusters scored per query. Higher is slower but more accurate.
+
+        iterations
+            Number of k-means iterations.
+
+        """
+        if not len(self):
+            raise ValueError("Cannot build an IVF index without vectors.")
+
+        self.ivf = _IVF.train(self.vectors, self.metric, nlist or int(4 * np.sqrt(len(self))), iterations)
+        self.nprobe = nprobe
+
+    def __len__(self) -> int:
+        """Return the number of vectors."""
+        return len(self.ids)
+
+    def upsert(self, vectors: Sequence[Union[tuple, dict]], namespace: Optional[str] = None, **kwargs) -> dict:
+        """Insert or update vectors given as (id, values, metadata) tuples or Pinecone-style dicts."""
+        if namespace:
+            return self.namespace(namespace).upsert(vectors)
+
+        docs = [(v["id"], v["values"], v.get("metadata") or {}) if isinstance(v, dict) else v for v in vectors]
+        # The last copy of an id repeated in the batch wins, like successive upserts
+        docs = list({doc[0]: doc for doc in docs}.values())
+        new_rows = []
+        new_metadata = []
+        vectors_ = np.array(self.vectors)  # Copy, the memory-mapped matrix is read-only
+        for id_, values, metadata in docs:
+            values = np.asarray(values, dtype=np.float32)
+            if id_ in self._positions:
+                i = self._positions[id_]
+                vectors_[i] = values
+                # New columns only cover the rows that existed before the batch, new rows are added below
+                for field in set(self.metadata) | set(metadata):
+                    self._column(field, size=len(self.ids) - len(new_rows))[i] = metadata.get(field)
+            else:
+                self._positions[id_] = len(self.ids)
+                self.ids.append(id_)
+                new_rows.append(values)
+                new_metadata.append(metadata)
+
+        n = len(self.ids) - len(new_rows)
+        for field in set(self.metadata).union(*[set(m) for m in new_metadata]):
+            self._column(field, size=n).extend(m.get(field) for m in new_metadata)
+
+        if new_rows:
+            vectors_ = np.concatenate([vectors_, np.array(new_rows, dtype=np.float32).reshape(-1, self.dimension)])
+        self.vectors = np.ascontiguousarray(vectors_)
+        self._on_change()
+        return {"upserted_count": len(docs)}
+
+    def _column(self, field: str, size: Optional[int] = None) -> List[Any]:
+        """Return the metadata column of a field, creating it filled with None if needed."""
+        if field not in self.metadata:
+            self.metadata[field] = [None] * (len(self.ids) if size is None else size)
+        return self.metadata[field]
+
+    def _on_change(self) -> None:
+        self._norms = np.einsum("ij,ij->i", self.vectors, self.vectors)
+        self._columns = {}
+        self._postings = {}
+        self._version = uuid.uuid4().hex
+        # Keep the clusters and only re-assign the rows. Call `build_ivf` to re-train after large changes.
+        if self.ivf is not None:
+            self.ivf.assign(self.vectors)
+
+    def delete(
+        self,
+        ids: Optional[List[str]] = None,
+        delete_all: bool = False,
+        filter: Optional[dict] = None,
+        namespace: Optional[str] = None,
+        **kwargs,
+    ) -> dict:
+        """Delete vectors of a namespace by id, by metadata filter or all of them."""
+        if namespace:
+            return self.namespace(namespace).delete(ids, delete_all, filter)
+
+        if delete_all:
+            keep = np.zeros(len(self), dtype=bool)
+        elif filter is not None:
+            keep = np.ones(len(self), dtype=bool)
+            keep[self._filter_rows(filter)] = False
+        else:
+            keep = np.ones(len(self), dtype=bool)
+            keep[[self._positions[id_] for id_ in ids or [] if id_ in self._positions]] = False
+
+        rows = np.flatnonzero(keep)
+        self.vectors = np.ascontiguousarray(self.vectors[rows])
+        self.ids = [self.ids[i] for i in rows]
+        self.metadata = {field: [values[i] for i in rows] for field, values in self.metadata.items()}
+        self._positions = {id_: i for i, id_ in enumerate(self.ids)}
+        self._on_change()
+        return {}
+
+    def fetch(self, ids: List[str], namespace: Optional[str] = None, **kwargs) -> dict:
+        """Return the vectors and metadata of the given ids."""
+        if namespace:
+            return self.namespace(namespace).fetch(ids)
+
+        return {
+            "vectors": {
+                id_: self._match(self._positions[id_], None, True, True) for id_ in ids if id_ in self._positions
+            }
+        }
+
+    def describe_index_stats(self, **kwargs) -> dict:
+        """Return the index statistics."""
+        namespaces = {"": {"vector_count": len(self)}}
+        namespaces.update({name: {"vector_count": len(shard)} for name, shard in self._shards.items() if len(shard)})
+        return {
+            "dimension": self.dimension,
+            "total_vector_count": sum(namespace["vector_count"] for namespace in namespaces.values()),
+            "namespaces": namespaces,
+        }
+
+    def _filter_column(self, field: str) -> np.ndarray:
+        """Return the metadata column as an object array, cached until the next change."""
+        if field not in self._columns:
+            column = np.empty(len(self), dtype=object)
+            column[:] = self.metadata.get(field, [None] * len(self))
+            self._columns[field] = column
+        return self._columns[field]
+
+    def _indexed(self, field: str) -> bool:
+        """Return True if the field has posting lists. Like Pinecone, all fields are indexed by default."""
+        indexed = self.metadata_config.get("indexed")
+        return indexed is None or field in indexed
+
+    def _field_postings(self, field: str) -> Dict[Any, np.ndarray]:
+        """Return the sorted rows of every value of an indexed field, cached until the next change."""
+        if field not in self._postings:
+            postings: Dict[Any, List[int]] = {}
+            for row, cell in enumerate(self.metadata.get(field, [])):
+                for value in cell if isinstance(cell, list) else [cell]:
+                    if value is not None:
+                        postings.setdefault(value, []).append(row)
+            self._postings[field] = {value: np.array(rows, dtype=np.int64) for value, rows in postings.items()}
+        return self._postings[field]
+
+    def _posting_rows(self, field: str, values: list) -> np.ndarray:
+        """Return the sorted rows where the field has any of the values."""
+        postings = self._field_postings(field)
+        rows = [postings[value] for value in values if value in postings]
+        if len(rows) == 1:
+            return rows[0]
+        # A row with list-valued metadata can appear in several posting lists
+        return np.unique(np.concatenate(rows)) if rows else np.empty(0, dtype=np.int64)
+
+    def _condition_mask(self, field: str, op: str, value: Any, rows: np.ndarray) -> np.ndarray:
+        """Evaluate a Pinecone filter condition on some rows by scanning the metadata column.
+
+        List-valued metadata matches if any of its elements match.
+        """
+        values = _condition_values(op, value)
+        column = self._filter_column(field)[rows]
+        mask = np.fromiter(
+            (any(v in values for v in cell) if isinstance(cell, list) else cell in values for cell in column),
+            dtype=bool,
+            count=len(column),
+        )
+        return ~mask if op in ("$ne", "$nin") else mask
+
+    def _filter_rows(self, filter: dict) -> np.ndarray:
+        """Resolve a Pinecone metadata filter into the sorted rows that match it.
+
+        `$eq` and `$in` conditions on indexed fields are resolved with posting lists, intersected from the
+        most selective one. The other conditions are then only evaluated on the surviving rows.
+        """
+        postings = []
+        scans = []
+        for field, condition in filter.items():
+            if field == "$and":
+                postings.extend(self._filter_rows(sub_filter) for sub_filter in condition)
+            elif field == "$or":
+                postings.append(reduce(np.union1d, [self._filter_rows(sub_filter) for sub_filter in condition]))
+            else:
+                for op, value in condition.items() if isinstance(condition, dict) else [("$eq", condition)]:
+                    if op in ("$eq", "$in") and self._indexed(field):
+                        postings.append(self._posting_rows(field, list(_condition_values(op, value))))
+                    else:
+                        scans.append((field, op, value))
+
+        rows = np.arange(len(self))
+        for i, candidates in enumerate(sorted(postings, key=len)):
+            rows = candidates if i == 0 else np.intersect1d(rows, candidates, assume_unique=True)
+            if not len(rows):
+                break
+
+        for field, op, value in scans:
+            rows = rows[self._condition_mask(field, op, value, rows)]
+        return rows
+
+    def _scores(self, queries: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Score rows against a matrix of queries. Higher is better, except for euclidean (squared distance)."""
+        vectors = self.vectors if rows is None else np.take(self.vectors, rows, axis=0)
+        norms = self._norms if rows is None else self._norms[rows]
+        dot = queries @ vectors.T
+        if self.metric == "dotproduct":
+            return dot
+        if self.metric == "cosine":
+            return dot / np.maximum(np.sqrt(norms)[None, :] * np.linalg.norm(queries, axis=1)[:, None], 1e-12)
+        return np.maximum(norms[None, :] - 2 * dot + np.einsum("ij,ij->i", queries, queries)[:, None], 0.0)
+
+    def _top_k(self, scores: np.ndarray, top_k: int) -> np.ndarray:
+        """Return the positions of the best `top_k` scores, best first."""
+        ranked = scores if self.metric == "euclidean" else -scores
+        top_k = min(top_k, len(ranked))
+        if top_k == 0:
+            return np.empty(0, dtype=np.int64)
+        best = np.argpartition(ranked, top_k - 1)[:top_k]
+        return best[np.argsort(ranked[best], kind="stable")]
+
+    def _candidates(
+        self, query: np.ndarray, top_k: int, filter: Optional[dict], nprobe: Optional[int], exact: bool
+    ) -> Optional[np.ndarray]:
+        """Return the rows to score, or None to score them all."""
+        filtered = self._filter_rows(filter) if filter else None
+        if self.ivf is None or exact:
+            return filtered
+
+        probed = np.sort(self.ivf.probe(query, nprobe or self.nprobe))
+        if filtered is None:
+            return probed
+        # Selective filters leave fewer candidates than the probed clusters, score them all exactly
+        if len(filtered) <= len(probed):
+            return filtered
+
+        rows = np.intersect1d(probed, filtered, assume_unique=True)
+        return rows if len(rows) >= top_k else filtered
+
+    def evaluate_recall(
+        self, queries: np.ndarray, top_k: int = 10, nprobes: Sequence[int] = (1, 2, 4, 8, 16, 32)
+    ) -> Dict[int, Dict[str, float]]:
+        """Measure the recall@k and latency of the IVF index against exact search to choose `nprobe`.
+
+        Parameters
+        ----------
+        queries
+            Query vectors, e.g. a sample of the indexed vectors or embedded user questions.
+
+        top_k
+            Number of neighbours to compare.
+
+        nprobes
+            Values of `nprobe` to evaluate.
+
+        Returns
+        -------
+        results
+            Mean recall@k and latency in milliseconds per `nprobe`.
+
+        """
+        if self.ivf is None:
+            raise ValueError("The index has no IVF index, call `build_ivf` first.")
+
+        queries = np.asarray(queries, dtype=np.float32)
+        expected = [{m["id"] for m in self.query(q, top_k, exact=True)["matches"]} for q in queries]
+        results = {}
+        for nprobe in nprobes:
+            start = time.perf_counter()
+            found = [{m["id"] for m in self.query(q, top_k, nprobe=nprobe)["matches"]} for q in queries]
+            latency = (time.perf_counter() - start) / len(queries)
+            recall = np.mean([len(f & e) / max(len(e), 1) for f, e in zip(found, expected)])
+            results[nprobe] = {"recall": float(recall), "latency_ms": latency * 1000}
+        return results
+
+    def _match(self, row: int, score: Optional[float], include_metadata: bool, include_values: bool) -> dict:
+        match = {"id": self.ids[row]}
+        if score is not None:
+            match["score"] = float(score)
+        if include_values:
+            match["values"] = self.vectors[row].tolist()
+        if include_metadata:
+            match["metadata"] = {
+                field: values[row] for field, values in self.metadata.items() if values[row] is not None
+            }
+        return match
+
+    def query(
+        self,
+        vector: List[float],
+        top_k: int = 10,
+        include_metadata: bool = False,
+        include_values: bool = False,
+        filter: Optional[dict] = None,
+        nprobe: Optional[int] = None,
+        exact: bool = False,
+        namespace: Optional[str] = None,
+        **kwargs,
+    ) -> dict:
+        """Return the `top_k` most similar vectors that match the metadata filter.
+
+        With an IVF index, only the rows of the `nprobe` closest clusters are scored, unless `exact` is set.
+        Filters that leave fewer than `top_k` candidates in those clusters fall back to exact search.
+        """
+        return self.query_many([vector], top_k, include_metadata, include_values, filter, nprobe, exact, namespace)[0]
+
+    def query_many(
+        self,
+        vectors: Union[np.ndarray, List[List[float]]],
+        top_k: int = 10,
+        include_metadata: bool = False,
+        include_values: bool = False,
+        filters: Union[None, dict, List[Optional[dict]]] = None,
+        nprobe: Optional[int] = None,
+        exact: bool = False,
+        namespace: Optional[str] = None,
+        **kwargs,
+    ) -> List[dict]:
+        """Run several queries at once and return one `query` result per vector.
+
+        Queries that share a filter resolve it once and are scored with a single matrix product.
+
+        Parameters
+        ----------
+        vectors
+            Query vectors.
+
+        top_k
+            Number of results per query.
+
+        include_metadata
+            Whether to return the metadata of the matches.
+
+        include_values
+            Whether to return the vectors of the matches.
+
+        filters
+            A filter shared by all queries, or one filter per query.
+
+        nprobe
+            Number of clusters scored per query with the IVF index.
+
+        exact
+            Whether to ignore the IVF index.
+
+        namespace
+            Namespace to search. Defaults to the default namespace.
+
+        """
+        if namespace:
+            results = self.namespace(namespace).query_many(
+                vectors, top_k, include_metadata, include_values, filters, nprobe, exact
+            )
+            return [{**result, "namespace": namespace} for result in results]
+
+        queries = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dimension)
+        if filters is None or isinstance(filters, dict):
+            filters = [filters] * len(queries)
+
+        groups: Dict[str, List[int]] = {}
+        for i, filter in enumerate(filters):
+            # Each query probes its own IVF clusters, so those are scored one by one
+            key = str(i) if self.ivf is not None and not exact else json.dumps(filter, sort_keys=True)
+            groups.setdefault(key, []).append(i)
+
+        results = [None] * len(queries)
+        for positions in groups.values():
+            rows = self._candidates(queries[positions[0]], top_k, filters[positions[0]], nprobe, exact)
+            scores = self._scores(queries[positions], rows)
+            for i, query_scores in zip(positions, scores):
+                best = self._top_k(query_scores, top_k)
+                matched = best if rows is None else rows[best]
+                results[i] = {
+                    "matches": [
+                        self._match(row, score, include_metadata, include_values)
+                        for row, score in zip(matched, query_scores[best])
+                    ],
+                    "namespace": "",
+                }
+        return results
+
+
+class LocalVectorIndex:
+    """Build and connect to local indexes with the same surface as `PineconeIndex`."""
+
+    def __init__(self, path: str = ".cache/vector_indexes") -> None:
+        """Initialise the directory that holds the indexes."""
+        self.path = path
+        self._manifest_path = os.path.join(path, ".manifests")
+
+    def _index_path(self, index_name: str) -> str:
+        return os.path.join(self.path, index_name)
+
+    def list_indexes(self) -> List[str]:
+        """Return the names of the existing indexes."""
+        if not os.path.exists(self.path):
+            return []
+        return sorted(
+            name for name in os.listdir(self.path) if os.path.exists(os.path.join(self.path, name, "config.json"))
+        )
+
+    def connect(self, index_name: str) -> LocalIndex:
+        """Connect to the index."""
+        if index_name not in self.list_indexes():
+            raise ValueError(f"Index {index_name} does not exist.")
+
+        return LocalIndex.load(self._index_path(index_name))
+
+    def build_and_upsert(
+        self,
+        index_name: str,
+        dimension: int,
+        metadata_config: dict,
+        metric: str,
+        docs: list,
+        batch_size: int = 100,
+        delete_if_exists: bool = False,
+        manifest: Optional[str] = None,
+        embed: Optional[Callable[[List[dict]], np.ndarray]] = None,
+        nlist: Optional[int] = None,
+        nprobe: int = 8,
+        namespace: Optional[str] = None,
+        legacy_filter: Optional[dict] = None,
+        **kwargs,
+    ) -> None:
+        """Build the index (if it does not exist) and add docs.
+
+        Parameters
+        ----------
+        index_name
+            Name of the index.
+
+        dimension
+            Length of the indexed vectors.
+
+        metadata_config
+            The metadata config.
+
+        metric
+            The distance metric to use.
+
+        docs
+            The documents to index.
+
+        batch_size
+            Unused, kept for compatibility with `PineconeIndex`. Local upserts are a single bulk load.
+
+        delete_if_exists
+            Whether to delete the index if it already exists.
+
+        manifest
+            Name of a manifest recording the (id, content hash) of the docs, e.g. "dm". When set, only new or
+            changed docs are embedded and upserted, and docs that were removed since the last build are deleted.
+            Use stable ids, e.g. from `genai.index_manifest.content_id`. Each namespace has its own manifests;
+            the first build of a namespace moves the docs of the same manifest out of the default namespace.
+
+        embed
+            Function returning the embeddings of a list of metadata, for docs given without values.
+
+        namespace
+            Namespace of the docs, e.g. their source. With `delete_if_exists`, only this namespace is cleared,
+            so one corpus can be rebuilt without touching the others.
+
+        legacy_filter
+            Metadata filter of docs an earlier build stored in the default namespace, e.g.
+            `{"source": {"$eq": "BBC"}}`. They are deleted from it once the docs are in `namespace`. Builders
+            with a manifest do not need it, their docs are moved on the first build of the namespace.
+
+        nlist
+            Number of clusters of the IVF index. No IVF index is built if not set, use `-1` for the default size.
+
+        nprobe
+            Number of clusters scored per query with the IVF index.
+
+        """
+        if delete_if_exists and not namespace:
+            self.delete(index_name)
+
+        if index_name in self.list_indexes():
+            index = self.connect(index_name)
+        else:
+            index = LocalIndex(self._index_path(index_name), dimension, metric, metadata_config)
+
+        shard = index.namespace(namespace)
+        if delete_if_exists and namespace:
+            shard.delete(delete_all=True)
+            if manifest is not None:
+                IndexManifest(index_name, manifest, self._manifest_path, namespace).delete()
+
+        # Docs moving from the default namespace to their own are upserted again and removed from the default one
+        legacy = legacy_manifest(index_name, manifest, namespace, self._manifest_path) if manifest else None
+        docs, to_delete, index_manifest, hashes = plan_upserts(
+            index_name, docs, manifest, embed, self._manifest_path, namespace
+        )
+        if docs:
+            shard.upsert(docs)
+        if to_delete:
+            shard.delete(ids=to_delete)
+        if legacy is not None:
+            index.delete(ids=list(legacy.hashes))
+        if legacy_filter is not None and namespace:
+            index.delete(filter=legacy_filter)
+        if nlist is not None:
+            shard.build_ivf(nlist if nlist > 0 else None, nprobe)
+        index.flush()
+        if index_manifest is not None:
+            index_manifest.save(hashes)
+        if legacy is not None:
+            legacy.delete()
+
+    def export_snapshot(self, index_name: str, path: str) -> None:
+        """Save the index and its manifests to a snapshot file."""
+        snapshot = self.connect(index_name).to_snapshot()
+        snapshot.manifests = IndexManifest.load_all(index_name, self._manifest_path)
+        snapshot.save(path)
+
+    def import_snapshot(self, index_name: str, path: str, delete_if_exists: bool = False, **kwargs) -> None:
+        """Load a snapshot file into the index, bulk loading it when the index is new.
+
+        Parameters
+        ----------
+        index_name
+            Name of the index.
+
+        path
+            Path of the snapshot.
+
+        delete_if_exists
+            Whether to delete the index if it already exists. Otherwise the snapshot is upserted into it.
+
+        """
+        snapshot = IndexSnapshot.load(path)
+        if delete_if_exists:
+            self.delete(index_name)
+
+        if index_name in self.list_indexes():
+            index = self.connect(index_name)
+            for namespace, part in snapshot.split().items():
+                index.upsert(list(part.docs()), namespace=namespace)
+        else:
+            index = LocalIndex.from_snapshot(self._index_path(index_name), snapshot)
+        index.flush()
+        IndexManifest.restore_all(index_name, snapshot.manifests, self._manifest_path)
+
+    def delete(self, index_name: str) -> None:
+        """Delete the index."""
+        IndexManifest.delete_all(index_name, self._manifest_path)
+        shutil.rmtree(self._index_path(index_name), ignore_errors=True)
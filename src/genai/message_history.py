@@ -1,45 +1,148 @@
+import atexit
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
 from abc import ABC
 from abc import abstractmethod
+from bisect import bisect_left
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from functools import lru_cache
+from functools import partial
+from typing import Callable
+from typing import Dict
 from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+from typing import Union
 
+import numpy as np
 import tiktoken
 
 from genai import MessageTemplate
 
 
+logger = logging.getLogger(__name__)
+
+# A dictionary rather than a MessageTemplate, which is formatted in place and would be shared across threads
+SUMMARISE_MESSAGE = dict(
+    role="user",
+    content=(
+        "###Instructions###\n"
+        "Update the summary of a conversation with its new messages. Keep the facts the user shared, the "
+        "questions they asked and the answers they were given. Leave out the references quoted in the "
+        "messages. Answer with the updated summary only, in at most {max_words} words.\n"
+        "###Summary###\n{summary}\n"
+        "###New messages###\n{messages}"
+    ),
+)
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model_name: str) -> tiktoken.Encoding:
+    """Return the tiktoken encoding of a model, resolved once per model."""
+    return tiktoken.encoding_for_model(model_name)
+
+
 class TokenCounter:
     """Count tokens and buffer messages from memory."""
 
+    # every message follows <|start|>{role/name}\n{content}<|end|>\n
+    tokens_per_message = 3
+    tokens_per_name = 1
+    # every reply is primed with <|start|>assistant<|message|>
+    tokens_per_reply = 3
+    # Below this many texts, encoding them one by one is faster than spinning up threads
+    min_batch_size = 16
+
     @staticmethod
     def _count_tokens_from_string(s: str, model_name: str) -> int:
         """Return the number of tokens in a text string."""
-        encoding = tiktoken.encoding_for_model(model_name)
-        num_tokens = len(encoding.encode(s))
+        return len(get_encoding(model_name).encode(s))
+
+    @classmethod
+    def count_tokens(
+        cls,
+        texts: Sequence[str],
+        model_name: str = "gpt-3.5-turbo",
+        num_threads: int = 8,
+        batch_size: int = 1000,
+    ) -> np.ndarray:
+        """Return the number of tokens of each text, e.g. of every document of an index.
+
+        Texts are encoded with tiktoken's batch encoding, which runs across `num_threads` threads, in batches
+        of `batch_size` texts so that only the tokens of one batch are held in memory.
+
+        Parameters
+        ----------
+        texts
+            The texts to count.
+
+        model_name
+            The name of the model to use for token counting.
+
+        num_threads
+            Number of threads encoding a batch.
+
+        batch_size
+            Number of texts encoded at once.
+
+        Returns
+        -------
+        num_tokens
+            The number of tokens of each text.
+
+        """
+        encoding = get_encoding(model_name)
+        texts = list(texts)
+        if len(texts) < cls.min_batch_size:
+            return np.array([len(encoding.encode(text)) for text in texts], dtype=np.int64)
+
+        num_tokens = np.empty(len(texts), dtype=np.int64)
+        for start in range(0, len(texts), batch_size):
+            tokens = encoding.encode_batch(texts[start : start + batch_size], num_threads=num_threads)
+            num_tokens[start : start + len(tokens)] = [len(t) for t in tokens]
         return num_tokens
 
+    @classmethod
+    def count_message_tokens(cls, messages: Sequence[dict], model_name: str = "gpt-3.5-turbo", **kwargs) -> np.ndarray:
+        """Return the number of tokens of each message, excluding the tokens priming the reply.
+
+        The fields of all messages are counted in one `count_tokens` call, which takes the same keyword arguments.
+        """
+        values = [v for message in messages for v in message.values()]
+        owners = np.repeat(np.arange(len(messages)), [len(message) for message in messages])
+        num_tokens = np.bincount(
+            owners, weights=cls.count_tokens(values, model_name, **kwargs), minlength=len(messages)
+        )
+        names = np.array(["name" in message for message in messages], dtype=np.int64)  # When role = function
+        return num_tokens.astype(np.int64) + cls.tokens_per_message + names * cls.tokens_per_name
+
     @classmethod
     def _count_tokens_from_messages(cls, messages: list, model_name: str) -> int:
         """Return the number of tokens in a list of messages."""
-        num_tokens = 0
-
-        # every message follows <|start|>{role/name}\n{content}<|end|>\n
-        tokens_per_message = 3
-        tokens_per_name = 1
-        for message in messages:
-            num_tokens += tokens_per_message
-            for k, v in message.items():
-                num_tokens += cls._count_tokens_from_string(v, model_name)
-                if k == "name":  # When role = function
-                    num_tokens += tokens_per_name
-
-        num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
-        return num_tokens
+        return int(cls.count_message_tokens(messages, model_name).sum()) + cls.tokens_per_reply
 
-    @staticmethod
-    def _forget_messages(num_tokens: int, max_tokens: int) -> bool:
-        if num_tokens > max_tokens:
-            return True
-        return False
+    @classmethod
+    def _forgotten_range(
+        cls, token_counts: List[int], max_tokens: int, keep_system_message: bool = True
+    ) -> Tuple[int, int]:
+        """Return the range of the oldest messages to forget to fit the messages in `max_tokens`.
+
+        A single pass over the token counts of the messages, the system message is kept if requested.
+        """
+        num_tokens = sum(token_counts) + cls.tokens_per_reply
+        start = end = 1 if keep_system_message else 0
+        while num_tokens > max_tokens and end < len(token_counts):
+            num_tokens -= token_counts[end]
+            end += 1
+        return start, end
 
     @classmethod
     def buffer(
@@ -48,8 +151,9 @@ class TokenCounter:
         model_name: str = "gpt-3.5-turbo",
         max_tokens: int = 4096,
         keep_system_message: bool = True,
+        token_counts: Optional[List[int]] = None,
     ) -> List[dict]:
-        """Return the number of tokens in a list of messages.
+        """Forget the oldest messages until the number of tokens fits in max_tokens.
 
         Parameters
         ----------
@@ -62,20 +166,20 @@ class TokenCounter:
         keep_system_message
             Whether to keep the system message in the history.
 
+        token_counts
+            The number of tokens of each message, if already counted.
+
         Returns
         -------
         messages
             List of messages.
 
         """
-        num_tokens = cls._count_tokens_from_messages(messages, model_name)
-        if cls._forget_messages(num_tokens, max_tokens):
-            if keep_system_message:
-                messages.pop(1)
-            else:
-                messages.pop(0)
-            cls.buffer(messages, model_name=model_name, max_tokens=max_tokens)
+        if token_counts is None:
+            token_counts = cls.count_message_tokens(messages, model_name).tolist()
 
+        start, end = cls._forgotten_range(token_counts, max_tokens, keep_system_message)
+        del messages[start:end]
         return messages
 
 
@@ -98,26 +202,100 @@ class BaseMessageHistory(ABC):
         pass
 
 
+class MessageWindow(Sequence):
+    """Read-only view of the most recent messages of a history that fit in a token budget.
+
+    The window only holds its offsets in the history, no message is copied. Concatenating it with a list,
+    e.g. `history.get_messages() + [instruction]`, returns a new list.
+    """
+
+    def __init__(self, messages: List[dict], start: int, end: int, keep_first: bool, num_tokens: int) -> None:
+        """Create a view of `messages[start:end]`, preceded by `messages[0]` if `keep_first` is set."""
+        self._messages = messages
+        self.start = start
+        self.end = end
+        self.keep_first = keep_first
+        self.num_tokens = num_tokens
+
+    def __len__(self) -> int:
+        """Return the number of messages in the window."""
+        return self.end - self.start + self.keep_first
+
+    def __getitem__(self, i: Union[int, slice]) -> Union[dict, List[dict]]:
+        """Return a message, or a list of messages for a slice."""
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("message window index out of range")
+        if self.keep_first:
+            return self._messages[0] if i == 0 else self._messages[self.start + i - 1]
+        return self._messages[self.start + i]
+
+    def __add__(self, other: Sequence) -> List[dict]:
+        """Return the messages of the window followed by others."""
+        return list(self) + list(other)
+
+    def __radd__(self, other: Sequence) -> List[dict]:
+        """Return other messages followed by the messages of the window."""
+        return list(other) + list(self)
+
+    def __eq__(self, other: object) -> bool:
+        """Compare the messages with those of another sequence, e.g. a list."""
+        return isinstance(other, Sequence) and list(self) == list(other)
+
+    def __repr__(self) -> str:
+        """Return the messages of the window."""
+        return f"MessageWindow({list(self)!r})"
+
+
 class InMemoryMessageHistory(BaseMessageHistory):
-    """In-memory message history."""
+    """In-memory message history.
+
+    Messages are only ever appended. The tokens of each message are counted once, when it is added, and kept
+    as prefix sums per tiktoken encoding, so `get_messages` finds the window fitting a token budget with a
+    binary search and never drops messages from the history.
+    """
+
+    def __init__(self, model_name: str = "gpt-3.5-turbo") -> None:
+        """Initialize the message history, counting tokens with the encoding of `model_name`."""
+        self.model_name = model_name
+        self._messages: List[dict] = []
+        self._prefix_sums: Dict[str, List[int]] = {}
 
-    def __init__(self) -> None:
-        """Initialize the message history."""
-        self.messages = []
+    def __len__(self) -> int:
+        """Return the number of messages of the history."""
+        return len(self._messages)
+
+    @property
+    def messages(self) -> List[dict]:
+        """Return all the messages of the history. Use `add_message` to add one."""
+        return self._messages
 
     def add_message(self, message: MessageTemplate) -> None:
         """Add a message to the history."""
-        self.messages.append(message)
+        self._messages.append(message)
+        self.token_prefix_sums(self.model_name)
+
+    def token_prefix_sums(self, model_name: str) -> List[int]:
+        """Return the number of tokens of the first i messages at position i, counting new messages only."""
+        prefix_sums = self._prefix_sums.setdefault(get_encoding(model_name).name, [0])
+        if len(prefix_sums) <= len(self._messages):
+            counts = TokenCounter.count_message_tokens(self._messages[len(prefix_sums) - 1 :], model_name)
+            prefix_sums.extend((prefix_sums[-1] + np.cumsum(counts)).tolist())
+        return prefix_sums
 
     def get_messages(
         self,
         model_name: str = "gpt-3.5-turbo",
         max_tokens: int = 4096,
         keep_system_message: bool = True,
-    ) -> List[dict]:
+    ) -> MessageWindow:
         """Get all messages from history.
 
-        Filter messages when the number of tokens exceeds max_tokens.
+        Filter messages when the number of tokens exceeds max_tokens. The oldest messages are left out of the
+        returned window but stay in the history.
 
         Parameters
         ----------
@@ -133,16 +311,448 @@ class InMemoryMessageHistory(BaseMessageHistory):
         Returns
         -------
         messages
-            List of messages.
+            Read-only window of the messages.
 
         """
-        return TokenCounter.buffer(
-            self.messages,
-            model_name=model_name,
-            max_tokens=max_tokens,
-            keep_system_message=keep_system_message,
-        )
+        prefix_sums = self.token_prefix_sums(model_name)
+        n = len(self._messages)
+        keep_first = keep_system_message and n > 0
+        first_tokens = prefix_sums[1] if keep_first else 0
+        # The window messages[start:] fits if first_tokens + prefix_sums[n] - prefix_sums[start] + reply <= max_tokens
+        target = first_tokens + prefix_sums[n] + TokenCounter.tokens_per_reply - max_tokens
+        start = bisect_left(prefix_sums, target, int(keep_first), n)
+        num_tokens = first_tokens + prefix_sums[n] - prefix_sums[start] + TokenCounter.tokens_per_reply
+        return MessageWindow(self._messages, start, n, keep_first, num_tokens)
 
     def clear_messages(self) -> None:
         """Empty the message history."""
-        self.messages = []
+        self._messages = []
+        self._prefix_sums = {}
+
+
+@lru_cache(maxsize=None)
+def _connect(path: str) -> Tuple[sqlite3.Connection, threading.Lock]:
+    """Return the connection to a message database shared by the histories of the process, and its lock."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS messages (
+            conversation TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            message TEXT NOT NULL,
+            encoding TEXT NOT NULL,
+            num_tokens INTEGER NOT NULL,
+            PRIMARY KEY (conversation, position)
+        ) WITHOUT ROWID"""
+    )
+    return conn, threading.Lock()
+
+
+class SQLiteMessageHistory(BaseMessageHistory):
+    """Message history of a conversation stored in a local SQLite database in WAL mode.
+
+    Messages are clustered by conversation and position, so adding a message is a single insert and
+    `get_messages` only reads the most recent messages that fit in the token budget. The tokens of each
+    message are counted once, when it is added. Several processes on the same machine can share the database.
+    """
+
+    def __init__(
+        self,
+        conversation_id: str,
+        path: str = ".cache/message_history.sqlite",
+        model_name: str = "gpt-3.5-turbo",
+        archive: Optional["MessageArchive"] = None,
+    ) -> None:
+        """Open the history of a conversation.
+
+        Parameters
+        ----------
+        conversation_id
+            Id of the conversation, e.g. the contact of the user.
+
+        path
+            Path to the SQLite file.
+
+        model_name
+            The name of the model whose encoding is used to count the tokens of new messages.
+
+        archive
+            Archive that copies the conversation to a slower store, e.g. S3, when it changes.
+
+        """
+        self.conversation_id = conversation_id
+        self.path = path
+        self.model_name = model_name
+        self.archive = archive
+        self._conn, self._lock = _connect(path)
+
+    def __len__(self) -> int:
+        """Return the number of messages of the conversation."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MAX(position) FROM messages WHERE conversation = ?", (self.conversation_id,)
+            ).fetchone()
+        return 0 if row[0] is None else row[0] + 1
+
+    @property
+    def messages(self) -> List[dict]:
+        """Return all the messages of the conversation."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT message FROM messages WHERE conversation = ? ORDER BY position", (self.conversation_id,)
+            ).fetchall()
+        return [json.loads(message) for message, in rows]
+
+    def add_message(self, message: MessageTemplate) -> None:
+        """Add a message to the history."""
+        self.add_messages([message])
+
+    def add_messages(self, messages: List[dict], archive: bool = True) -> None:
+        """Add messages in a single transaction, e.g. to restore a conversation. Set `archive` to skip archiving."""
+        num_tokens = TokenCounter.count_message_tokens(messages, self.model_name).tolist()
+        encoding = get_encoding(self.model_name).name
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT MAX(position) FROM messages WHERE conversation = ?", (self.conversation_id,)
+                ).fetchone()
+                start = 0 if row[0] is None else row[0] + 1
+                self._conn.executemany(
+                    "INSERT INTO messages (conversation, position, message, encoding, num_tokens) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (self.conversation_id, start + i, json.dumps(message, ensure_ascii=False), encoding, n)
+                        for i, (message, n) in enumerate(zip(messages, num_tokens))
+                    ],
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+        if archive and self.archive is not None:
+            self.archive.mark(self)
+
+    def get_messages(
+        self,
+        model_name: str = "gpt-3.5-turbo",
+        max_tokens: int = 4096,
+        keep_system_message: bool = True,
+    ) -> List[dict]:
+        """Get the most recent messages that fit in max_tokens.
+
+        Parameters
+        ----------
+        model_name
+            The name of the model to use for token counting.
+
+        max_tokens
+            The maximum number of tokens to keep in the history.
+
+        keep_system_message
+            Whether to keep the system message in the history.
+
+        Returns
+        -------
+        messages
+            List of messages, oldest first.
+
+        """
+        encoding = get_encoding(model_name).name
+
+        def _num_tokens(message: str, message_encoding: str, num_tokens: int) -> int:
+            if message_encoding == encoding:
+                return num_tokens
+            return int(TokenCounter.count_message_tokens([json.loads(message)], model_name)[0])
+
+        first = []
+        budget = max_tokens - TokenCounter.tokens_per_reply
+        with self._lock:
+            if keep_system_message:
+                row = self._conn.execute(
+                    "SELECT message, encoding, num_tokens FROM messages WHERE conversation = ? AND position = 0",
+                    (self.conversation_id,),
+                ).fetchone()
+                if row is not None:
+                    first = [json.loads(row[0])]
+                    budget -= _num_tokens(*row)
+
+            # Walk back from the newest message until the budget is spent
+            recent = []
+            rows = self._conn.execute(
+                "SELECT message, encoding, num_tokens FROM messages WHERE conversation = ? AND position >= ? "
+                "ORDER BY position DESC",
+                (self.conversation_id, len(first)),
+            )
+            for row in rows:
+                budget -= _num_tokens(*row)
+                if budget < 0:
+                    break
+                recent.append(json.loads(row[0]))
+
+        return first + recent[::-1]
+
+    def clear_messages(self) -> None:
+        """Delete the messages of the conversation."""
+        with self._lock:
+            self._conn.execute("DELETE FROM messages WHERE conversation = ?", (self.conversation_id,))
+        if self.archive is not None:
+            self.archive.mark(self)
+
+
+class MessageArchive:
+    """Copy conversations to a slower store, e.g. S3, off the request path.
+
+    Changed conversations are written in full by a background thread at most every `interval` seconds, so a
+    burst of messages costs a single write. Failed writes are retried at the next interval.
+    """
+
+    def __init__(self, write: Callable[[str, List[dict]], None], interval: float = 5.0) -> None:
+        """Start the archiving thread.
+
+        Parameters
+        ----------
+        write
+            Function writing all the messages of a conversation, given its id.
+
+        interval
+            Seconds between two writes of a conversation.
+
+        """
+        self.write = write
+        self.interval = interval
+        self._pending: Dict[str, SQLiteMessageHistory] = {}
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def mark(self, history: SQLiteMessageHistory) -> None:
+        """Schedule the conversation of a history to be archived."""
+        with self._lock:
+            self._pending[history.conversation_id] = history
+
+    def flush(self) -> None:
+        """Archive the scheduled conversations now."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+
+        for conversation_id, history in pending.items():
+            try:
+                self.write(conversation_id, history.messages)
+            except Exception:
+                logger.warning(f"Failed to archive conversation {conversation_id}, retrying later", exc_info=True)
+                with self._lock:
+                    self._pending.setdefault(conversation_id, history)
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+
+def summarise_messages(summary: str, messages: List[dict], model: str = "gpt-3.5-turbo", max_tokens: int = 256) -> str:
+    """Fold messages into the running summary of a conversation with an LLM.
+
+    Parameters
+    ----------
+    summary
+        The current summary, empty at first.
+
+    messages
+        Messages to add to the summary, oldest first.
+
+    model
+        The OpenAI model writing the summary.
+
+    max_tokens
+        Maximum length of the new summary.
+
+    Returns
+    -------
+    summary
+        The updated summary.
+
+    """
+    from genai.eyfs import TextGenerator  # genai.eyfs counts tokens with this module
+
+    response = TextGenerator.generate(
+        model=model,
+        temperature=0.0,
+        messages=[SUMMARISE_MESSAGE],
+        message_kwargs={
+            "summary": summary or "(empty)",
+            "messages": "\n".join(f"{message['role']}: {message['content']}" for message in messages),
+            "max_words": int(max_tokens * 0.6),
+        },
+        max_tokens=max_tokens,
+    )
+    return response["choices"][0]["message"]["content"].strip()
+
+
+class SummaryMessageHistory(BaseMessageHistory):
+    """Message history that summarises the messages falling out of the token window instead of dropping them.
+
+    `get_messages` returns the system message, a running summary of the older messages and the most recent
+    messages that fit in the rest of the budget, so the prompt size stays bounded however long the chat gets.
+    Messages that no longer fit are folded into the summary by a background thread. The summary is used from
+    the next call once it is ready, so a slow or failed summary never delays a reply; until then, the evicted
+    messages are left out like in the wrapped history. The newest message is always returned, even when it
+    alone is over the budget.
+    """
+
+    # Shared by all histories, so that many conversations do not start a thread each
+    executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="summarise")
+
+    def __init__(
+        self,
+        history: Optional[BaseMessageHistory] = None,
+        summarise: Optional[Callable[[str, List[dict]], str]] = None,
+        summary_model: str = "gpt-3.5-turbo",
+        summary_max_tokens: int = 256,
+        chunk_tokens: int = 2048,
+    ) -> None:
+        """Wrap a history.
+
+        Parameters
+        ----------
+        history
+            History storing the messages, e.g. a `SQLiteMessageHistory`. Defaults to an `InMemoryMessageHistory`.
+
+        summarise
+            Function returning the summary updated with new messages. Defaults to `summarise_messages`.
+
+        summary_model
+            The OpenAI model writing the summary with the default `summarise`.
+
+        summary_max_tokens
+            Maximum length of the summary with the default `summarise`.
+
+        chunk_tokens
+            Maximum number of tokens of the messages folded into the summary at once.
+
+        """
+        self.history = history if history is not None else InMemoryMessageHistory()
+        self.summarise = summarise or partial(summarise_messages, model=summary_model, max_tokens=summary_max_tokens)
+        self.chunk_tokens = chunk_tokens
+        self.summary = ""
+        # Number of messages of the history covered by the summary
+        self.summarised = 0
+        self._generation = 0
+        self._future: Optional[Future] = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Return the number of messages of the history."""
+        return len(self.history)
+
+    @property
+    def messages(self) -> List[dict]:
+        """Return all the messages of the history."""
+        return self.history.messages
+
+    def add_message(self, message: MessageTemplate) -> None:
+        """Add a message to the history."""
+        self.history.add_message(message)
+
+    def get_messages(
+        self,
+        model_name: str = "gpt-3.5-turbo",
+        max_tokens: int = 4096,
+        keep_system_message: bool = True,
+    ) -> List[dict]:
+        """Get the system message, the summary of older messages and the most recent messages.
+
+        Parameters
+        ----------
+        model_name
+            The name of the model to use for token counting.
+
+        max_tokens
+            The maximum number of tokens of the returned messages, summary included.
+
+        keep_system_message
+            Whether to keep the system message in the history.
+
+        Returns
+        -------
+        messages
+            List of messages.
+
+        """
+        with self._lock:
+            summary, summarised = self.summary, self.summarised
+
+        summary_messages = []
+        if summary:
+            summary_messages = [{"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"}]
+            max_tokens -= int(TokenCounter.count_message_tokens(summary_messages, model_name)[0])
+
+        num_messages = len(self.history)
+        window = list(self.history.get_messages(model_name, max_tokens, keep_system_message))
+        first = window[:1] if keep_system_message and num_messages else []
+        recent = window[len(first) :]
+        if not recent and num_messages > len(first):
+            # The newest message alone is over the budget, keep it anyway so that the model sees the question
+            recent = self.history.messages[-1:]
+        # Position of the oldest recent message, the messages between the first one and it were evicted
+        start = num_messages - len(recent)
+        if start > max(summarised, len(first)):
+            self._schedule(len(first), start)
+
+        return first + summary_messages + recent[max(summarised - start, 0) :]
+
+    def _schedule(self, offset: int, end: int) -> None:
+        """Summarise the messages up to `end` in the background, unless a summary is already being written."""
+        with self._lock:
+            if self._future is not None and not self._future.done():
+                return
+            self._future = self.executor.submit(self._summarise, offset, end, self._generation)
+
+    def _summarise(self, offset: int, end: int, generation: int) -> None:
+        with self._lock:
+            summary, start = self.summary, max(self.summarised, offset)
+        messages = self.history.messages[start:end]
+        num_tokens = TokenCounter.count_message_tokens(
+            messages, getattr(self.history, "model_name", "gpt-3.5-turbo")
+        ).tolist()
+
+        i = 0
+        while i < len(messages):
+            # Fold at least one message at a time, and as many as fit in chunk_tokens
+            j, chunk_tokens = i + 1, num_tokens[i]
+            while j < len(messages) and chunk_tokens + num_tokens[j] <= self.chunk_tokens:
+                chunk_tokens += num_tokens[j]
+                j += 1
+
+            try:
+                summary = self.summarise(summary, messages[i:j])
+            except Exception:
+                logger.warning("Failed to summarise messages, retrying at the next turn", exc_info=True)
+                return
+
+            with self._lock:
+                if generation != self._generation:
+                    return
+                self.summary, self.summarised = summary, start + j
+            i = j
+
+    def wait(self, timeout: Optional[float] = None) -> None:
+        """Wait until the summary being written, if any, is ready."""
+        future = self._future
+        if future is not None:
+            wait([future], timeout)
+
+    def clear_messages(self) -> None:
+        """Empty the message history and its summary."""
+        with self._lock:
+            self._generation += 1
+            self.summary = ""
+            self.summarised = 0
+        self.history.clear_messages()
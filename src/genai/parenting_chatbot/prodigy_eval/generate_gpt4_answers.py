@@ -15,6 +15,7 @@ import openai
 import pandas as pd
 
 from genai import MessageTemplate
+from genai.cache import ResponseCache
 from genai.eyfs import TextGenerator
 
 
@@ -22,11 +23,14 @@ DIR = "src/genai/parenting_chatbot/prodigy_eval/data/"
 SYSTEM_PROMPT = DIR + "system.json"
 QUESTIONS = DIR + "questions.jsonl"
 OUTPUT_FILE = DIR + "answers_gpt4.jsonl"
+CACHE_PATH = ".cache/openai_responses.sqlite"
 
 dotenv.load_dotenv()
 openai.api_key = os.environ["OPENAI_API_KEY"]
 
 if __name__ == "__main__":
+    # Re-running the script only pays for questions that have not been answered yet
+    TextGenerator.cache = ResponseCache(CACHE_PATH)
     # Load the system prompt
     system_prompt = MessageTemplate.load(SYSTEM_PROMPT)
     # Load the questions
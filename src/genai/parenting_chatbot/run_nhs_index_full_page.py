@@ -1,15 +1,20 @@
 """Build a pinecone index with the NHS Start for Life data."""
 
 import os
-import uuid
 
+from typing import List
+
+import numpy as np
 import openai
 import pandas as pd
 
 from dotenv import load_dotenv
 
-from genai.eyfs import get_embedding
-from genai.vector_index import PineconeIndex
+from genai.embedding_cache import EmbeddingCache
+from genai.eyfs import get_embeddings
+from genai.eyfs import set_embedding_cache
+from genai.index_manifest import content_id
+from genai.vector_index import get_vector_index
 
 
 load_dotenv()
@@ -18,20 +23,30 @@ load_dotenv()
 openai.api_key = os.environ["OPENAI_API_KEY"]
 INDEX_NAME = "eyfs-index"
 ENCODER_NAME = "text-embedding-ada-002"
+# Only new or changed texts are sent to the API on rebuilds
+EMBEDDING_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH", ".cache/embeddings")
+
+
+def embed(items: List[dict]) -> np.ndarray:
+    """Encode the text of the items in batched requests."""
+    return get_embeddings([item["text"] for item in items], model=ENCODER_NAME)
+
 
 if "__main__" == __name__:
+    set_embedding_cache(EmbeddingCache(EMBEDDING_CACHE_PATH))
+
     df = pd.read_csv(os.environ["PATH_TO_NHS_DATA"])
     df = df.groupby("URL").apply(lambda group: "\n\n".join(group["header"] + "\n" + group["content"]))
     df = df.reset_index()
     df.columns = ["URL", "content"]
 
-    # Format the data to what pinecone needs and generate a temp uuid
+    # Derive stable ids from the content, only new or changed pages are encoded and upserted
     docs = []
     for tup in df.itertuples():
         doc = tuple(
             (
-                str(uuid.uuid4()),
-                get_embedding(tup.content),
+                content_id("nhs_full_page", tup.URL),
+                None,
                 {
                     "source": "nhs_full_page",
                     "text": tup.content,
@@ -42,7 +57,7 @@ if "__main__" == __name__:
         docs.append(doc)
 
     # Build the index
-    conn = PineconeIndex(api_key=os.environ["PINECONE_API_KEY"], environment=os.environ["PINECONE_REGION"])
+    conn = get_vector_index(api_key=os.environ.get("PINECONE_API_KEY"), environment=os.environ.get("PINECONE_REGION"))
 
     conn.build_and_upsert(
         index_name=INDEX_NAME,
@@ -51,4 +66,7 @@ if "__main__" == __name__:
         docs=docs,
         metadata_config={"indexed": ["areas_of_learning", "source", "type_", "age_group"]},
         batch_size=40,
+        manifest="nhs_full_page",
+        embed=embed,
+        namespace="nhs_full_page",
     )
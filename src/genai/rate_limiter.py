@@ -0,0 +1,167 @@
+"""Process-wide token-bucket rate limiter for the OpenAI API.
+
+Every call budgets both requests per minute (RPM) and tokens per minute (TPM) for its model
+and waits up front until there is capacity, instead of backing off after a `RateLimitError`.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+
+from genai.message_history import TokenCounter
+from genai.message_history import get_encoding
+
+
+# (RPM, TPM) per model. Models are matched by their longest prefix, e.g. "gpt-4-1106-preview" uses "gpt-4".
+# Override with the OPENAI_RATE_LIMITS environment variable, e.g. '{"gpt-4": [500, 30000]}'.
+DEFAULT_LIMITS = {
+    "gpt-3.5-turbo": (3500, 90000),
+    "gpt-4": (500, 10000),
+    "text-embedding-ada-002": (3000, 1000000),
+}
+
+# Tokens budgeted for the completion when the request does not set `max_tokens`
+DEFAULT_COMPLETION_TOKENS = 256
+
+
+class TokenBucket:
+    """Thread-safe token bucket that refills continuously at a per-minute rate."""
+
+    def __init__(self, rate_per_minute: float, burst_seconds: float = 10.0) -> None:
+        """Initialise a full bucket holding `burst_seconds` worth of capacity."""
+        self.rate = rate_per_minute / 60
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        """Take `amount` from the bucket and return how many seconds to wait before using it.
+
+        The bucket can go into debt, so requests larger than the capacity wait proportionally longer
+        and concurrent callers are served in the order they reserved.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            self.tokens -= amount
+            return max(0.0, -self.tokens / self.rate)
+
+
+class RateLimiter:
+    """Budget requests and tokens per model."""
+
+    def __init__(self, limits: Optional[Dict[str, Tuple[int, int]]] = None, burst_seconds: float = 10.0) -> None:
+        """Initialise the limiter.
+
+        Parameters
+        ----------
+        limits
+            (RPM, TPM) per model name prefix. Models without a matching prefix are not limited.
+
+        burst_seconds
+            Seconds worth of capacity that can be used in a burst.
+
+        """
+        self.limits = dict(DEFAULT_LIMITS if limits is None else limits)
+        self.burst_seconds = burst_seconds
+        self._buckets: Dict[str, Tuple[TokenBucket, TokenBucket]] = {}
+        self._lock = threading.Lock()
+
+    def set_limits(self, model: str, rpm: int, tpm: int) -> None:
+        """Set the limits of a model (prefix), e.g. to match the account's tier."""
+        with self._lock:
+            self.limits[model] = (rpm, tpm)
+            self._buckets.pop(model, None)
+
+    def _match(self, model: str) -> Optional[str]:
+        prefixes = [prefix for prefix in self.limits if model.startswith(prefix)]
+        return max(prefixes, key=len) if prefixes else None
+
+    def reserve(self, model: str, tokens: int) -> float:
+        """Reserve one request and `tokens` tokens and return the seconds to wait before sending it."""
+        prefix = self._match(model)
+        if prefix is None:
+            return 0.0
+
+        with self._lock:
+            if prefix not in self._buckets:
+                rpm, tpm = self.limits[prefix]
+                self._buckets[prefix] = (
+                    TokenBucket(rpm, self.burst_seconds),
+                    TokenBucket(tpm, self.burst_seconds),
+                )
+            requests, token_bucket = self._buckets[prefix]
+
+        return max(requests.reserve(1), token_bucket.reserve(tokens))
+
+    def acquire(self, model: str, tokens: int) -> None:
+        """Block until the request fits in the model's budget."""
+        wait = self.reserve(model, tokens)
+        if wait:
+            time.sleep(wait)
+
+    async def aacquire(self, model: str, tokens: int) -> None:
+        """Wait without blocking the event loop until the request fits in the model's budget."""
+        wait = self.reserve(model, tokens)
+        if wait:
+            await asyncio.sleep(wait)
+
+
+def _counting_model(model: str) -> str:
+    """Return a model name tiktoken knows, falling back to the cl100k_base encoding of gpt-3.5-turbo."""
+    try:
+        get_encoding(model)
+        return model
+    except KeyError:
+        return "gpt-3.5-turbo"
+
+
+def estimate_chat_tokens(
+    messages: List[Dict],
+    model: str,
+    max_tokens: Optional[int] = None,
+    functions: Optional[List[Dict]] = None,
+) -> int:
+    """Estimate the tokens a chat completion counts against the TPM limit: prompt plus completion budget."""
+    counting_model = _counting_model(model)
+    # Skip empty fields, e.g. the content of a function call
+    prompt = [{k: v for k, v in message.items() if isinstance(v, str)} for message in messages]
+    num_tokens = TokenCounter._count_tokens_from_messages(prompt, counting_model)
+    if functions:
+        num_tokens += TokenCounter._count_tokens_from_string(json.dumps(functions), counting_model)
+
+    return num_tokens + (max_tokens or DEFAULT_COMPLETION_TOKENS)
+
+
+def estimate_embedding_tokens(texts: List[str], model: str) -> int:
+    """Estimate the tokens an embedding request counts against the TPM limit."""
+    return int(count_embedding_tokens(texts, model).sum())
+
+
+def count_embedding_tokens(texts: List[str], model: str) -> np.ndarray:
+    """Return the number of tokens of each text of an embedding request, counted in one batch."""
+    return TokenCounter.count_tokens(texts, _counting_model(model))
+
+
+def _limits_from_env() -> Optional[Dict[str, Tuple[int, int]]]:
+    overrides = os.environ.get("OPENAI_RATE_LIMITS")
+    if not overrides:
+        return None
+
+    limits = dict(DEFAULT_LIMITS)
+    limits.update({model: tuple(limit) for model, limit in json.loads(overrides).items()})
+    return limits
+
+
+# Shared by every OpenAI call in the process
+rate_limiter = RateLimiter(_limits_from_env())
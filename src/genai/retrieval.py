@@ -0,0 +1,493 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any
+from typing import Callable
+from typing import Hashable
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Union
+
+import numpy as np
+import pinecone
+
+from genai.bm25 import BM25Index
+from genai.eyfs import get_embeddings
+from genai.local_index import LocalIndex
+from genai.retrieval_cache import RetrievalCache
+
+
+def query_many(
+    index: Union[pinecone.index.Index, LocalIndex],
+    vectors: Union[np.ndarray, List[List[float]]],
+    filters: Union[None, dict, List[Optional[dict]]] = None,
+    top_k: int = 5,
+    include_metadata: bool = True,
+    include_values: bool = False,
+    max_workers: int = 8,
+    namespace: Optional[str] = None,
+) -> List[Any]:
+    """Run several queries at once and return one result per vector.
+
+    Local indexes score the queries with a single matrix product, remote indexes are queried concurrently.
+
+    Parameters
+    ----------
+    index
+        Pinecone or local index.
+
+    vectors
+        Query vectors.
+
+    filters
+        A filter shared by all queries, or one filter per query.
+
+    top_k
+        Number of results per query.
+
+    include_metadata
+        Whether to return the metadata of the matches.
+
+    include_values
+        Whether to return the vectors of the matches.
+
+    max_workers
+        Number of concurrent requests to a remote index.
+
+    namespace
+        Namespace to search, e.g. a source. Defaults to the default namespace.
+
+    Returns
+    -------
+    results
+        The query results, in the order of the vectors.
+
+    """
+    if isinstance(index, LocalIndex):
+        return index.query_many(vectors, top_k, include_metadata, include_values, filters, namespace=namespace)
+
+    if filters is None or isinstance(filters, dict):
+        filters = [filters] * len(vectors)
+
+    def _query(vector: Sequence[float], filter: Optional[dict]) -> Any:
+        return index.query(
+            vector=np.asarray(vector).tolist(),
+            top_k=top_k,
+            include_metadata=include_metadata,
+            include_values=include_values,
+            filter=filter,
+            namespace=namespace,
+        )
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(vectors)))) as executor:
+        return list(executor.map(_query, vectors, filters))
+
+
+@lru_cache(maxsize=None)
+def _pinecone_metric(index_name: str) -> str:
+    return pinecone.describe_index(index_name).metric
+
+
+def index_metric(index: Union[pinecone.index.Index, LocalIndex]) -> str:
+    """Return the distance metric of a local or Pinecone index, asking Pinecone once per index."""
+    if isinstance(index, LocalIndex):
+        return index.metric
+    if isinstance(index, pinecone.index.Index):
+        return _pinecone_metric(index.configuration.server_variables["index_name"])
+    raise ValueError(f"Cannot tell the metric of a {type(index).__name__}, pass it explicitly.")
+
+
+def merge_matches(
+    results: List[Any],
+    higher_is_better: bool = True,
+    key: Callable[[Any], Hashable] = lambda match: match["id"],
+) -> List[Any]:
+    """Merge the matches of several queries, keep the best scoring copy of duplicates and rank them.
+
+    Parameters
+    ----------
+    results
+        Query results.
+
+    higher_is_better
+        Whether higher scores are better. False for euclidean indexes, whose scores are distances.
+
+    key
+        Identity of a match, e.g. `lambda match: match["metadata"]["text"]` to deduplicate by text.
+
+    Returns
+    -------
+    matches
+        The deduplicated matches, best first.
+
+    """
+    best = {}
+    for result in results:
+        for match in result["matches"]:
+            k = key(match)
+            score = match["score"] if higher_is_better else -match["score"]
+            if k not in best or score > best[k][0]:
+                best[k] = (score, match)
+
+    return [match for _, match in sorted(best.values(), key=lambda item: item[0], reverse=True)]
+
+
+def query_namespaces(
+    index: Union[pinecone.index.Index, LocalIndex],
+    vector: Sequence[float],
+    namespaces: List[str],
+    top_k: int = 5,
+    filter: Optional[dict] = None,
+    include_metadata: bool = True,
+    include_values: bool = False,
+    metric: Optional[str] = None,
+) -> dict:
+    """Query several namespaces in parallel and merge their matches, e.g. to search across sources.
+
+    Parameters
+    ----------
+    index
+        Pinecone or local index.
+
+    vector
+        Query vector.
+
+    namespaces
+        Namespaces to search.
+
+    top_k
+        Number of results.
+
+    filter
+        Metadata filter applied in every namespace.
+
+    include_metadata
+        Whether to return the metadata of the matches.
+
+    include_values
+        Whether to return the vectors of the matches.
+
+    metric
+        Distance metric of the index, which tells whether higher scores are better. Read from the index if not set.
+
+    Returns
+    -------
+    result
+        The `top_k` best matches of all namespaces, like the result of `index.query`.
+
+    """
+
+    def _query(namespace: str) -> Any:
+        return index.query(
+            vector=np.asarray(vector).tolist(),
+            top_k=top_k,
+            include_metadata=include_metadata,
+            include_values=include_values,
+            filter=filter,
+            namespace=namespace,
+        )
+
+    with ThreadPoolExecutor(max_workers=max(1, len(namespaces))) as executor:
+        results = list(executor.map(_query, namespaces))
+
+    # Ids are only unique within a namespace, so the matches are ranked without deduplicating them
+    matches = [match for result in results for match in result["matches"]]
+    matches.sort(key=lambda match: match["score"], reverse=(metric or index_metric(index)) != "euclidean")
+    return {"matches": matches[:top_k]}
+
+
+def _normalise(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def mmr(query_vectors: np.ndarray, vectors: np.ndarray, k: int, lambda_mult: float = 0.5) -> List[int]:
+    """Select `k` relevant but diverse vectors with maximal marginal relevance.
+
+    Each step picks the vector maximising `lambda_mult * relevance - (1 - lambda_mult) * redundancy`,
+    where relevance is its highest cosine similarity to the queries and redundancy its highest cosine
+    similarity to the vectors already picked. All similarities come from two matrix products.
+
+    Parameters
+    ----------
+    query_vectors
+        A query vector, or one row per query.
+
+    vectors
+        Candidate vectors, one row per candidate.
+
+    k
+        Number of candidates to select.
+
+    lambda_mult
+        Trade-off between relevance (1) and diversity (0).
+
+    Returns
+    -------
+    selected
+        Positions of the selected candidates, in the order they were picked.
+
+    """
+    vectors = _normalise(np.asarray(vectors, dtype=np.float32))
+    queries = _normalise(np.atleast_2d(np.asarray(query_vectors, dtype=np.float32)))
+    relevance = (vectors @ queries.T).max(axis=1)
+    similarity = vectors @ vectors.T
+
+    selected: List[int] = []
+    redundancy = np.zeros(len(vectors), dtype=np.float32)
+    available = np.ones(len(vectors), dtype=bool)
+    for _ in range(min(k, len(vectors))):
+        scores = np.where(available, lambda_mult * relevance - (1 - lambda_mult) * redundancy, -np.inf)
+        i = int(np.argmax(scores))
+        selected.append(i)
+        available[i] = False
+        redundancy = similarity[i] if len(selected) == 1 else np.maximum(redundancy, similarity[i])
+    return selected
+
+
+def mmr_rerank(query_vectors: np.ndarray, matches: List[Any], k: int, lambda_mult: float = 0.5) -> List[Any]:
+    """Select `k` diverse matches with `mmr`. The matches must include their values."""
+    if not matches:
+        return []
+
+    vectors = np.array([match["values"] for match in matches], dtype=np.float32)
+    return [matches[i] for i in mmr(query_vectors, vectors, k, lambda_mult)]
+
+
+def search(
+    index: Union[pinecone.index.Index, LocalIndex],
+    queries: Sequence[Union[str, Sequence[float]]],
+    filters: Union[None, dict, List[Optional[dict]]] = None,
+    top_k: int = 5,
+    include_values: bool = False,
+    key: Callable[[Any], Hashable] = lambda match: match["id"],
+    model: str = "text-embedding-ada-002",
+    mmr_k: Optional[int] = None,
+    mmr_lambda: float = 0.5,
+    cache: Optional[RetrievalCache] = None,
+    namespace: Optional[str] = None,
+    metric: Optional[str] = None,
+) -> List[Any]:
+    """Search the index for several queries and return their merged, deduplicated matches, best first.
+
+    Text queries are embedded with a single batched call. With `mmr_k`, the merged matches are re-ranked
+    with maximal marginal relevance and only the `mmr_k` most relevant yet diverse ones are returned.
+
+    Parameters
+    ----------
+    index
+        Pinecone or local index.
+
+    queries
+        Query texts or vectors.
+
+    filters
+        A filter shared by all queries, or one filter per query.
+
+    top_k
+        Number of results per query.
+
+    include_values
+        Whether to return the vectors of the matches.
+
+    key
+        Identity of a match used to deduplicate them.
+
+    model
+        Embedding model of the text queries.
+
+    mmr_k
+        Number of matches to select with maximal marginal relevance.
+
+    mmr_lambda
+        Trade-off between relevance (1) and diversity (0) of the selection.
+
+    cache
+        Cache of the matches of each query. Queries found in it are neither embedded nor searched.
+
+    namespace
+        Namespace to search, e.g. a source. Defaults to the default namespace.
+
+    metric
+        Distance metric of the index, which tells whether higher scores are better. Read from the index if not set.
+
+    Returns
+    -------
+    matches
+        The deduplicated matches of all queries, best first.
+
+    """
+    if not queries:
+        return []
+
+    if filters is None or isinstance(filters, dict):
+        filters = [filters] * len(queries)
+    include_values = include_values or mmr_k is not None
+
+    vectors = [np.asarray(query, dtype=np.float32) if not isinstance(query, str) else None for query in queries]
+    results = [None] * len(queries)
+    keys = [None] * len(queries)
+    if cache is not None:
+        for i, query in enumerate(queries):
+            keys[i] = cache.make_key(
+                index, query, filter=filters[i], top_k=top_k, include_values=include_values, namespace=namespace
+            )
+            cached = cache.get(keys[i])
+            if cached is not None:
+                results[i] = {"matches": cached["matches"]}
+                if cached["vector"] is not None:
+                    vectors[i] = np.asarray(cached["vector"], dtype=np.float32)
+
+    misses = [i for i, result in enumerate(results) if result is None]
+    texts = [i for i in misses if vectors[i] is None]
+    if texts:
+        embeddings = get_embeddings([queries[i] for i in texts], model=model)
+        for i, embedding in zip(texts, embeddings):
+            vectors[i] = embedding
+
+    if misses:
+        missed = query_many(
+            index,
+            np.stack([vectors[i] for i in misses]),
+            [filters[i] for i in misses],
+            top_k,
+            include_values=include_values,
+            namespace=namespace,
+        )
+        for i, result in zip(misses, missed):
+            results[i] = result
+            if cache is not None:
+                cache.set(keys[i], result["matches"], vectors[i] if isinstance(queries[i], str) else None)
+
+    vectors = np.stack(vectors)
+    metric = metric or index_metric(index)
+    matches = merge_matches(results, higher_is_better=metric != "euclidean", key=key)
+    if mmr_k is not None:
+        matches = mmr_rerank(vectors, matches, mmr_k, mmr_lambda)
+    return matches
+
+
+def reciprocal_rank_fusion(
+    rankings: List[List[Any]], k: int = 60, weights: Optional[List[float]] = None
+) -> List[dict]:
+    """Fuse ranked lists of matches by summing `weight / (k + rank)` over the lists each match appears in.
+
+    Parameters
+    ----------
+    rankings
+        Lists of matches, best first.
+
+    k
+        Damping constant. Higher values flatten the contribution of the top ranks.
+
+    weights
+        Weight of each list. Defaults to 1.
+
+    Returns
+    -------
+    matches
+        The fused matches, best first, with their fused score.
+
+    """
+    weights = weights or [1.0] * len(rankings)
+    scores = {}
+    matches = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, match in enumerate(ranking, start=1):
+            scores[match["id"]] = scores.get(match["id"], 0.0) + weight / (k + rank)
+            matches.setdefault(match["id"], match)
+
+    return [
+        {"id": id_, "score": score, "metadata": matches[id_]["metadata"]}
+        for id_, score in sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    ]
+
+
+def hybrid_search(
+    index: Union[pinecone.index.Index, LocalIndex],
+    bm25_index: Optional[BM25Index],
+    text: str,
+    vector: Sequence[float],
+    filter: Optional[dict] = None,
+    top_k: int = 5,
+    num_candidates: int = 20,
+    rrf_k: int = 60,
+    namespace: Optional[str] = None,
+    cache: Optional[RetrievalCache] = None,
+) -> List[Any]:
+    """Search the vector index and the BM25 index and fuse their results with reciprocal rank fusion.
+
+    Falls back to vector search when there is no BM25 index.
+
+    Parameters
+    ----------
+    index
+        Pinecone or local index.
+
+    bm25_index
+        BM25 index over the same documents, or None. It is built from a snapshot and can lag behind the
+        vector index, so its matches that the vector index no longer has are dropped.
+
+    text
+        The query.
+
+    vector
+        The embedding of the query.
+
+    filter
+        Metadata filter applied to both searches.
+
+    top_k
+        Number of results.
+
+    num_candidates
+        Number of results of each search that are fused.
+
+    rrf_k
+        Damping constant of the reciprocal rank fusion.
+
+    namespace
+        Namespace of the vector search, e.g. a source. The BM25 index covers all namespaces, use `filter` to
+        restrict it to the same documents.
+
+    cache
+        Cache of the fused matches, keyed by the query text. A hit skips both searches.
+
+    Returns
+    -------
+    matches
+        The best matches, best first.
+
+    """
+    if cache is not None:
+        key = cache.make_key(
+            index,
+            text,
+            filter=filter,
+            top_k=top_k,
+            num_candidates=num_candidates,
+            rrf_k=rrf_k,
+            namespace=namespace,
+            lexical=bm25_index is not None,
+        )
+        cached = cache.get(key)
+        if cached is not None:
+            return cached["matches"]
+
+    if bm25_index is None:
+        matches = index.query(
+            vector=list(vector), top_k=top_k, include_metadata=True, filter=filter, namespace=namespace
+        )["matches"]
+    else:
+        semantic = index.query(
+            vector=list(vector), top_k=num_candidates, include_metadata=True, filter=filter, namespace=namespace
+        )
+        lexical = bm25_index.search(text, top_k=num_candidates, filter=filter)
+        if lexical:
+            # Ids are content hashes, so docs removed or changed by a later build are missing from the vector index
+            current = index.fetch(ids=[match["id"] for match in lexical], namespace=namespace)["vectors"]
+            lexical = [match for match in lexical if match["id"] in current]
+        matches = reciprocal_rank_fusion([semantic["matches"], lexical], k=rrf_k)[:top_k]
+
+    if cache is not None:
+        cache.set(key, matches)
+    return matches
@@ -0,0 +1,339 @@
+"""Benchmark the latency and recall of the retrieval backends on a snapshot of an index.
+
+The query sets (parenting questions, Development Matters learning goals and BBC activity titles) are
+replayed against `index.query`-compatible backends built from the same snapshot:
+- exact: brute-force local index, the ground truth of recall@k
+- ivf: local index with an IVF index
+- hybrid: exact vector search fused with BM25
+- remote: the exact local index behind a simulated network round trip, standing in for Pinecone
+- pinecone: a live Pinecone index, with --pinecone-index
+
+The report has the p50/p95/p99 latency, the throughput, the memory used to build each backend and the
+recall@k against exact search. Query embeddings are read from the embedding cache, so once it is
+filled the benchmark runs offline and reproducibly.
+
+Usage: Run the script from the repo root directory
+$ python src/genai/retrieval_benchmark.py snapshots/eyfs-index.npz
+$ python src/genai/retrieval_benchmark.py snapshots/eyfs-index.npz --offline --output benchmark.json
+"""
+import argparse
+import json
+import os
+import time
+import tracemalloc
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from genai.bm25 import BM25Index
+from genai.embedding_cache import EmbeddingCache
+from genai.eyfs import get_embeddings
+from genai.eyfs import set_embedding_cache
+from genai.index_snapshot import IndexSnapshot
+from genai.local_index import LocalIndex
+from genai.retrieval import hybrid_search
+from genai.utils import read_json
+
+
+QUESTIONS_PATH = "src/genai/parenting_chatbot/prodigy_eval/data/questions.jsonl"
+DM_PATH = "src/genai/dm/dm.json"
+
+# Takes a query set, the query text and its embedding, returns the ids of the matches, best first
+Search = Callable[["QuerySet", str, np.ndarray, int], List[str]]
+
+
+@dataclass
+class QuerySet:
+    """Queries replayed against a source, e.g. parenting questions against the NHS pages."""
+
+    name: str
+    texts: List[str]
+    source: str
+
+    @property
+    def filter(self) -> dict:
+        """Return the metadata filter of the source."""
+        return {"source": {"$eq": self.source}}
+
+
+class RemoteStandIn:
+    """Local index that waits for a simulated network round trip before each query."""
+
+    def __init__(self, index: LocalIndex, latency: float) -> None:
+        """Wrap the index, adding `latency` seconds to each query."""
+        self.index = index
+        self.latency = latency
+
+    def query(self, *args, **kwargs) -> dict:
+        """Query the index like `pinecone.Index.query`."""
+        time.sleep(self.latency)
+        return self.index.query(*args, **kwargs)
+
+
+def load_query_sets(
+    snapshot: IndexSnapshot,
+    questions_path: str = QUESTIONS_PATH,
+    dm_path: str = DM_PATH,
+    max_queries: int = 200,
+    seed: int = 0,
+) -> List[QuerySet]:
+    """Return the parenting, DM and BBC query sets, each sampled down to `max_queries` queries.
+
+    BBC activity titles are read from the snapshot, so that set is empty when the index has no BBC activities.
+    """
+    questions = [row["question"] for row in read_json(questions_path, lines=True)]
+    learning_goals = [
+        goal
+        for area in read_json(dm_path)
+        if area["area_of_learning"]
+        for age_group in area["age_group"].values()
+        for goal in age_group["learning_goals"]
+    ]
+    titles = sorted(
+        {
+            metadata["title"]
+            for metadata in snapshot.metadata
+            if metadata.get("source") == "BBC" and isinstance(metadata.get("title"), str)
+        }
+    )
+
+    rng = np.random.default_rng(seed)
+    query_sets = []
+    for name, texts, source in [
+        ("parenting", questions, "nhs_full_page"),
+        ("dm", learning_goals, "dm"),
+        ("bbc", titles, "BBC"),
+    ]:
+        texts = list(dict.fromkeys(texts))
+        if len(texts) > max_queries:
+            texts = [texts[i] for i in sorted(rng.choice(len(texts), max_queries, replace=False))]
+        if texts:
+            query_sets.append(QuerySet(name, texts, source))
+    return query_sets
+
+
+def embed_queries(texts: List[str], model: str = "text-embedding-ada-002", offline: bool = False) -> np.ndarray:
+    """Embed the queries, reading them from the embedding cache only when `offline` is set."""
+    if not offline:
+        return get_embeddings(texts, model=model)
+
+    cache = EmbeddingCache(os.environ.get("EMBEDDING_CACHE_PATH", ".cache/embeddings"))
+    embeddings, found = cache.get_many([text.replace("\n", " ") for text in texts], model)
+    if not found.all():
+        raise ValueError(f"{int((~found).sum())} queries are not in the embedding cache, run once without --offline.")
+    return embeddings
+
+
+def _namespace(namespaces: set, source: str) -> Optional[str]:
+    """Return the namespace of a source, or None if the index keeps every source in the default namespace."""
+    return source if source in namespaces else None
+
+
+def _vector_search(index: Any, snapshot: IndexSnapshot, **kwargs) -> Search:
+    namespaces = set(snapshot.namespaces)
+
+    def search(query_set: QuerySet, text: str, vector: np.ndarray, top_k: int) -> List[str]:
+        result = index.query(
+            vector=vector.tolist(),
+            top_k=top_k,
+            include_metadata=True,
+            filter=query_set.filter,
+            namespace=_namespace(namespaces, query_set.source),
+            **kwargs,
+        )
+        return [match["id"] for match in result["matches"]]
+
+    return search
+
+
+def backend_factories(
+    snapshot: IndexSnapshot,
+    nprobe: int = 8,
+    nlist: Optional[int] = None,
+    remote_latency: float = 0.05,
+    pinecone_index: Optional[str] = None,
+) -> Dict[str, Callable[[], Search]]:
+    """Return functions that build each backend from the snapshot, so their memory can be measured.
+
+    Parameters
+    ----------
+    snapshot
+        Snapshot of the index.
+
+    nprobe
+        Number of clusters scored per query by the IVF backend.
+
+    nlist
+        Number of clusters of the IVF backend. Defaults to 4 * sqrt(number of vectors) per namespace.
+
+    remote_latency
+        Seconds of simulated network round trip of the remote stand-in.
+
+    pinecone_index
+        Name of a live Pinecone index with the same contents to benchmark, if any.
+
+    """
+    # The indexes are never flushed, the path is only a label
+    path = os.path.join(".cache", "benchmark")
+
+    def exact() -> Search:
+        return _vector_search(LocalIndex.from_snapshot(path, snapshot), snapshot, exact=True)
+
+    def ivf() -> Search:
+        index = LocalIndex.from_snapshot(path, snapshot)
+        for namespace in set(snapshot.namespaces) or {""}:
+            shard = index.namespace(namespace)
+            if len(shard):
+                shard.build_ivf(nlist, nprobe)
+        return _vector_search(index, snapshot)
+
+    def hybrid() -> Search:
+        index = LocalIndex.from_snapshot(path, snapshot)
+        bm25_index = BM25Index.from_snapshot(snapshot)
+        namespaces = set(snapshot.namespaces)
+
+        def search(query_set: QuerySet, text: str, vector: np.ndarray, top_k: int) -> List[str]:
+            matches = hybrid_search(
+                index,
+                bm25_index,
+                text,
+                vector,
+                filter=query_set.filter,
+                top_k=top_k,
+                namespace=_namespace(namespaces, query_set.source),
+            )
+            return [match["id"] for match in matches]
+
+        return search
+
+    def remote() -> Search:
+        return _vector_search(RemoteStandIn(LocalIndex.from_snapshot(path, snapshot), remote_latency), snapshot)
+
+    factories = {"exact": exact, "ivf": ivf, "hybrid": hybrid, "remote": remote}
+    if pinecone_index is not None:
+        from genai.vector_index import PineconeIndex
+
+        factories["pinecone"] = lambda: _vector_search(PineconeIndex().connect(pinecone_index), snapshot)
+    return factories
+
+
+def run_benchmark(
+    query_sets: List[QuerySet],
+    embeddings: Dict[str, np.ndarray],
+    factories: Dict[str, Callable[[], Search]],
+    top_k: int = 10,
+    repeat: int = 3,
+    concurrency: int = 8,
+) -> pd.DataFrame:
+    """Replay the query sets against each backend and compare their matches with exact search.
+
+    Parameters
+    ----------
+    query_sets
+        Query sets to replay.
+
+    embeddings
+        Embeddings of the queries of each query set, by query set name.
+
+    factories
+        Functions building the backends, by backend name. Recall is measured against "exact".
+
+    top_k
+        Number of matches per query.
+
+    repeat
+        Number of times the queries are replayed one by one to measure latency.
+
+    concurrency
+        Number of concurrent queries when measuring throughput.
+
+    Returns
+    -------
+    report
+        One row per backend and query set.
+
+    """
+    expected: Dict[str, List[set]] = {}
+    rows = []
+    for backend, factory in factories.items():
+        tracemalloc.start()
+        search = factory()
+        memory = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+
+        for query_set in query_sets:
+            queries = list(zip(query_set.texts, embeddings[query_set.name]))
+            search(query_set, *queries[0], top_k)  # Warm up caches and lazily built posting lists
+
+            latencies = []
+            for _ in range(repeat):
+                for text, vector in queries:
+                    start = time.perf_counter()
+                    search(query_set, text, vector, top_k)
+                    latencies.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                found = list(executor.map(lambda query: search(query_set, *query, top_k), queries))
+            throughput = len(queries) / (time.perf_counter() - start)
+
+            found = [set(ids) for ids in found]
+            expected.setdefault(query_set.name, found)
+            recall = np.mean([len(f & e) / max(len(e), 1) for f, e in zip(found, expected[query_set.name])])
+            p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+            rows.append(
+                {
+                    "backend": backend,
+                    "query_set": query_set.name,
+                    "queries": len(queries),
+                    "p50_ms": p50,
+                    "p95_ms": p95,
+                    "p99_ms": p99,
+                    "qps": throughput,
+                    "memory_mb": memory,
+                    f"recall@{top_k}": recall,
+                }
+            )
+    return pd.DataFrame(rows)
+
+
+if "__main__" == __name__:
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Benchmark the retrieval backends on an index snapshot.")
+    parser.add_argument("snapshot", help="Snapshot of the index, see genai/index_snapshot.py.")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--max-queries", type=int, default=200, help="Queries sampled per query set.")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--nprobe", type=int, default=8)
+    parser.add_argument("--nlist", type=int, default=None)
+    parser.add_argument("--remote-latency-ms", type=float, default=50.0)
+    parser.add_argument("--pinecone-index", default=None, help="Also benchmark this live Pinecone index.")
+    parser.add_argument("--offline", action="store_true", help="Fail instead of embedding uncached queries.")
+    parser.add_argument("--output", default=None, help="Path of a JSON report.")
+    args = parser.parse_args()
+
+    set_embedding_cache(EmbeddingCache(os.environ.get("EMBEDDING_CACHE_PATH", ".cache/embeddings")))
+    snapshot = IndexSnapshot.load(args.snapshot)
+    query_sets = load_query_sets(snapshot, max_queries=args.max_queries)
+    embeddings = {query_set.name: embed_queries(query_set.texts, offline=args.offline) for query_set in query_sets}
+    factories = backend_factories(
+        snapshot, args.nprobe, args.nlist, args.remote_latency_ms / 1000, pinecone_index=args.pinecone_index
+    )
+    report = run_benchmark(query_sets, embeddings, factories, args.top_k, args.repeat, args.concurrency)
+
+    print(report.to_string(index=False, float_format="%.2f"))  # noqa: T001
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report.to_dict(orient="records"), f, indent=2)
@@ -0,0 +1,139 @@
+import hashlib
+import threading
+import time
+
+from collections import OrderedDict
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+from typing import Union
+
+import numpy as np
+
+from genai.cache import ResponseCache
+from genai.local_index import LocalIndex
+
+
+def index_version(index: Any) -> str:
+    """Return a string that changes when the index is rebuilt.
+
+    Local indexes get a new version on every change. Pinecone does not expose one, so the vector counts
+    are used instead; updates that keep the counts unchanged are only picked up when entries expire.
+    """
+    if isinstance(index, LocalIndex):
+        return index.version
+
+    stats = index.describe_index_stats()
+    namespaces = {name: namespace["vector_count"] for name, namespace in stats["namespaces"].items()}
+    return ResponseCache.make_key(total=stats["total_vector_count"], namespaces=namespaces)
+
+
+class RetrievalCache:
+    """Cache the matches of vector searches, keyed by query, filter, top_k and index version.
+
+    Text queries are keyed by their text, so a hit skips both the embedding call and the search. Vector
+    queries are keyed by the vector rounded to `precision` decimals. Entries live in an in-memory LRU
+    and, optionally, in a `ResponseCache` on disk shared by the processes of the machine. Rebuilding the
+    index changes its version, so stale entries are never returned and age out of both tiers.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl: Optional[float] = 60 * 60,
+        path: Optional[str] = None,
+        version_ttl: float = 60.0,
+        precision: int = 4,
+    ) -> None:
+        """Initialise the cache.
+
+        Parameters
+        ----------
+        max_entries
+            Number of entries kept in memory.
+
+        ttl
+            Seconds after which an entry expires. None means entries never expire.
+
+        path
+            Path to the SQLite file of the shared on-disk tier. None disables it.
+
+        version_ttl
+            Seconds between two checks of the version of an index.
+
+        precision
+            Decimals kept when hashing query vectors.
+
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.version_ttl = version_ttl
+        self.precision = precision
+        self.disk = ResponseCache(path, ttl=ttl) if path else None
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._versions: Dict[int, Tuple[float, str]] = {}
+        self._lock = threading.Lock()
+
+    def _version(self, index: Any) -> str:
+        now = time.monotonic()
+        checked_at, version = self._versions.get(id(index), (-np.inf, ""))
+        if now - checked_at > self.version_ttl:
+            version = index_version(index)
+            self._versions[id(index)] = (now, version)
+        return version
+
+    def make_key(self, index: Any, query: Union[str, Sequence[float]], **params) -> str:
+        """Hash the query, the search parameters and the index version into a key."""
+        if isinstance(query, str):
+            query_key = " ".join(query.lower().split())
+        else:
+            rounded = np.round(np.asarray(query, dtype=np.float32), self.precision) + 0.0  # Turn -0.0 into 0.0
+            query_key = hashlib.sha256(rounded.tobytes()).hexdigest()
+        return ResponseCache.make_key(query=query_key, version=self._version(index), **params)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the cached entry, with the "matches" and the query "vector" if it was stored, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (self.ttl is None or time.monotonic() - entry[0] <= self.ttl):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+        value = self.disk.get(key) if self.disk is not None else None
+        with self._lock:
+            if value is None:
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self.hits += 1
+        self._remember(key, value)
+        return value
+
+    def set(self, key: str, matches: List[Any], vector: Optional[Sequence[float]] = None) -> None:
+        """Store the matches of a search and, for text queries, the query vector."""
+        value = {
+            "matches": [match.to_dict() if hasattr(match, "to_dict") else dict(match) for match in matches],
+            "vector": None if vector is None else np.asarray(vector, dtype=np.float32).tolist(),
+        }
+        self._remember(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+
+    def _remember(self, key: str, value: Dict[str, Any]) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    @property
+    def hit_rate(self) -> float:
+        """Return the share of lookups that were served from the cache."""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
@@ -0,0 +1,154 @@
+import json
+import logging
+import os
+import threading
+
+from typing import List
+from typing import Optional
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+
+class SemanticCache:
+    """Serve stored answers to questions that are semantically similar to a new one.
+
+    Questions are kept as L2-normalised float32 vectors in memory, so a lookup is a single
+    matrix-vector product. When a path is given, entries are appended to disk and reloaded on start.
+    """
+
+    def __init__(self, path: Optional[str] = None, threshold: float = 0.95, dimension: int = 1536) -> None:
+        """Initialise the cache.
+
+        Parameters
+        ----------
+        path
+            Directory where the cache is persisted. None keeps it in memory only.
+
+        threshold
+            Minimum cosine similarity between two questions to serve the stored answer.
+
+        dimension
+            Length of the question embeddings.
+
+        """
+        self.path = path
+        self.threshold = threshold
+        self.dimension = dimension
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._vectors = np.empty((0, dimension), dtype=np.float32)
+        self._entries = []
+
+        if path:
+            os.makedirs(path, exist_ok=True)
+            self._load()
+
+    @property
+    def _vectors_path(self) -> str:
+        return os.path.join(self.path, "vectors.f32")
+
+    @property
+    def _entries_path(self) -> str:
+        return os.path.join(self.path, "entries.jsonl")
+
+    def _load(self) -> None:
+        """Read the persisted entries, ignoring a partially written last row."""
+        if not os.path.exists(self._entries_path):
+            return
+
+        with open(self._entries_path, "r") as f:
+            entries = [json.loads(line) for line in f]
+
+        vectors = np.fromfile(self._vectors_path, dtype=np.float32)
+        n = min(len(entries), vectors.size // self.dimension)
+        self._vectors = vectors[: n * self.dimension].reshape(n, self.dimension)
+        self._entries = entries[:n]
+
+    @staticmethod
+    def _normalise(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        return vector / max(np.linalg.norm(vector), 1e-12)
+
+    def lookup(self, embedding: List[float]) -> Optional[dict]:
+        """Return the stored entry of the most similar question above the threshold, or None.
+
+        The entry has the keys `question`, `answer`, `references`, `context` and `similarity`.
+        """
+        query = self._normalise(embedding)
+        with self._lock:
+            entry = None
+            if self._entries:
+                similarities = self._vectors @ query
+                i = int(np.argmax(similarities))
+                if similarities[i] >= self.threshold:
+                    entry = dict(self._entries[i], similarity=float(similarities[i]))
+
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        return entry
+
+    def add(
+        self,
+        question: str,
+        embedding: List[float],
+        answer: str,
+        references: Optional[List[str]] = None,
+        context: Optional[str] = None,
+    ) -> None:
+        """Store an answered question.
+
+        Parameters
+        ----------
+        question
+            The user's question.
+
+        embedding
+            The question's embedding, as used for the lookup.
+
+        answer
+            The generated answer.
+
+        references
+            URLs of the documents that were used to answer the question.
+
+        context
+            The retrieved text that was added to the prompt.
+
+        """
+        vector = self._normalise(embedding)
+        entry = {"question": question, "answer": answer, "references": references or [], "context": context}
+        with self._lock:
+            self._vectors = np.vstack([self._vectors, vector[None, :]])
+            self._entries.append(entry)
+            if self.path:
+                with open(self._vectors_path, "ab") as f:
+                    f.write(vector.tobytes())
+                with open(self._entries_path, "a") as f:
+                    f.write(f"{json.dumps(entry)}\n")
+
+    @property
+    def hit_rate(self) -> float:
+        """Share of lookups served from the cache."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def metrics(self) -> dict:
+        """Return the cache metrics."""
+        return {
+            "semantic_cache_hits": self.hits,
+            "semantic_cache_misses": self.misses,
+            "semantic_cache_hit_rate": self.hit_rate,
+            "semantic_cache_threshold": self.threshold,
+            "semantic_cache_size": len(self._entries),
+        }
+
+    def log_metrics(self) -> None:
+        """Log the cache metrics."""
+        logger.info(json.dumps(self.metrics()))
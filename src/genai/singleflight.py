@@ -0,0 +1,167 @@
+import threading
+
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+
+
+class _Call:
+    """An in-flight call whose result is shared by every caller with the same key."""
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class _Broadcast:
+    """Fan out a single iterator to many subscribers.
+
+    Items are buffered, so late subscribers replay the stream from the start. Whichever subscriber
+    needs the next item pulls it from the upstream iterator, so a slow or closed subscriber never
+    blocks the others. `subscribers` is counted by the owner, which closes the broadcast once the last
+    subscriber leaves.
+    """
+
+    def __init__(self, iterator: Iterator, on_done: Callable[[], None]) -> None:
+        self._iterator = iterator
+        self._on_done = on_done
+        self.subscribers = 0
+        self._items: List[Any] = []
+        self._done = False
+        self._error: Optional[BaseException] = None
+        self._producing = False
+        self._condition = threading.Condition()
+
+    def _produce(self) -> None:
+        try:
+            item = next(self._iterator)
+        except StopIteration:
+            self._finish()
+        except BaseException as e:
+            self._finish(e)
+        else:
+            with self._condition:
+                self._items.append(item)
+        finally:
+            with self._condition:
+                self._producing = False
+                self._condition.notify_all()
+
+    def _finish(self, error: Optional[BaseException] = None) -> None:
+        self._on_done()
+        with self._condition:
+            self._done = True
+            self._error = error
+
+    def close(self) -> None:
+        """Stop the stream and close the upstream iterator, e.g. its HTTP response, if it is not exhausted."""
+        with self._condition:
+            if self._done:
+                return
+            self._done = True
+            self._condition.notify_all()
+        close = getattr(self._iterator, "close", None)
+        if close is not None:
+            close()
+
+    def subscribe(self) -> Iterator:
+        """Iterate over the stream from its first item."""
+        i = 0
+        while True:
+            with self._condition:
+                while i >= len(self._items) and not self._done and self._producing:
+                    self._condition.wait()
+
+                produce = False
+                if i < len(self._items):
+                    item = self._items[i]
+                elif self._done:
+                    if self._error is not None:
+                        raise self._error
+                    return
+                else:
+                    produce = self._producing = True
+
+            if produce:
+                self._produce()
+                continue
+
+            i += 1
+            yield item
+
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key into a single upstream call.
+
+    Callers that arrive while a call is in flight wait for it and receive its result (or its exception).
+    The key is forgotten as soon as the call returns, so this deduplicates concurrent work only; use
+    `genai.cache.ResponseCache` to reuse results over time.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self._streams: Dict[str, _Broadcast] = {}
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        """Call `fn` unless a call with the same key is in flight, in which case wait for its result."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result
+
+    def do_stream(self, key: str, fn: Callable[[], Iterator]) -> Iterator:
+        """Subscribe to the stream returned by `fn`, sharing it with concurrent callers that use the same key.
+
+        The subscription starts with the first item requested. When every subscriber closes the stream
+        before its end, e.g. a rerun drops the generator, the upstream is closed and the key is forgotten.
+        """
+        with self._lock:
+            stream = self._streams.get(key)
+            if stream is None:
+                stream = self._streams[key] = _Broadcast(_lazy(fn), on_done=lambda: self._forget_stream(key, stream))
+            stream.subscribers += 1
+
+        try:
+            yield from stream.subscribe()
+        finally:
+            with self._lock:
+                stream.subscribers -= 1
+                abandoned = stream.subscribers == 0
+                if abandoned and self._streams.get(key) is stream:
+                    del self._streams[key]
+            if abandoned:
+                stream.close()
+
+    def _forget_stream(self, key: str, stream: _Broadcast) -> None:
+        with self._lock:
+            if self._streams.get(key) is stream:
+                del self._streams[key]
+
+
+def _lazy(fn: Callable[[], Iterator]) -> Iterator:
+    """Defer calling `fn` until the first item is requested."""
+    yield from fn()
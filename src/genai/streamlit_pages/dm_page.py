@@ -4,11 +4,10 @@ import streamlit as st
 
 from genai import MessageTemplate
 from genai.eyfs import TextGenerator
-from genai.eyfs import get_embedding
+from genai.retrieval import search
 from genai.streamlit_pages.utils import get_index
-from genai.streamlit_pages.utils import query_pinecone
+from genai.streamlit_pages.utils import get_retrieval_cache
 from genai.streamlit_pages.utils import reset_state
-from genai.streamlit_pages.utils import sample_docs
 from genai.utils import read_json
 
 
@@ -103,44 +102,45 @@ def eyfs_dm_kb(index_name: str = "eyfs-index", sidebar: bool = True) -> None:
                 )
 
             if st.button("**Search for activity examples**"):
-                results = []
-                for learning_goal in learning_goals:
-                    search_results = query_pinecone(
-                        index=index,
-                        encoded_query=get_embedding(learning_goal),
-                        filters={
-                            "areas_of_learning": {"$in": [areas_of_learning]},
-                            "source": {"$eq": "dm"},
-                            "age_group": {"$in": [age_groups]},
-                            "type_": {"$eq": "examples"},
-                        },
-                        top_n=n_examples,
-                    )
-                    results.extend(search_results)
-
-                results = list(set([result["metadata"]["text"] for result in results]))
-                idx = sample_docs(num_docs=len(results), n=n_examples)
-                results = [results[i] for i in idx]
+                results = search(
+                    index=index,
+                    queries=learning_goals,
+                    filters={
+                        "areas_of_learning": {"$in": [areas_of_learning]},
+                        "source": {"$eq": "dm"},
+                        "age_group": {"$in": [age_groups]},
+                        "type_": {"$eq": "examples"},
+                    },
+                    top_k=n_examples,
+                    key=lambda result: result["metadata"]["text"],
+                    mmr_k=n_examples,
+                    cache=get_retrieval_cache(),
+                    namespace="dm",
+                )
+
+                results = [result["metadata"]["text"] for result in results]
                 st.session_state["examples"] = "\n\n".join(results)
 
     elif choice == "Describe a learning goal":
         if age_groups:
             text_input = st.text_input(label="**Describe a learning goal**")
             if st.button("Search for learning goals"):
-                results = query_pinecone(
+                results = search(
                     index=index,
-                    encoded_query=get_embedding(text_input),
+                    queries=[text_input],
                     filters={
                         "source": {"$eq": "dm"},
                         "age_group": {"$in": [age_groups]},
                         "type_": {"$eq": "learning_goals"},
                     },
-                    top_n=n_examples,
+                    top_k=2 * n_examples,
+                    key=lambda result: result["metadata"]["text"],
+                    mmr_k=n_examples,
+                    cache=get_retrieval_cache(),
+                    namespace="dm",
                 )
 
-                results = list(set([result["metadata"]["text"] for result in results]))
-                idx = sample_docs(num_docs=len(results), n=n_examples)
-                results = [results[i] for i in idx]
+                results = [result["metadata"]["text"] for result in results]
                 st.session_state["learning_goals"] = "\n\n".join(results)
 
             if st.session_state["learning_goals"]:
@@ -149,23 +149,22 @@ def eyfs_dm_kb(index_name: str = "eyfs-index", sidebar: bool = True) -> None:
                     for result in st.session_state["learning_goals"].split("\n\n"):
                         st.write(f"- {result}\n")
 
-                results = []
-                for learning_goal in st.session_state["learning_goals"].split("\n\n"):
-                    search_results = query_pinecone(
-                        index=index,
-                        encoded_query=get_embedding(learning_goal),
-                        filters={
-                            "source": {"$eq": "dm"},
-                            "age_group": {"$in": [age_groups]},
-                            "type_": {"$eq": "examples"},
-                        },
-                        top_n=n_examples,
-                    )
-                    results.extend(search_results)
+                results = search(
+                    index=index,
+                    queries=st.session_state["learning_goals"].split("\n\n"),
+                    filters={
+                        "source": {"$eq": "dm"},
+                        "age_group": {"$in": [age_groups]},
+                        "type_": {"$eq": "examples"},
+                    },
+                    top_k=n_examples,
+                    key=lambda result: result["metadata"]["text"],
+                    mmr_k=n_examples,
+                    cache=get_retrieval_cache(),
+                    namespace="dm",
+                )
                 areas_of_learning = [result["metadata"]["areas_of_learning"] for result in results]
-                results = list(set([result["metadata"]["text"] for result in results]))
-                idx = sample_docs(num_docs=len(results), n=n_examples)
-                results = [results[i] for i in idx]
+                results = [result["metadata"]["text"] for result in results]
                 st.session_state["examples"] = "\n\n".join(results)
 
     if st.session_state["examples"]:
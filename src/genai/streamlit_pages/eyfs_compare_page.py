@@ -4,6 +4,7 @@ from genai.eyfs import TextGenerator
 from genai.eyfs import get_embedding
 from genai.streamlit_pages.eyfs_kb_bbc_page import get_index
 from genai.streamlit_pages.eyfs_kb_bbc_page import query_pinecone
+from genai.streamlit_pages.utils import get_retrieval_cache
 from genai.utils import read_json
 
 
@@ -100,8 +101,9 @@ def eyfs_compare() -> None:
                     index,
                     encoded_query,
                     areas_of_learning=areas_of_learning,
-                    top_n=4,
+                    top_n=10,
                     max_n=4,
+                    cache=get_retrieval_cache(),
                 )
 
             with st.spinner("Generating activities..."):
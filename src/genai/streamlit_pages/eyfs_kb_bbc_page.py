@@ -1,12 +1,16 @@
+from typing import Optional
+
 import pinecone
 import streamlit as st
 
 from genai import MessageTemplate
 from genai.eyfs import TextGenerator
 from genai.eyfs import get_embedding
+from genai.retrieval import mmr_rerank
+from genai.retrieval_cache import RetrievalCache
 from genai.streamlit_pages.utils import get_index
+from genai.streamlit_pages.utils import get_retrieval_cache
 from genai.streamlit_pages.utils import reset_state
-from genai.streamlit_pages.utils import sample_docs
 from genai.utils import read_json
 
 
@@ -98,8 +102,9 @@ def eyfs_kb_bbc(index_name: str = "eyfs-index") -> None:
                     index,
                     encoded_query,
                     areas_of_learning=areas_of_learning,
-                    top_n=4,
+                    top_n=10,
                     max_n=4,
+                    cache=get_retrieval_cache(),
                 )
 
                 if "similar_docs" not in st.session_state:
@@ -153,6 +158,7 @@ def query_pinecone(
     areas_of_learning: list,
     top_n: int = 4,
     max_n: int = 4,
+    cache: Optional[RetrievalCache] = None,
 ) -> list:
     """Query the pinecone index.
 
@@ -171,7 +177,10 @@ def query_pinecone(
         Number of results to return.
 
     max_n
-        Maximum number of results to keep as prompt examples.
+        Maximum number of results to keep as prompt examples, picked with maximal marginal relevance.
+
+    cache
+        Cache of the matches of the query.
 
     Returns
     -------
@@ -180,18 +189,28 @@ def query_pinecone(
 
 
     """
-    results = index.query(
-        vector=encoded_query,
-        top_k=top_n,
-        include_metadata=True,
-        filter={
-            "areas_of_learning": {"$in": areas_of_learning},
-            "source": {"$eq": "BBC"},
-        },
-    )
-
-    results = results["matches"]
-    # Subset docs to fit the prompt length
-    idx = sample_docs(len(results), max_n)
-
-    return [results[i] for i in idx]
+    filter = {
+        "areas_of_learning": {"$in": areas_of_learning},
+        "source": {"$eq": "BBC"},
+    }
+    cached = None
+    if cache is not None:
+        key = cache.make_key(index, encoded_query, filter=filter, top_k=top_n, include_values=True, namespace="BBC")
+        cached = cache.get(key)
+
+    if cached is not None:
+        matches = cached["matches"]
+    else:
+        matches = index.query(
+            vector=encoded_query,
+            top_k=top_n,
+            include_metadata=True,
+            include_values=True,
+            filter=filter,
+            namespace="BBC",
+        )["matches"]
+        if cache is not None:
+            cache.set(key, matches)
+
+    # Keep relevant but diverse docs to fit the prompt length
+    return mmr_rerank(encoded_query, matches, max_n)
@@ -1,8 +1,10 @@
 import json
+import os
 import uuid
 
 from datetime import datetime
 
+import pinecone
 import s3fs
 import streamlit as st
 
@@ -11,11 +13,14 @@ from streamlit_feedback import streamlit_feedback
 
 from genai.eyfs import TextGenerator
 from genai.eyfs import get_embedding
-from genai.message_history import InMemoryMessageHistory
+from genai.message_history import SummaryMessageHistory
 from genai.prompt_template import FunctionTemplate
 from genai.prompt_template import MessageTemplate
+from genai.retrieval import hybrid_search
+from genai.semantic_cache import SemanticCache
+from genai.streamlit_pages.utils import get_bm25_index
 from genai.streamlit_pages.utils import get_index
-from genai.streamlit_pages.utils import query_pinecone
+from genai.streamlit_pages.utils import get_retrieval_cache
 from genai.streamlit_pages.utils import reset_state
 
 
@@ -54,6 +59,7 @@ def parenting_chatbot(aws_key: str, aws_secret: str, s3_path: str, sidebar: bool
     selected_model = "gpt-3.5-turbo"
     temperature = 0.6
     pinecone_index = get_index(index_name="eyfs-index")
+    semantic_cache = get_semantic_cache()
 
     if sidebar:
         with st.sidebar:
@@ -73,7 +79,8 @@ def parenting_chatbot(aws_key: str, aws_secret: str, s3_path: str, sidebar: bool
 
     # st.session_state["memory"] controls the flow to OpenAI and logging
     if "memory" not in st.session_state:
-        st.session_state["memory"] = InMemoryMessageHistory()
+        # Turns that no longer fit in the prompt are summarised in the background
+        st.session_state["memory"] = SummaryMessageHistory()
         st.session_state["memory"].add_message(system_message.to_prompt())
 
     # st.session_state["messages"] shows the conversation in the UI
@@ -93,35 +100,25 @@ def parenting_chatbot(aws_key: str, aws_secret: str, s3_path: str, sidebar: bool
         with st.chat_message("user"):
             st.markdown(prompt)
 
-        # Search the vector index
-        search_results = query_pinecone(
-            index=pinecone_index,
-            encoded_query=get_embedding(prompt),
-            top_n=3,
-            filters={
-                "source": {"$eq": "nhs_full_page"},
-            },
-        )
-
-        nhs_texts = []
-        nhs_urls = []
-        for result in search_results:
-            pred = TextGenerator.generate(
-                temperature=0.0,
-                messages=[filter_refs_system_message, filter_refs_user_message],
-                message_kwargs={"text": result["metadata"]["text"], "question": prompt},
-                functions=[filter_refs_function.to_prompt()],
-                function_call={"name": filter_refs_function.name},
+        # Serve the stored answer of a similar question or search the vector index. Answers depend on the
+        # conversation, so only opening questions are looked up and stored, and no user sees another's history
+        first_turn = len(st.session_state["memory"]) == 1
+        encoded_query = get_embedding(prompt)
+        cached = semantic_cache.lookup(encoded_query) if first_turn else None
+        if cached:
+            nhs_texts = cached["context"]
+            nhs_urls = cached["references"]
+        else:
+            nhs_texts, nhs_urls = retrieve_references(
+                pinecone_index,
+                prompt,
+                encoded_query,
+                filter_refs_function,
+                filter_refs_system_message,
+                filter_refs_user_message,
             )
 
-            pred = json.loads(pred["choices"][0]["message"]["function_call"]["arguments"])["prediction"]
-
-            if pred:
-                nhs_texts.append(result["metadata"]["text"])
-                nhs_urls.append(result["metadata"]["url"])
-
-        if nhs_texts:
-            nhs_texts = "\n===\n".join(nhs_texts)
+        question = prompt
 
         # Log message for the UI before adding the references
         st.session_state["messages"].append({"role": "user", "content": prompt})
@@ -143,15 +140,21 @@ def parenting_chatbot(aws_key: str, aws_secret: str, s3_path: str, sidebar: bool
             message_placeholder = st.empty()
             full_response = ""
 
-            for response in TextGenerator.generate(
-                model=selected_model,
-                temperature=temperature,
-                messages=st.session_state["memory"].get_messages(),
-                message_kwargs=None,
-                stream=True,
-            ):
-                full_response += response.choices[0].delta.get("content", "")
-                message_placeholder.markdown(full_response + "▌")
+            if cached:
+                full_response = cached["answer"]
+            else:
+                for response in TextGenerator.generate(
+                    model=selected_model,
+                    temperature=temperature,
+                    messages=st.session_state["memory"].get_messages(),
+                    message_kwargs=None,
+                    stream=True,
+                ):
+                    full_response += response.choices[0].delta.get("content", "")
+                    message_placeholder.markdown(full_response + "▌")
+
+                if first_turn:
+                    semantic_cache.add(question, encoded_query, full_response, references=nhs_urls, context=nhs_texts)
 
             # Submit feedback
             streamlit_feedback(
@@ -172,6 +175,16 @@ def parenting_chatbot(aws_key: str, aws_secret: str, s3_path: str, sidebar: bool
         st.session_state["messages"].append({"role": "assistant", "content": full_response})
         st.session_state["memory"].add_message({"role": "assistant", "content": full_response})
 
+        if first_turn:
+            write_to_s3(
+                aws_key,
+                aws_secret,
+                f"{s3_path}/session-logs/{st.session_state['session_uuid']}",
+                "semantic_cache",
+                {"hit": cached is not None, **semantic_cache.metrics()},
+                how="a",
+            )
+
         write_to_s3(
             aws_key,
             aws_secret,
@@ -200,6 +213,91 @@ def parenting_chatbot(aws_key: str, aws_secret: str, s3_path: str, sidebar: bool
         )
 
 
+@st.cache_resource
+def get_semantic_cache() -> SemanticCache:
+    """Return and persist the semantic cache of answered questions."""
+    return SemanticCache(
+        path=os.environ.get("SEMANTIC_CACHE_PATH"),
+        threshold=float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", 0.95)),
+    )
+
+
+def retrieve_references(
+    pinecone_index: pinecone.index.Index,
+    prompt: str,
+    encoded_query: list,
+    filter_refs_function: FunctionTemplate,
+    filter_refs_system_message: MessageTemplate,
+    filter_refs_user_message: MessageTemplate,
+) -> tuple:
+    """Search the vector index and keep the NHS pages that an LLM judges relevant to the prompt.
+
+    Parameters
+    ----------
+    pinecone_index
+        Pinecone index.
+
+    prompt
+        The user's message.
+
+    encoded_query
+        The embedding of the user's message.
+
+    filter_refs_function
+        Function used to classify a page as relevant or not.
+
+    filter_refs_system_message
+        System message of the relevance classifier.
+
+    filter_refs_user_message
+        User message of the relevance classifier.
+
+    Returns
+    -------
+    nhs_texts
+        The relevant texts joined in a single string.
+
+    nhs_urls
+        The URLs of the relevant texts.
+
+    """
+    # Fuse with lexical matches so that pages naming specific terms (e.g. "colic") are not missed
+    search_results = hybrid_search(
+        index=pinecone_index,
+        bm25_index=get_bm25_index(index_name="eyfs-index"),
+        text=prompt,
+        vector=encoded_query,
+        top_k=3,
+        filter={
+            "source": {"$eq": "nhs_full_page"},
+        },
+        namespace="nhs_full_page",
+        cache=get_retrieval_cache(),
+    )
+
+    nhs_texts = []
+    nhs_urls = []
+    for result in search_results:
+        pred = TextGenerator.generate(
+            temperature=0.0,
+            messages=[filter_refs_system_message, filter_refs_user_message],
+            message_kwargs={"text": result["metadata"]["text"], "question": prompt},
+            functions=[filter_refs_function.to_prompt()],
+            function_call={"name": filter_refs_function.name},
+        )
+
+        pred = json.loads(pred["choices"][0]["message"]["function_call"]["arguments"])["prediction"]
+
+        if pred:
+            nhs_texts.append(result["metadata"]["text"])
+            nhs_urls.append(result["metadata"]["url"])
+
+    if nhs_texts:
+        nhs_texts = "\n===\n".join(nhs_texts)
+
+    return nhs_texts, nhs_urls
+
+
 def write_to_s3(key: str, secret: str, s3_path: str, filename: str, data: dict, how: str = "a") -> None:
     """Write data to a jsonl file in S3.
 
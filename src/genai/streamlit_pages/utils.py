@@ -1,14 +1,15 @@
 import os
-import random
 
-from typing import List
 from typing import Optional
 from typing import Union
 
 import pinecone
 import streamlit as st
 
-from genai.vector_index import PineconeIndex
+from genai.bm25 import BM25Index
+from genai.local_index import LocalIndex
+from genai.retrieval_cache import RetrievalCache
+from genai.vector_index import get_vector_index
 
 
 def reset_state(key: Optional[str] = None) -> None:
@@ -38,61 +39,21 @@ def reset_state(key: Optional[str] = None) -> None:
 
 
 @st.cache_resource
-def get_index(index_name: str) -> pinecone.index.Index:
-    """Return and persist the pinecone index."""
-    conn = PineconeIndex(api_key=os.environ["PINECONE_API_KEY"], environment=os.environ["PINECONE_REGION"])
+def get_index(index_name: str) -> Union[pinecone.index.Index, LocalIndex]:
+    """Return and persist the index of the backend set with VECTOR_INDEX_BACKEND (Pinecone by default)."""
+    conn = get_vector_index(api_key=os.environ.get("PINECONE_API_KEY"), environment=os.environ.get("PINECONE_REGION"))
     index = conn.connect(index_name=index_name)
     return index
 
 
-def sample_docs(num_docs: int, n: int) -> Union[List[int], ValueError]:
-    """Sample docs (without replacement)."""
-    try:
-        return random.sample(range(num_docs), n)
-    except ValueError:
-        try:
-            return random.sample(range(num_docs), num_docs)
-        except ValueError as e:
-            raise ValueError(f"Cannot sample docs: {e}")
-
-
-def query_pinecone(
-    index: pinecone.index.Index,
-    encoded_query: list,
-    filters: dict,
-    top_n: int = 5,
-    max_n: int = 10,
-) -> list:
-    """Query the pinecone index.
-
-    Parameters
-    ----------
-    index
-        Pinecone index.
-
-    query
-        Query vector to search for.
-
-    areas_of_learning
-        Areas of learning to filter by.
-
-    top_n
-        Number of results to return.
-
-    max_n
-        Maximum number of results to keep as prompt examples.
-
-    Returns
-    -------
-    docs
-        List of documents.
+@st.cache_resource
+def get_bm25_index(index_name: str) -> Optional[BM25Index]:
+    """Return and persist the BM25 index of the vector index, or None if it was not built."""
+    path = os.path.join(os.environ.get("BM25_INDEX_PATH", ".cache/bm25"), f"{index_name}.npz")
+    return BM25Index.load(path) if os.path.exists(path) else None
 
-    """
-    results = index.query(
-        vector=encoded_query,
-        top_k=top_n,
-        include_metadata=True,
-        filter=filters,
-    )
 
-    return results["matches"]
+@st.cache_resource
+def get_retrieval_cache() -> RetrievalCache:
+    """Return and persist the cache of vector search results shared by the pages."""
+    return RetrievalCache(path=os.environ.get("RETRIEVAL_CACHE_PATH"))
@@ -1,13 +1,33 @@
+import logging
 import os
 import time
 
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+from typing import Dict
+from typing import List
 from typing import Optional
+from typing import Union
 
+import numpy as np
 import pinecone
 
+from tenacity import before_sleep_log
+from tenacity import retry
+from tenacity import stop_after_attempt
+from tenacity import wait_exponential
+
+from genai.index_manifest import IndexManifest
+from genai.index_manifest import legacy_manifest
+from genai.index_manifest import plan_upserts
+from genai.index_snapshot import IndexSnapshot
+from genai.local_index import LocalVectorIndex
 from genai.utils import batch
 
 
+logger = logging.getLogger(__name__)
+
+
 class PineconeIndex:
     """Wrap the Pinecone API.
 
@@ -50,6 +70,12 @@ class PineconeIndex:
         docs: list,
         batch_size: int = 100,
         delete_if_exists: bool = False,
+        manifest: Optional[str] = None,
+        embed: Optional[Callable[[List[dict]], np.ndarray]] = None,
+        max_workers: int = 8,
+        ready_timeout: float = 300.0,
+        namespace: Optional[str] = None,
+        legacy_filter: Optional[dict] = None,
         **kwargs,
     ) -> None:
         """Build the index (if it does not exist) and add docs.
@@ -77,12 +103,40 @@ class PineconeIndex:
         delete_if_exists
             Whether to delete the index if it already exists.
 
+        manifest
+            Name of a manifest recording the (id, content hash) of the docs, e.g. "dm". When set, only new or
+            changed docs are embedded and upserted, and docs that were removed since the last build are deleted.
+            Use stable ids, e.g. from `genai.index_manifest.content_id`. Each namespace has its own manifests;
+            the first build of a namespace moves the docs of the same manifest out of the default namespace.
+
+        embed
+            Function returning the embeddings of a list of metadata, for docs given without values.
+
+        max_workers
+            Number of batches upserted concurrently.
+
+        ready_timeout
+            Seconds to wait for the index to be ready.
+
+        namespace
+            Namespace of the docs, e.g. their source. With `delete_if_exists`, only this namespace is cleared,
+            so one corpus can be rebuilt without touching the others.
+
+        legacy_filter
+            Metadata filter of docs an earlier build stored in the default namespace, e.g.
+            `{"source": {"$eq": "BBC"}}`. They are deleted from it once the docs are in `namespace`. Builders
+            with a manifest do not need it, their docs are moved on the first build of the namespace.
+
         """
-        if delete_if_exists:
+        if delete_if_exists and not namespace:
             self.delete(index_name)
 
         if index_name in pinecone.list_indexes():
             index = self.connect(index_name)
+            if delete_if_exists and namespace:
+                index.delete(delete_all=True, namespace=namespace)
+                if manifest is not None:
+                    IndexManifest(index_name, manifest, namespace=namespace).delete()
         else:
             pinecone.create_index(
                 index_name,
@@ -93,16 +147,181 @@ class PineconeIndex:
 
             index = self.connect(index_name)
 
-        # Potential fix to avoid error 403
-        time.sleep(30)
+        # Docs moving from the default namespace to their own are upserted again and removed from the default one
+        legacy = legacy_manifest(index_name, manifest, namespace) if manifest else None
+        docs, to_delete, index_manifest, hashes = plan_upserts(index_name, docs, manifest, embed, namespace=namespace)
+
+        self.wait_until_ready(index_name, timeout=ready_timeout)
+
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # Consume the results to raise the first error once the retries are exhausted
+            list(executor.map(lambda docs: self._upsert_batch(index, docs, namespace), batch(docs, batch_size)))
+        elapsed = max(time.monotonic() - start, 1e-9)
+        print(  # noqa: T001
+            f"Upserted {len(docs)} vectors to {index_name} in {elapsed:.1f}s ({len(docs) / elapsed:.0f} vectors/s)"
+        )
+
+        for batched_ids in batch(to_delete, 1000):
+            index.delete(ids=batched_ids, namespace=namespace)
+
+        if legacy is not None:
+            for batched_ids in batch(list(legacy.hashes), 1000):
+                index.delete(ids=batched_ids)
+        if legacy_filter is not None and namespace:
+            index.delete(filter=legacy_filter)
 
-        for batched_docs in batch(docs, batch_size):
-            index.upsert(batched_docs)
+        if index_manifest is not None:
+            index_manifest.save(hashes)
+        if legacy is not None:
+            legacy.delete()
+
+    def export_snapshot(
+        self, index_name: str, path: str, ids: Optional[List[str]] = None, batch_size: int = 200, max_workers: int = 8
+    ) -> None:
+        """Fetch the vectors of the index and save them with its manifests to a snapshot file.
+
+        Parameters
+        ----------
+        index_name
+            Name of the index.
+
+        path
+            Path of the snapshot.
+
+        ids
+            Ids to export, fetched from every namespace of the index. Pinecone cannot list the ids of an index, so
+            they default to the ids of the manifests of each namespace. A warning is logged for the vectors of a
+            namespace that are left out, e.g. of a builder that records no manifest.
+
+        batch_size
+            Number of ids fetched per request.
+
+        max_workers
+            Number of concurrent fetch requests.
+
+        """
+        manifests = IndexManifest.load_all(index_name)
+        index = self.connect(index_name)
+        description = pinecone.describe_index(index_name)
+        counts = {
+            name: namespace["vector_count"] for name, namespace in index.describe_index_stats()["namespaces"].items()
+        }
+        if ids is None:
+            # Manifests of a namespace are named "<namespace>/<name>", those of the default namespace have no prefix
+            ids_by_namespace: Dict[str, List[str]] = {}
+            for name, hashes in manifests.items():
+                ids_by_namespace.setdefault(name.rpartition("/")[0], []).extend(hashes)
+            if not ids_by_namespace:
+                raise ValueError(f"Index {index_name} has no manifest, pass the ids to export.")
+        else:
+            ids_by_namespace = {namespace: list(ids) for namespace in counts}
+
+        requests = [
+            (namespace, batched_ids)
+            for namespace, namespace_ids in ids_by_namespace.items()
+            if namespace in counts
+            for batched_ids in batch(sorted(set(namespace_ids)), batch_size)
+        ]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            responses = executor.map(
+                lambda request: (request[0], index.fetch(ids=request[1], namespace=request[0]).to_dict()), requests
+            )
+            rows = [
+                (namespace, id_, vector)
+                for namespace, response in responses
+                for id_, vector in sorted(response["vectors"].items())
+            ]
+
+        for namespace, count in counts.items():
+            exported = sum(row[0] == namespace for row in rows)
+            if exported < count:
+                logger.warning(
+                    f"Exported {exported} of the {count} vectors of namespace '{namespace}' of {index_name}, "
+                    "pass the ids of the others or record them in a manifest to export them."
+                )
+
+        snapshot = IndexSnapshot(
+            ids=[id_ for _, id_, _ in rows],
+            vectors=np.array([vector["values"] for _, _, vector in rows], dtype=np.float32),
+            metadata=[vector.get("metadata") or {} for _, _, vector in rows],
+            dimension=description.dimension,
+            metric=description.metric,
+            metadata_config=description.metadata_config or {},
+            manifests=manifests,
+            namespaces=[namespace for namespace, _, _ in rows],
+        )
+        snapshot.save(path)
+        logger.info(f"Exported {len(rows)} vectors from {index_name} to {path}")
+
+    def import_snapshot(
+        self,
+        index_name: str,
+        path: str,
+        batch_size: int = 100,
+        delete_if_exists: bool = False,
+        max_workers: int = 8,
+        **kwargs,
+    ) -> None:
+        """Upsert a snapshot file into the index, creating it if needed, and restore its manifests."""
+        snapshot = IndexSnapshot.load(path)
+        if delete_if_exists:
+            self.delete(index_name)
+
+        for namespace, part in snapshot.split().items():
+            self.build_and_upsert(
+                index_name=index_name,
+                dimension=snapshot.dimension,
+                metadata_config=snapshot.metadata_config,
+                metric=snapshot.metric,
+                docs=list(part.docs()),
+                batch_size=batch_size,
+                max_workers=max_workers,
+                namespace=namespace or None,
+            )
+        IndexManifest.restore_all(index_name, snapshot.manifests)
+
+    @staticmethod
+    def wait_until_ready(index_name: str, timeout: float = 300.0) -> None:
+        """Poll the index status until it is ready, backing off up to 5 seconds between checks."""
+        deadline = time.monotonic() + timeout
+        interval = 0.5
+        while not pinecone.describe_index(index_name).status.get("ready"):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Index {index_name} is not ready after {timeout}s.")
+            time.sleep(interval)
+            interval = min(interval * 2, 5.0)
+
+    @staticmethod
+    @retry(
+        reraise=True,
+        stop=stop_after_attempt(5),
+        wait=wait_exponential(multiplier=1, min=1, max=30),
+        before_sleep=before_sleep_log(logger, logging.WARNING),
+    )
+    def _upsert_batch(index: pinecone.index.Index, docs: list, namespace: Optional[str] = None) -> None:
+        """Upsert a batch of docs, retrying transient errors such as a 403 right after creating the index."""
+        index.upsert(docs, namespace=namespace)
 
     @staticmethod
     def delete(index_name: str) -> None:
         """Delete the index."""
+        IndexManifest.delete_all(index_name)
         try:
             pinecone.delete_index(index_name)
         except Exception as e:
             print(e)  # noqa: T001
+
+
+def get_vector_index(
+    api_key: Optional[str] = None,
+    environment: Optional[str] = None,
+) -> Union[PineconeIndex, LocalVectorIndex]:
+    """Return the index backend selected with the VECTOR_INDEX_BACKEND environment variable.
+
+    Set it to "local" to build and query in-process indexes stored in LOCAL_INDEX_PATH instead of Pinecone.
+    """
+    if os.environ.get("VECTOR_INDEX_BACKEND", "pinecone") == "local":
+        return LocalVectorIndex(os.environ.get("LOCAL_INDEX_PATH", ".cache/vector_indexes"))
+
+    return PineconeIndex(api_key=api_key, environment=environment)
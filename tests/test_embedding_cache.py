@@ -0,0 +1,20 @@
+import numpy as np
+
+from genai.embedding_cache import EmbeddingCache
+
+
+def test_put_many_after_partial_row(tmp_path):
+    cache = EmbeddingCache(str(tmp_path))
+    cache.put_many(["a"], np.array([[1.0, 2.0, 3.0]]))
+
+    # A writer crashed halfway through a row
+    with open(tmp_path / "text-embedding-ada-002.f32", "ab") as f:
+        f.write(b"\x00" * 5)
+
+    cache = EmbeddingCache(str(tmp_path))
+    np.testing.assert_array_equal(cache.get("a"), [1.0, 2.0, 3.0])
+    cache.put_many(["b"], np.array([[4.0, 5.0, 6.0]]))
+
+    cache = EmbeddingCache(str(tmp_path))
+    np.testing.assert_array_equal(cache.get("a"), [1.0, 2.0, 3.0])
+    np.testing.assert_array_equal(cache.get("b"), [4.0, 5.0, 6.0])
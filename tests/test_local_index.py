@@ -0,0 +1,32 @@
+import numpy as np
+
+from genai.local_index import LocalIndex
+
+
+def _index(tmp_path) -> LocalIndex:
+    return LocalIndex(str(tmp_path / "index"), dimension=2, metric="cosine", metadata_config={})
+
+
+def test_upsert_new_ids_in_one_batch(tmp_path):
+    index = _index(tmp_path)
+    index.upsert([("a", [1.0, 0.0], {"n": 1}), ("b", [0.0, 1.0], {"n": 2}), ("c", [1.0, 1.0], {"n": 3})])
+
+    vectors = index.fetch(["b", "c"])["vectors"]
+    assert vectors["b"]["metadata"] == {"n": 2}
+    assert vectors["c"]["metadata"] == {"n": 3}
+    np.testing.assert_allclose(vectors["c"]["values"], [1.0, 1.0])
+
+
+def test_upsert_updates_and_adds_in_one_batch(tmp_path):
+    index = _index(tmp_path)
+    index.upsert([("a", [1.0, 0.0], {"n": 1})])
+    index.upsert([("b", [0.0, 1.0], {"n": 2}), ("a", [1.0, 0.0], {"n": 1, "new": "x"}), ("c", [1.0, 1.0], {})])
+
+    assert all(len(column) == len(index) for column in index.metadata.values())
+    vectors = index.fetch(["a", "b", "c"])["vectors"]
+    assert vectors["a"]["metadata"] == {"n": 1, "new": "x"}
+    assert vectors["b"]["metadata"]["n"] == 2
+
+    index.delete(ids=["b"])
+    assert sorted(index.fetch(["a", "b", "c"])["vectors"]) == ["a", "c"]
+    np.testing.assert_allclose(index.fetch(["c"])["vectors"]["c"]["values"], [1.0, 1.0])
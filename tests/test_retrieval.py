@@ -0,0 +1,15 @@
+from genai.bm25 import BM25Index
+from genai.local_index import LocalIndex
+from genai.retrieval import hybrid_search
+
+
+def test_hybrid_search_drops_lexical_matches_missing_from_the_vector_index(tmp_path):
+    index = LocalIndex(str(tmp_path / "index"), dimension=2, metric="cosine", metadata_config={})
+    index.upsert([("a", [1.0, 0.0], {"text": "colic in babies"}), ("b", [0.0, 1.0], {"text": "sleep"})])
+    bm25_index = BM25Index.build(
+        ["a", "stale"], ["colic in babies", "colic and crying"], [{"text": "colic in babies"}, {"text": "old"}]
+    )
+
+    matches = hybrid_search(index, bm25_index, "colic", [0.0, 1.0], top_k=5)
+
+    assert sorted(match["id"] for match in matches) == ["a", "b"]
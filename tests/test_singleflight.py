@@ -0,0 +1,39 @@
+from genai.singleflight import SingleFlight
+
+
+def _upstream(calls: list, closed: list):
+    calls.append(1)
+    try:
+        yield from "abc"
+    finally:
+        closed.append(1)
+
+
+def test_abandoned_stream_is_closed_and_forgotten():
+    sf = SingleFlight()
+    calls, closed = [], []
+
+    stream = sf.do_stream("key", lambda: _upstream(calls, closed))
+    assert next(stream) == "a"
+    del stream
+
+    assert "key" not in sf._streams
+    assert closed == [1]
+    assert list(sf.do_stream("key", lambda: _upstream(calls, closed))) == ["a", "b", "c"]
+    assert len(calls) == 2
+
+
+def test_stream_continues_while_a_subscriber_remains():
+    sf = SingleFlight()
+    calls, closed = [], []
+
+    first = sf.do_stream("key", lambda: _upstream(calls, closed))
+    second = sf.do_stream("key", lambda: _upstream(calls, closed))
+    assert next(first) == "a"
+    assert next(second) == "a"
+    first.close()
+
+    assert closed == []
+    assert list(second) == ["b", "c"]
+    assert len(calls) == 1
+    assert "key" not in sf._streams
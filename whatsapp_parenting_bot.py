@@ -1,7 +1,11 @@
 import json
+import logging
 import os
 
+from functools import lru_cache
 from threading import Thread
+from typing import List
+from typing import Union
 
 import openai
 import s3fs
@@ -14,14 +18,22 @@ from twilio.twiml.messaging_response import MessagingResponse
 
 from genai.eyfs import TextGenerator
 from genai.eyfs import get_embedding
-from genai.message_history import InMemoryMessageHistory
+from genai.message_history import MessageArchive
+from genai.message_history import SQLiteMessageHistory
+from genai.message_history import SummaryMessageHistory
+from genai.message_history import get_encoding
 from genai.prompt_template import FunctionTemplate
 from genai.prompt_template import MessageTemplate
+from genai.retrieval import hybrid_search
+from genai.semantic_cache import SemanticCache
+from genai.streamlit_pages.utils import get_bm25_index
 from genai.streamlit_pages.utils import get_index
-from genai.streamlit_pages.utils import query_pinecone
+from genai.streamlit_pages.utils import get_retrieval_cache
 
 
 load_dotenv()
+# Report the semantic cache metrics in the app logs
+logging.basicConfig(level=logging.INFO)
 # Twilio settings
 client = Client(os.environ["TWILIO_ACCOUNT_SID"], os.environ["TWILIO_AUTH_TOKEN"])
 # OpenAI model
@@ -32,18 +44,32 @@ openai.api_key = os.environ["OPENAI_API_KEY"]
 AWS_KEY = os.environ["AWS_ACCESS_KEY_ID"]
 AWS_SECRET = os.environ["AWS_SECRET_ACCESS_KEY"]
 S3_PATH = os.environ["S3_BUCKET"] + "/prototypes/whatsapp-bot/logs"
+# Message histories are read and written locally, S3 keeps an asynchronous copy
+MESSAGE_HISTORY_PATH = os.environ.get("MESSAGE_HISTORY_PATH", ".cache/message_history.sqlite")
+# Older turns are kept as a running summary. The references are cut so that the current turn always fits
+MAX_HISTORY_TOKENS = 4096
+MAX_REFERENCE_TOKENS = 2048
 
 pinecone_index = get_index(index_name="eyfs-index")
+bm25_index = get_bm25_index(index_name="eyfs-index")
 system_message = MessageTemplate.load("src/genai/parenting_chatbot/prompts/system.json")
 filter_refs_function = FunctionTemplate.load("src/genai/parenting_chatbot/prompts/filter_refs_function.json")
 filter_refs_user_message = MessageTemplate.load("src/genai/parenting_chatbot/prompts/filter_refs_user.json")
 filter_refs_system_message = MessageTemplate.load("src/genai/parenting_chatbot/prompts/filter_refs_system.json")
 
+# Answers to previously asked questions, served when a new question is similar enough
+semantic_cache = SemanticCache(
+    path=os.environ.get("SEMANTIC_CACHE_PATH"),
+    threshold=float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", 0.95)),
+)
+
 # Initiate the Flask app
 app = Flask(__name__)
 
 
-def write_to_s3(key: str, secret: str, s3_path: str, filename: str, data: dict, how: str = "a") -> None:
+def write_to_s3(
+    key: str, secret: str, s3_path: str, filename: str, data: Union[dict, List[dict]], how: str = "a"
+) -> None:
     """
     Write data to a jsonl file in S3.
 
@@ -52,13 +78,21 @@ def write_to_s3(key: str, secret: str, s3_path: str, filename: str, data: dict,
         secret (str): AWS secret access key.
         s3_path (str): S3 bucket path.
         filename (str): Name of the file to write to.
-        data (dict): Data to write to the file.
+        data (Union[dict, List[dict]]): Data to write to the file, one line per dictionary.
         how (str, optional): How to write to the file. Default is "a" for append. Use "w" to overwrite.
 
     """
     fs = s3fs.S3FileSystem(key=key, secret=secret)
     with fs.open(f"{s3_path}/{filename}.jsonl", how) as f:
-        f.write(f"{json.dumps(data)}\n")
+        f.write("".join(f"{json.dumps(row)}\n" for row in ([data] if isinstance(data, dict) else data)))
+
+
+def archive_messages(sender_contact: str, messages: List[dict]) -> None:
+    """Overwrite the S3 copy of a sender's message history."""
+    write_to_s3(AWS_KEY, AWS_SECRET, f"{S3_PATH}/{sender_contact}", "messages", messages, how="w")
+
+
+message_archive = MessageArchive(archive_messages)
 
 
 def read_from_s3(key: str, secret: str, s3_path: str, filename: str) -> list:
@@ -84,18 +118,24 @@ def read_from_s3(key: str, secret: str, s3_path: str, filename: str) -> list:
     return data_list
 
 
-def fetch_message_history(sender_contact: str, create_new: bool = True) -> InMemoryMessageHistory:
+def fetch_message_history(sender_contact: str, create_new: bool = True) -> SQLiteMessageHistory:
     """
-    Find a folder on s3 corresponding to the sender; if doesn't exist, create a new folder
+    Open the sender's message history from the local store, restoring it from S3 the first time it is used
+    on this machine; if the sender has no history on S3 either, start a new one
 
     Args:
         sender_contact (str): Sender's contact, follows a format 'whatsapp:+<phone number>'
-        create_new (bool, optional): Whether to create a new folder if one doesn't exist. Defaults to True.
+        create_new (bool, optional): Whether to create a new history if one doesn't exist. Defaults to True.
 
     Returns:
-        InMemoryMessageHistory: Message history
+        SQLiteMessageHistory: Message history
     """
-    message_history = InMemoryMessageHistory()
+    message_history = SQLiteMessageHistory(
+        sender_contact, path=MESSAGE_HISTORY_PATH, model_name=LLM, archive=message_archive
+    )
+    if len(message_history):
+        return message_history
+
     try:
         messages = read_from_s3(
             AWS_KEY,
@@ -103,24 +143,32 @@ def fetch_message_history(sender_contact: str, create_new: bool = True) -> InMem
             f"{S3_PATH}/{sender_contact}",
             "messages",
         )
-        for message in messages:
-            message_history.add_message(message)
+        message_history.add_messages(messages, archive=False)
         return message_history
     except FileNotFoundError as e:
         if create_new:
-            write_to_s3(
-                AWS_KEY,
-                AWS_SECRET,
-                f"{S3_PATH}/{sender_contact}",
-                "messages",
-                {"role": "system", "content": "Welcome to the Parenting Chatbot!"},
-                how="w",
-            )
+            message_history.add_message({"role": "system", "content": "Welcome to the Parenting Chatbot!"})
             return message_history
         else:
             raise e
 
 
+@lru_cache(maxsize=1024)
+def fetch_summary_history(sender_contact: str) -> SummaryMessageHistory:
+    """
+    Return the sender's message history, summarising the turns that no longer fit in the prompt
+
+    The summary is kept in memory for the most recent senders and rebuilt in the background after a restart.
+
+    Args:
+        sender_contact (str): Sender's contact, follows a format 'whatsapp:+<phone number>'
+
+    Returns:
+        SummaryMessageHistory: Message history
+    """
+    return SummaryMessageHistory(fetch_message_history(sender_contact))
+
+
 def send_links(link: str, my_contact: str, receiver_contact: str) -> None:
     """Generate text messages and send them to a given contact
 
@@ -137,28 +185,43 @@ def send_links(link: str, my_contact: str, receiver_contact: str) -> None:
     return
 
 
-@app.route("/text", methods=["POST"])
-def text_reply() -> str:
-    """Respond to incoming messages"""
-    receiver_contact = request.form.get("To")
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """Cut a text to its first max_tokens tokens.
 
-    # Fetch message history for this sender
-    sender_contact = request.form.get("From")
-    message_history = fetch_message_history(sender_contact)
+    Args:
+        text (str): The text to cut.
+        max_tokens (int): The maximum number of tokens to keep.
+
+    Returns:
+        str: The text, or its beginning if it is longer than max_tokens.
+    """
+    encoding = get_encoding(LLM)
+    tokens = encoding.encode(text)
+    return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
 
-    # Save the incoming message to the message history
-    prompt = request.form.get("Body")
 
-    # Generate response to the message
+def retrieve_references(prompt: str, encoded_query: list) -> tuple:
+    """Search the vector index and keep the NHS pages that an LLM judges relevant to the prompt.
+
+    Args:
+        prompt (str): The user's message.
+        encoded_query (list): The embedding of the user's message.
 
-    # Search the vector index
-    search_results = query_pinecone(
+    Returns:
+        tuple: The relevant texts joined in a single string and their URLs.
+    """
+    # Fuse with lexical matches so that pages naming specific terms (e.g. "colic") are not missed
+    search_results = hybrid_search(
         index=pinecone_index,
-        encoded_query=get_embedding(prompt),
-        top_n=3,
-        filters={
+        bm25_index=bm25_index,
+        text=prompt,
+        vector=encoded_query,
+        top_k=3,
+        filter={
             "source": {"$eq": "nhs_full_page"},
         },
+        namespace="nhs_full_page",
+        cache=get_retrieval_cache(),
     )
 
     nhs_texts = []
@@ -179,39 +242,64 @@ def text_reply() -> str:
             nhs_urls.append(result["metadata"]["url"])
 
     if nhs_texts:
-        nhs_texts = "\n===\n".join(nhs_texts)
+        nhs_texts = truncate_tokens("\n===\n".join(nhs_texts), MAX_REFERENCE_TOKENS)
+
+    return nhs_texts, nhs_urls
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics() -> dict:
+    """Expose the semantic cache metrics"""
+    return semantic_cache.metrics()
+
+
+@app.route("/text", methods=["POST"])
+def text_reply() -> str:
+    """Respond to incoming messages"""
+    receiver_contact = request.form.get("To")
+
+    # Fetch message history for this sender
+    sender_contact = request.form.get("From")
+    message_history = fetch_summary_history(sender_contact)
+
+    # Save the incoming message to the message history
+    prompt = request.form.get("Body")
+
+    # Generate response to the message. Answers depend on the conversation, so only opening questions are
+    # looked up and stored, and no sender sees another's history
+    first_turn = len(message_history) == 1
+    encoded_query = get_embedding(prompt)
+    cached = semantic_cache.lookup(encoded_query) if first_turn else None
+    if cached:
+        nhs_texts = cached["context"]
+        nhs_urls = cached["references"]
+    else:
+        nhs_texts, nhs_urls = retrieve_references(prompt, encoded_query)
+
+    question = prompt
 
     # Add references to the prompt
     prompt = f"""###NHS Start for Life references###\n{nhs_texts}\n\n###User message###\n{prompt} \n\n###Additional instructions###\nAnswer in one or two sentences, not more."""  # noqa: B950
 
     message_history.add_message({"role": "user", "content": prompt})
-    write_to_s3(
-        AWS_KEY,
-        AWS_SECRET,
-        f"{S3_PATH}/{sender_contact}",
-        "messages",
-        message_history.messages[-1],
-        how="a",
-    )
 
-    response = TextGenerator.generate(
-        model=LLM,
-        temperature=TEMPERATURE,
-        messages=message_history.get_messages(),
-        message_kwargs=None,
-    )
-    response = response["choices"][0]["message"]["content"]
+    if cached:
+        response = cached["answer"]
+    else:
+        response = TextGenerator.generate(
+            model=LLM,
+            temperature=TEMPERATURE,
+            messages=message_history.get_messages(model_name=LLM, max_tokens=MAX_HISTORY_TOKENS),
+            message_kwargs=None,
+        )
+        response = response["choices"][0]["message"]["content"]
+        if first_turn:
+            semantic_cache.add(question, encoded_query, response, references=nhs_urls, context=nhs_texts)
+
+    if first_turn:
+        semantic_cache.log_metrics()
     message_history.add_message({"role": "assistant", "content": response})
 
-    # Save message history
-    write_to_s3(
-        AWS_KEY,
-        AWS_SECRET,
-        f"{S3_PATH}/{sender_contact}",
-        "messages",
-        message_history.messages[-1],
-        how="a",
-    )
     resp = MessagingResponse()
     resp.message(response)
 